@@ -0,0 +1,231 @@
+### FILE: AsyncService.py
+### AUTHOR: Salvatore Cardamone
+### DESCRIPTION: asyncio front-end to the NR LDPC chain, which micro-batches concurrent requests
+
+import asyncio
+from functools import partial
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from FecMe.NRLDPC import encode_batch, decode_batch
+
+### ====================================================================================
+###                                     Lanes
+### ====================================================================================
+
+class _Lane():
+    """Queue of pending requests of one kind, along with the function which serves a batch of
+    them and the histograms of the queue depth seen by each request on arrival and of the
+    sizes of the batches flushed.
+    """
+
+    def __init__(self, name, function):
+        """Class constructor.
+        """
+        self.name = name
+        self.function = function
+        self.queue = asyncio.Queue()
+        self.queue_depths = Counter()
+        self.batch_sizes = Counter()
+        self.task = None
+
+def _encode(requests):
+    """Encode a batch of encode requests, returning the result of each.
+    """
+    columns = {name : [request[name] for request in requests] for name in requests[0]}
+
+    return encode_batch(columns.pop('a'), columns.pop('G'), **columns)
+
+def _decode(requests, **kwargs):
+    """Decode a batch of decode requests, returning the result of each. Keyword arguments are
+    passed to the decoder.
+    """
+    columns = {name : [request[name] for request in requests] for name in requests[0]}
+    a_hat, passed, iterations = decode_batch(columns.pop('llr'), columns.pop('A'), **columns, **kwargs)
+
+    return [(a, bool(ok), int(n)) for a, ok, n in zip(a_hat, passed, iterations)]
+
+# Sentinel which tells a lane to flush what it holds and stop
+_stop = object()
+
+### ====================================================================================
+###                                     Service
+### ====================================================================================
+
+class FECService():
+    """asyncio service wrapping the NR LDPC chain. Each encode or decode call queues its
+    transport block and awaits the result. Requests are gathered into micro-batches, which are
+    flushed once they reach max_batch requests or once flush_deadline seconds have passed
+    since the first request of the batch arrived, and served by encode_batch or decode_batch
+    on an executor so that the event loop is never blocked. Up to max_in_flight batches run at
+    once. If a batch fails, its requests are retried one at a time, so that a bad request only
+    fails its own future.
+    """
+
+    def __init__(self, executor=None, max_batch=32, flush_deadline=500e-6, max_in_flight=2, **decode_kwargs):
+        """Class constructor. By default batches run on a thread pool; a process pool may be
+        given instead. Keyword arguments are passed to the decoder.
+        """
+        if max_batch < 1:
+            raise ValueError("Batches must hold at least one request")
+
+        self.executor = executor
+        self.max_batch = max_batch
+        self.flush_deadline = flush_deadline
+        self.max_in_flight = max_in_flight
+        self.decode_kwargs = decode_kwargs
+        self.lanes = {}
+        self.in_flight = set()
+        self.slots = None
+        self.closing = False
+        self.owns_executor = False
+
+    def __str__(self):
+        """String representation of FECService object.
+        """
+        return "FECService: batches of up to {0}, {1} us deadline".format(self.max_batch, self.flush_deadline * 1e6)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.stop()
+
+    async def start(self):
+        """Start flushing the encode and decode lanes on the running event loop.
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_in_flight)
+            self.owns_executor = True
+        else:
+            self.owns_executor = False
+
+        self.slots = asyncio.Semaphore(self.max_in_flight)
+        self.lanes = {'encode' : _Lane('encode', _encode), 'decode' : _Lane('decode', partial(_decode, **self.decode_kwargs))}
+        for lane in self.lanes.values():
+            lane.task = asyncio.create_task(self._flush_loop(lane))
+
+    async def stop(self):
+        """Serve every request already queued, then stop. Requests made once stopping has begun
+        are refused. Stopping a service which hasn't been started, or is already stopping or
+        stopped, does nothing.
+        """
+        if self.slots is None or self.closing:
+            return
+
+        # Refuse new requests before queuing the sentinels, since anything queued behind them
+        # would never be served
+        self.closing = True
+        for lane in self.lanes.values():
+            await lane.queue.put(_stop)
+        await asyncio.gather(*(lane.task for lane in self.lanes.values()))
+        await asyncio.gather(*self.in_flight)
+
+        self.slots = None
+        self.closing = False
+
+        if self.owns_executor:
+            self.executor.shutdown()
+            self.executor = None
+            self.owns_executor = False
+
+    async def encode(self, a, G, BGN=1, Qm=2, rv=0, NL=1, Nref=None):
+        """Encode a transport block, returning its rate-matched output; see NRLDPC.encode.
+        """
+        return await self._submit('encode', {'a' : a, 'G' : G, 'BGN' : BGN, 'Qm' : Qm, 'rv' : rv, 'NL' : NL, 'Nref' : Nref})
+
+    async def decode(self, llr, A, BGN=1, Qm=2, rv=0, NL=1, Nref=None):
+        """Decode a transport block of A bits from the LLRs of its rate-matched output,
+        returning the decoded transport block, whether it passed its CRC and the most
+        iterations spent on any of its codeblocks.
+        """
+        return await self._submit('decode', {'llr' : llr, 'A' : A, 'BGN' : BGN, 'Qm' : Qm, 'rv' : rv, 'NL' : NL, 'Nref' : Nref})
+
+    def stats(self):
+        """Return, for each lane, histograms of the queue depth found by arriving requests and
+        of the sizes of the batches flushed, as dictionaries from value to count.
+        """
+        return {name : {'queue_depths' : dict(sorted(lane.queue_depths.items())),
+                        'batch_sizes' : dict(sorted(lane.batch_sizes.items()))}
+                for name, lane in self.lanes.items()}
+
+    async def _submit(self, name, request):
+        """Queue a request on a lane and wait for its result.
+        """
+        if self.slots is None or self.closing:
+            raise RuntimeError("Service isn't running")
+
+        lane = self.lanes[name]
+        future = asyncio.get_running_loop().create_future()
+        lane.queue_depths[lane.queue.qsize()] += 1
+        await lane.queue.put((request, future))
+
+        return await future
+
+    async def _flush_loop(self, lane):
+        """Gather the requests of a lane into batches and dispatch them until told to stop.
+        """
+        loop = asyncio.get_running_loop()
+        stopping = False
+
+        while not stopping:
+            first = await lane.queue.get()
+            if first is _stop:
+                break
+
+            batch = [first]
+            deadline = loop.time() + self.flush_deadline
+            while len(batch) < self.max_batch:
+                try:
+                    item = lane.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(lane.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is _stop:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self.slots.acquire()
+            task = asyncio.create_task(self._run(lane, batch))
+            self.in_flight.add(task)
+            task.add_done_callback(self.in_flight.discard)
+
+    async def _run(self, lane, batch):
+        """Serve a batch of requests on the executor and resolve their futures.
+        """
+        loop = asyncio.get_running_loop()
+        lane.batch_sizes[len(batch)] += 1
+        function = lane.function
+
+        try:
+            requests = [request for request, _ in batch]
+            try:
+                results = await loop.run_in_executor(self.executor, function, requests)
+                outcomes = [(result, None) for result in results]
+            except Exception as error:
+                if len(batch) == 1:
+                    outcomes = [(None, error)]
+                else:
+                    outcomes = []
+                    for request in requests:
+                        try:
+                            outcomes.append(((await loop.run_in_executor(self.executor, function, [request]))[0], None))
+                        except Exception as error:
+                            outcomes.append((None, error))
+
+            for (_, future), (result, error) in zip(batch, outcomes):
+                if future.cancelled():
+                    continue
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+        finally:
+            self.slots.release()
@@ -0,0 +1,475 @@
+### FILE: BaseGraph.py
+### AUTHOR: Salvatore Cardamone
+### DESCRIPTION: NR LDPC base graphs and the quasi-cyclic parity check matrices lifted from them
+
+from os.path import abspath, dirname
+from collections import OrderedDict, namedtuple
+from threading import Lock, RLock
+from numpy import array, zeros, empty, arange, argwhere, searchsorted, roll, load, ones, flatnonzero, uint8, uint64, \
+    float32, bitwise_xor
+from scipy.sparse import csr_matrix
+
+from FecMe.PackedBits import rotate
+from FecMe.Instrumentation import register_cache
+from FecMe.Kernels import gather_xor, layer_update
+
+# Lifting sizes, Zc, arranged by lifting set. Zeros pad out the shorter sets.
+# See 38.212 Table 5.3.2-1
+lifting_sizes = array(
+    [[2,4,8,16,32,64,128,256],
+     [3,6,12,24,48,96,192,384],
+     [5,10,20,40,80,160,320,0],
+     [7,14,28,56,112,224,0,0],
+     [9,18,36,72,144,288,0,0],
+     [11,22,44,88,176,352,0,0],
+     [13,26,52,104,208,0,0,0],
+     [15,30,60,120,240,0,0,0]], dtype=int)
+lifting_sizes.setflags(write=False)
+
+# Dimensions of the two base graphs and the number of systematic columns in each.
+# See 38.212 Section 5.3.2
+base_graph_shapes = {1 : (46,68), 2 : (42,52)}
+base_graph_systematic_columns = {1 : 22, 2 : 10}
+
+def _base_graph_mask(BGs, BGN):
+    """Return a boolean mask of the populated entries in the base graph.
+    The npz file stores unpopulated entries and shifts of zero alike as zeros, so the mask is
+    the union of the nonzero entries across all eight lifting sets, plus the entries of the
+    parity part of the base graph which carry a shift of zero for every lifting set.
+    """
+    nrows, ncols = base_graph_shapes[BGN]
+    kb = base_graph_systematic_columns[BGN]
+
+    mask = zeros((nrows,ncols), dtype=bool)
+    for lifting_set in range(8):
+        mask |= BGs['BaseGraph{0}_LiftingSet{1}'.format(BGN, lifting_set)] != 0
+
+    # Double-diagonal core parity columns. See Tables 5.3.2-2 and 5.3.2-3 of 38.212
+    core_parity = {1 : [(0,0),(0,1),(1,0),(1,1),(1,2),(2,2),(2,3),(3,0),(3,3)],
+                   2 : [(0,0),(0,1),(1,1),(1,2),(2,0),(2,2),(2,3),(3,0),(3,3)]}
+    for irow, icol in core_parity[BGN]:
+        mask[irow,kb+icol] = True
+
+    # Extension parity columns form an identity below the core
+    for irow in range(4, nrows):
+        mask[irow,kb+irow] = True
+
+    return mask
+
+def load_base_graph(BGN, LiftingSet, BGs=None):
+    """Load the base graph for the given base graph number and lifting set from disk. Entries
+    of the returned base graph are shift coefficients, with -1 marking an unpopulated entry.
+    An already opened npz file can be passed in to save reopening it.
+    """
+    if BGs is None:
+        # Get the path to FecMe/FecMe so we can find the npz file
+        path = abspath(dirname(__file__))
+        BGs = load('{0}/NRLDPC_Base_Graphs.npz'.format(path))
+
+    BG = BGs['BaseGraph{0}_LiftingSet{1}'.format(BGN, LiftingSet)].copy()
+    BG[~_base_graph_mask(BGs, BGN)] = -1
+
+    return BG
+
+class LiftedGraph():
+    """Quasi-cyclic parity check matrix lifted from a base graph, held in compact form as the
+    list of its nonzero (Zc x Zc) circulants. Each circulant is a cyclically shifted identity,
+    so row k of the circulant at base graph position (row, col) with shift s has its single
+    nonzero entry in column (k + s) mod Zc.
+    See 38.212 Section 5.3.2, Item (3) for details about construction
+    """
+
+    def __init__(self, BG, Zc):
+        """Class constructor. Extract the circulant list from the base graph.
+        """
+        self.Zc = Zc
+        self.nrows, self.ncols = BG.shape
+
+        # Circulants are listed in row-major order of the base graph
+        populated = argwhere(BG >= 0)
+        self.rows = populated[:,0]
+        self.cols = populated[:,1]
+        self.shifts = BG[self.rows,self.cols] % Zc
+
+        # Offsets into the circulant list at which each row of the base graph begins
+        self.row_starts = searchsorted(self.rows, arange(self.nrows))
+
+        self.gather_cache = None
+        self.H_cache = None
+        self.encoder_cache = None
+
+    @classmethod
+    def from_arrays(cls, shape, Zc, rows, cols, shifts, gather=None, H=None):
+        """Construct a lifted graph from the dimensions of its base graph and its circulant list,
+        along with its gather indices and sparse PCM if they've been computed already, as they
+        are in the code tables.
+        """
+        graph = cls.__new__(cls)
+        graph.Zc = Zc
+        graph.nrows, graph.ncols = shape
+        graph.rows = rows
+        graph.cols = cols
+        graph.shifts = shifts
+        graph.row_starts = searchsorted(rows, arange(graph.nrows))
+        graph.gather_cache = gather
+        graph.H_cache = H
+        graph.encoder_cache = None
+
+        return graph
+
+    def __str__(self):
+        """String representation of LiftedGraph object.
+        """
+        return "LiftedGraph: ({0} x {1}) base graph, {2} circulants, Zc = {3}".format(self.nrows, self.ncols, len(self.shifts), self.Zc)
+
+    @property
+    def shape(self):
+        """Return the dimensions of the lifted parity check matrix.
+        """
+        return (self.nrows*self.Zc, self.ncols*self.Zc)
+
+    @property
+    def gather(self):
+        """Return a (circulants x Zc) array of column indices into the codeword. Row k of
+        entry i holds the codeword bit which participates in check k of circulant i.
+        """
+        if self.gather_cache is None:
+            k = arange(self.Zc)
+            self.gather_cache = self.cols[:,None]*self.Zc + (k[None,:] + self.shifts[:,None]) % self.Zc
+
+        return self.gather_cache
+
+    @property
+    def kb(self):
+        """Return the number of systematic columns in the base graph.
+        """
+        return self.ncols - self.nrows
+
+    @property
+    def encoder(self):
+        """Return the index tables used by the encoder. These are the columns, shifts, gather
+        indices and row offsets of the circulants in the core rows which act on systematic
+        columns; the shifts of the double-diagonal core parity circulants, along with the shift
+        of the one circulant in the first core parity column which isn't paired with another
+        of the same shift; and the columns, shifts, gather indices and row offsets of the
+        circulants in the extension rows which act on systematic or core parity columns.
+        """
+        if self.encoder_cache is None:
+            kb = self.kb
+
+            core = (self.rows < 4) & (self.cols < kb)
+            core_starts = searchsorted(self.rows[core], arange(4))
+
+            core_parity = {(int(irow), int(icol) - kb) : int(shift) for irow, icol, shift in
+                           zip(self.rows, self.cols, self.shifts) if irow < 4 and kb <= icol < kb + 4}
+
+            # Summing the core rows leaves the first core parity column multiplied by the one
+            # circulant whose shift isn't shared by another row in that column
+            column_shifts = [core_parity[(irow,0)] for irow in range(4) if (irow,0) in core_parity]
+            unpaired = [shift for shift in column_shifts if column_shifts.count(shift) == 1]
+            if len(unpaired) != 1:
+                raise ValueError("Base graph doesn't have a double-diagonal core parity structure")
+
+            extension = (self.rows >= 4) & (self.cols < kb + 4)
+            extension_starts = searchsorted(self.rows[extension], arange(4, self.nrows))
+
+            self.encoder_cache = ((self.cols[core], self.shifts[core], self.gather[core], core_starts),
+                                  (core_parity, unpaired[0]),
+                                  (self.cols[extension], self.shifts[extension], self.gather[extension], extension_starts))
+
+        return self.encoder_cache
+
+    @property
+    def H(self):
+        """Return the lifted parity check matrix as a CSR sparse matrix.
+        """
+        if self.H_cache is None:
+            check_rows = self.rows[:,None]*self.Zc + arange(self.Zc)[None,:]
+            self.H_cache = csr_matrix((ones((self.gather.size,), dtype=uint8), (check_rows.ravel(), self.gather.ravel())),
+                                      shape=self.shape)
+
+        return self.H_cache
+
+    @property
+    def H_csc(self):
+        """Return the lifted parity check matrix as a CSC sparse matrix.
+        """
+        return self.H.tocsc()
+
+    def encode(self, s):
+        """Systematically encode a (num_codewords x kb.Zc) array of information bits and return
+        the (num_codewords x ncols.Zc) codewords, information bits first.
+        Each circulant multiplies a Zc-bit segment by a cyclically shifted identity, which is a
+        gather of the segment with its indices rotated by the shift. The four core parity
+        segments are solved from the double-diagonal structure of the base graph: summing the
+        four core rows cancels every core parity column but the first, and the remaining core
+        parity segments follow by back-substitution. Every extension row then contains a single
+        extension parity column, which is the sum of the gathered systematic and core parity
+        segments in that row.
+        """
+        (_, _, core_gather, core_starts), core_parity, (_, _, extension_gather, extension_starts) = self.encoder
+        Zc = self.Zc
+        n = s.shape[0]
+        s = s.astype(uint8) & 1
+
+        # Sum of the shifted systematic segments in each of the four core rows
+        lam = gather_xor(s, core_gather, core_starts)
+
+        cw = empty((n,self.ncols*Zc), dtype=uint8)
+        cw[:,0:self.kb*Zc] = s
+        p = cw[:,self.kb*Zc:(self.kb+4)*Zc].reshape((n,4,Zc))
+        self._solve_core(lam, p, core_parity, lambda x, shift: roll(x, -shift, axis=-1))
+
+        # Extension parity segments
+        cw[:,(self.kb+4)*Zc:] = gather_xor(cw, extension_gather, extension_starts).reshape((n,-1))
+
+        return cw
+
+    def encode_packed(self, s):
+        """Systematically encode a (num_codewords x kb x words) array of Zc-bit systematic
+        segments, each packed into 64-bit words, and return the (num_codewords x ncols x words)
+        segments of the codewords. This mirrors encode, with each circulant product carried
+        out as a rotation of whole words.
+        """
+        (core_cols, core_shifts, _, core_starts), core_parity, (extension_cols, extension_shifts, _, extension_starts) = self.encoder
+        Zc = self.Zc
+        n, _, nw = s.shape
+
+        # Sum of the rotated systematic segments in each of the four core rows
+        lam = bitwise_xor.reduceat(rotate(s[:,core_cols], core_shifts, Zc), core_starts, axis=1)
+
+        cw = empty((n,self.ncols,nw), dtype=uint64)
+        cw[:,0:self.kb] = s
+        self._solve_core(lam, cw[:,self.kb:self.kb+4], core_parity, lambda x, shift: rotate(x[:,None], [shift], Zc)[:,0])
+
+        # Extension parity segments
+        cw[:,self.kb+4:] = bitwise_xor.reduceat(rotate(cw[:,extension_cols], extension_shifts, Zc), extension_starts, axis=1)
+
+        return cw
+
+    def _solve_core(self, lam, p, core_parity, shifted):
+        """Solve the double-diagonal core for the four core parity segments, p, given the sums
+        lam of the shifted systematic segments in each core row. Segments are shifted by the
+        given function, so the solve applies to both unpacked and packed segments.
+        """
+        core_parity, unpaired = core_parity
+
+        p[:,0] = shifted(bitwise_xor.reduce(lam, axis=1), (self.Zc - unpaired) % self.Zc)
+        p[:,1] = lam[:,0] ^ shifted(p[:,0], core_parity[(0,0)])
+        p[:,2] = lam[:,1] ^ p[:,1]
+        if (1,0) in core_parity:
+            p[:,2] ^= shifted(p[:,0], core_parity[(1,0)])
+        p[:,3] = lam[:,3] ^ shifted(p[:,0], core_parity[(3,0)])
+
+    def decode(self, llr, max_iterations=25, algorithm='normalized', scale=0.75, offset=0.5, stop=None):
+        """Decode a (num_codewords x ncols.Zc) array of log-likelihood ratios, positive for a
+        zero bit, with layered min-sum belief propagation. Return the hard-decision codewords,
+        the number of iterations each codeword took, and whether each codeword converged.
+        Each row of the base graph is a layer, processed as one update over all Zc checks of all
+        of its circulants and all codewords, by the layer kernel. The check-to-variable messages are
+        scaled (normalized min-sum) or reduced by an offset (offset min-sum); algorithm='minsum'
+        applies neither. After every iteration, codewords for which stop returns True are
+        retired, so that easy codewords don't run to the iteration limit. By default a codeword
+        stops once its syndrome is zero.
+        """
+        if algorithm not in ('minsum', 'normalized', 'offset'):
+            raise ValueError("Unsupported min-sum algorithm: {0}".format(algorithm))
+        if stop is None:
+            stop = lambda cw: ~self.syndrome(cw).any(axis=1)
+
+        n = llr.shape[0]
+        hard = zeros((n,self.ncols*self.Zc), dtype=uint8)
+        iterations = zeros((n,), dtype=int)
+        converged = zeros((n,), dtype=bool)
+
+        # Posterior LLRs and check-to-variable messages of the codewords still being decoded
+        active = arange(n)
+        L = llr.astype(float32)
+        R = zeros((n,len(self.shifts),self.Zc), dtype=float32)
+        if n == 0:
+            return hard, iterations, converged
+
+        for iteration in range(1, max_iterations+1):
+
+            # Each layer updates L and R in place; see FecMe.Kernels
+            for start, end in zip(self.row_starts, list(self.row_starts[1:]) + [len(self.shifts)]):
+                layer_update(L, R, self.gather, int(start), int(end), algorithm, scale, offset)
+
+            # Retire the codewords which have finished decoding
+            cw = (L < 0).astype(uint8)
+            stopped = stop(cw)
+            done = stopped | (iteration == max_iterations)
+            finished = active[done]
+            hard[finished] = cw[done]
+            iterations[finished] = iteration
+            converged[finished] = stopped[done]
+
+            if done.all():
+                break
+            keep = flatnonzero(~done)
+            active = active[keep]
+            L = L[keep]
+            R = R[keep]
+
+        return hard, iterations, converged
+
+    def syndrome(self, cw):
+        """Return the syndromes of a (num_codewords x ncols.Zc) array of codewords, computed
+        by gathering the shifted codeword bits for every circulant and summing them modulo 2
+        within each row of the base graph.
+        """
+        return gather_xor(cw.astype(uint8) & 1, self.gather, self.row_starts).reshape((cw.shape[0],-1))
+
+### ====================================================================================
+###                                 Process-Wide Cache
+### ====================================================================================
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+class LRUCache():
+    """Bounded, thread-safe least-recently-used cache which counts its hits and misses.
+    Values are built outside of the lock, so a slow build doesn't stall lookups of other keys;
+    if two threads race to build the same key, the first value stored wins.
+    """
+
+    def __init__(self, maxsize):
+        """Class constructor.
+        """
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, factory):
+        """Return the value cached against key, calling factory() to build it on a miss.
+        """
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            self.misses += 1
+
+        value = factory()
+
+        with self.lock:
+            if key in self.entries:
+                return self.entries[key]
+            self.entries[key] = value
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+        return value
+
+    def info(self):
+        """Return the hit and miss statistics of the cache.
+        """
+        with self.lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self.entries))
+
+    def clear(self):
+        """Empty the cache and reset its statistics.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+# Base graphs are loaded from the npz file at most once per process. There are only sixteen of
+# them, so they are held indefinitely. Lifted graphs are bounded by an LRU; the default size
+# holds every lifting size of both base graphs.
+_base_graph_lock = RLock()
+_base_graph_file = None
+_base_graphs = {}
+_lifted_graphs = LRUCache(maxsize=128)
+register_cache('lifted_graphs', _lifted_graphs.info)
+
+# Code tables built by FecMe.CodeTables, opened on first use; False if there are none
+_code_tables = None
+
+def base_graph(BGN, LiftingSet):
+    """Return the (read-only) base graph for the given base graph number and lifting set,
+    loading it from the npz file on first use.
+    """
+    global _base_graph_file
+
+    key = (BGN, LiftingSet)
+    BG = _base_graphs.get(key)
+    if BG is None:
+        with _base_graph_lock:
+            BG = _base_graphs.get(key)
+            if BG is None:
+                if _base_graph_file is None:
+                    # Read the whole file up front rather than holding it open, since a process
+                    # forked from this one would otherwise share its file offset
+                    path = abspath(dirname(__file__))
+                    with load('{0}/NRLDPC_Base_Graphs.npz'.format(path)) as BGs:
+                        _base_graph_file = {name : BGs[name] for name in BGs.files}
+                BG = load_base_graph(BGN, LiftingSet, BGs=_base_graph_file)
+                BG.setflags(write=False)
+                _base_graphs[key] = BG
+
+    return BG
+
+def code_tables():
+    """Return the memory-mapped code tables, opening them on first use, or None if no tables
+    file has been built.
+    """
+    global _code_tables
+
+    if _code_tables is None:
+        with _base_graph_lock:
+            if _code_tables is None:
+                from FecMe.CodeTables import open_tables
+                _code_tables = open_tables() or False
+
+    return _code_tables or None
+
+def use_code_tables(path):
+    """Build lifted graphs from the code tables at path from now on, emptying the lifted graph
+    cache. If path is None, the tables at the default path are used if they've been built, and
+    if path is False the base graphs are always used.
+    """
+    global _code_tables
+
+    with _base_graph_lock:
+        if path is None or path is False:
+            _code_tables = None if path is None else False
+        else:
+            from FecMe.CodeTables import CodeTables
+            _code_tables = CodeTables(path)
+        cache_clear()
+
+def lifted_graph(BGN, LiftingSet, Zc):
+    """Return the lifted graph for the given base graph number, lifting set and lifting size,
+    building it on a miss in the process-wide cache. Lifted graphs are taken from the code
+    tables if they've been built, and computed from the base graph otherwise.
+    """
+    def build():
+        tables = code_tables()
+        if tables is not None:
+            return tables.lifted_graph(BGN, Zc)
+        return LiftedGraph(base_graph(BGN, LiftingSet), Zc)
+
+    return _lifted_graphs.get((BGN, LiftingSet, Zc), build)
+
+def cache_info():
+    """Return the hit and miss statistics of the lifted graph cache.
+    """
+    return _lifted_graphs.info()
+
+def cache_clear():
+    """Empty the lifted graph cache and reset its statistics.
+    """
+    _lifted_graphs.clear()
+
+def warm_up(BGNs=(1,2)):
+    """Precompute the lifted graphs, including their sparse PCMs, for all 51 lifting sizes of
+    each of the given base graphs. Intended to be called once at service startup.
+    """
+    for BGN in BGNs:
+        for LiftingSet, column in argwhere(lifting_sizes > 0):
+            graph = lifted_graph(BGN, int(LiftingSet), int(lifting_sizes[LiftingSet,column]))
+            graph.gather
+            graph.H
@@ -2,7 +2,10 @@
 ### AUTHOR: Salvatore Cardamone
 ### DESCRIPTION: Various cyclic-redundancy check (CRC) functionalities and polynomials
 
-from numpy import array, zeros, ones, trim_zeros, concatenate, argmax
+from functools import lru_cache
+from numpy import array, asarray, zeros, concatenate, arange, packbits, bitwise_xor, uint8, float64, int64
+
+from FecMe.Kernels import crc_register, crc_table
 
 # Generator polynomials taken from Section 5.1 of 38.212
 # Leading element in array corresponds to highest power term, final element is the zeroth power
@@ -15,47 +18,191 @@ polynomials = {
     'CRC6'   : array([1,1,0,0,0,0,1], dtype=int)
 }
 
+### ====================================================================================
+###                                 Lookup Table Engine
+### ====================================================================================
+
+def _crc_polynomial(polynomial):
+    """Return the generator polynomial with the given name, raising if it isn't known.
+    """
+    g = polynomials.get(polynomial)
+    if g is None:
+        raise ValueError("Unsupported CRC polynomial: {0}".format(polynomial))
+
+    return g
+    
+# Lookup tables are built on first use of a polynomial and retained for the lifetime of the
+# process, keyed by the name of the polynomial in the dictionary above
+_crc_tables = {}
+
+def _crc_table(polynomial):
+    """Return the byte-wise lookup table for the named generator polynomial, building it if
+    this is the first time the polynomial has been requested.
+    The table is returned alongside the register width, W, and the alignment shift, S. The
+    register is W = max(L-1, 8) bits wide so that polynomials of degree less than eight can
+    still consume a whole byte per step; the remainder is held left-aligned in the register
+    and must be shifted down by S to recover the L-1 checksum bits.
+    """
+    table = _crc_tables.get(polynomial)
+    if table is None:
+
+        g = _crc_polynomial(polynomial)
+
+        # Degree of the generator polynomial and width of the working register
+        n = len(g) - 1
+        W = max(n, 8)
+        S = W - n
+        top = 1 << (W - 1)
+        mask = (1 << W) - 1
+        # Generator polynomial without its leading term, left-aligned within the register
+        poly = int(''.join(str(bit) for bit in g[1:]), 2) << S
+
+        # Entry i of the table is the register contents after shifting the byte i through an
+        # empty register eight times
+        entries = []
+        for i in range(256):
+            reg = i << (W - 8)
+            for _ in range(8):
+                reg = ((reg << 1) ^ poly) & mask if reg & top else (reg << 1) & mask
+            entries.append(reg)
+
+        # Held in the form the register kernel takes, so it's converted once per polynomial
+        table = (crc_table(entries), W, S)
+        _crc_tables[polynomial] = table
+
+    return table
+
+def _crc_register(packed, polynomial):
+    """Run the bytes in packed through the table-driven CRC register (initialised to zero) and
+    return the L-1 bit remainder as an integer. The byte loop is one of the kernels; see
+    FecMe.Kernels.
+    """
+    entries, W, S = _crc_table(polynomial)
+
+    return crc_register(packed, entries, W) >> S
+
+def _register_to_bits(reg, n):
+    """Expand an n-bit remainder into an array of bits, most significant bit first.
+    """
+    return (reg >> arange(n - 1, -1, -1)) & 1
+
+@lru_cache(maxsize=64)
+def _remainder_matrix(polynomial, A):
+    """Return the (A x L-1) matrix whose i-th row holds the remainder of x^(A-1-i+L-1) modulo
+    the generator polynomial, i.e. the checksum contributed by bit i of an A-bit message.
+    CRC is linear over GF(2), so the checksum of a message is the modulo-2 sum of the rows
+    selected by its set bits. The matrix is stored as floats so that the sum can be taken
+    with a single BLAS matrix product.
+    """
+    g = _crc_polynomial(polynomial)
+    n = len(g) - 1
+    top = 1 << n
+    full = int(''.join(str(bit) for bit in g), 2)
+
+    # Walk up through successive powers of x, reducing modulo the generator as we go
+    remainders = zeros((A,), dtype=int64)
+    reg = full ^ top
+    for k in range(A):
+        remainders[A-1-k] = reg
+        reg <<= 1
+        if reg & top:
+            reg ^= full
+
+    return ((remainders[:,None] >> arange(n - 1, -1, -1)) & 1).astype(float64)
+
+@lru_cache(maxsize=16)
+def _byte_remainder_table(polynomial, nbits):
+    """Return the (ceil(nbits/8) x 256) table whose entry (j, v) holds, as an integer, the
+    checksum contributed by the value v of byte j of an nbits-bit message packed most
+    significant bit first. Bits of the final byte beyond nbits contribute nothing. This is the
+    remainder matrix with the contributions of each byte's eight bits summed for every value
+    of the byte, so that a packed message is checksummed with one lookup per byte.
+    """
+    R = _remainder_matrix(polynomial, nbits).astype(int64)
+    n = R.shape[1]
+    nbytes = -(-nbits // 8)
+
+    remainders = zeros((nbytes*8,), dtype=int64)
+    remainders[0:nbits] = R @ (1 << arange(n - 1, -1, -1))
+    remainders = remainders.reshape((nbytes,8))
+
+    values = arange(256)
+    table = zeros((nbytes,256), dtype=int64)
+    for bit in range(8):
+        table ^= ((values[None,:] >> (7 - bit)) & 1) * remainders[:,bit:bit+1]
+
+    return table
+
+### ====================================================================================
+###                                     Methods
+### ====================================================================================
+
 def checksum(a, polynomial='CRC24A', checksum_fill=0):
     """Take a bitstring and compute the CRC checksum to be appended to the bitstring.
     Return CRC checksum -- the calling function can append them if needs be.
+    The bitstring is packed into bytes and run through a precomputed lookup table a byte at
+    a time, rather than dividing through by the generator polynomial one bit at a time.
     """
+    if checksum_fill not in (0, 1):
+        raise ValueError("Can't initialise the checksum with {0}s".format(checksum_fill))
 
-    # We have no need to consider the leading zeros in the input bitstring so
-    # just hack them off right at the start
-    a = trim_zeros(a, trim='f')
+    entries, W, S = _crc_table(polynomial)
+    n = W - S
 
-    A = len(a)
-    g = polynomials.get(polynomial)
-    L = len(g)
-
-    # Add overflow portion to work array where the checksum will end up
-    if checksum_fill == 0:
-        work = concatenate((a, zeros((L-1,), dtype=int)))
-    elif checksum_fill == 1:
-        work = concatenate((a, ones((L-1,),  dtype=int)))
-    else:
+    # Leading zeros don't change the remainder, so left-pad the bitstring out to a whole
+    # number of bytes before packing it
+    a = asarray(a).ravel()
+    pad = (-len(a)) % 8
+    packed = packbits(concatenate((zeros((pad,), dtype=uint8), a.astype(uint8))))
+
+    reg = _crc_register(packed, polynomial)
+
+    # Filling the checksum positions with ones before the division is equivalent to
+    # inverting the remainder afterwards, since the fill is of lower degree than the divisor
+    if checksum_fill == 1:
+        reg ^= (1 << n) - 1
+
+    # Return the CRC checksum
+    return _register_to_bits(reg, n)
+
+def checksum_packed(packed, nbits, polynomial='CRC24A', checksum_fill=0):
+    """Compute the CRC checksum of an nbits-bit bitstring packed most significant bit first
+    into bytes, as produced by numpy.packbits. Return the checksum as an integer whose most
+    significant of L-1 bits is the first checksum bit.
+    """
+    if checksum_fill not in (0, 1):
         raise ValueError("Can't initialise the checksum with {0}s".format(checksum_fill))
 
-    # Continue until all of the message part of the work array is zero
-    while any(work[0:A]) == 1:
+    entries, W, S = _crc_table(polynomial)
+    n = W - S
+    packed = asarray(packed, dtype=uint8)
 
-        # Find the leading non-zero element in the work array -- that's where we apply the
-        # generator polynomial
-        current_shift = argmax(work > 0)
+    # Whole bytes go through the lookup table
+    nbytes = nbits // 8
+    reg = _crc_register(packed[0:nbytes], polynomial) << S
 
-        # Loop over bits in the generator polynomial and xor with bit directly above
-        # in the work array
-        work[range(current_shift,current_shift+L)] ^= g[:]
+    # Any bits left over in a final, partially filled byte are shifted through one at a time
+    if nbits % 8:
+        poly = int(''.join(str(bit) for bit in _crc_polynomial(polynomial)[1:]), 2) << S
+        top = 1 << (W - 1)
+        mask = (1 << W) - 1
+        byte = int(packed[nbytes])
+        for i in range(nbits % 8):
+            reg ^= ((byte >> (7 - i)) & 1) << (W - 1)
+            reg = ((reg << 1) ^ poly) & mask if reg & top else (reg << 1) & mask
 
-    # Return the CRC checksum
-    return work[A:]
+    reg >>= S
+    if checksum_fill == 1:
+        reg ^= (1 << n) - 1
+
+    return reg
 
 def check(b, polynomial='CRC24A', checksum_fill=0):
     """Verify whether the received CRC checksum is valid given the generating polynomial.
     """
     
-    L = len(polynomials.get(polynomial))
-    A = len(b) - L
+    L = len(_crc_polynomial(polynomial))
+    A = len(b) - L + 1
 
     # Compute the checksum from the received message bits
     crc_checksum = checksum(b[0:A], polynomial=polynomial, checksum_fill=checksum_fill)
@@ -63,8 +210,67 @@ def check(b, polynomial='CRC24A', checksum_fill=0):
     rx_crc_checksum = b[A:]
 
     # Verify whether or not the checksums match and flag to the caller
-    return False if any(crc_checksum ^ rx_crc_checksum) == ~checksum_fill else True
-    
+    return not any(crc_checksum != rx_crc_checksum)
+
+def checksum_batch(a, polynomial='CRC24A', checksum_fill=0):
+    """Take a (num_blocks x A) array of bitstrings and compute the CRC checksum of every row in
+    a single call. Return a (num_blocks x L-1) array of checksums.
+    The checksums are formed as the GF(2) product of the bitstrings with the cached remainder
+    matrix for the polynomial and message length.
+    """
+    if checksum_fill not in (0, 1):
+        raise ValueError("Can't initialise the checksum with {0}s".format(checksum_fill))
+
+    a = asarray(a)
+    if a.ndim != 2:
+        raise ValueError("Batched checksum expects a 2-D array, got {0} dimension(s)".format(a.ndim))
+
+    R = _remainder_matrix(polynomial, a.shape[1])
+    crc_checksums = (a.astype(float64) @ R).astype(int) & 1
+
+    if checksum_fill == 1:
+        crc_checksums ^= 1
+
+    return crc_checksums
+
+def checksum_packed_batch(packed, nbits, polynomial='CRC24A', checksum_fill=0):
+    """Compute the CRC checksums of the nbits-bit bitstrings in the rows of a 2-D array of
+    bytes, packed most significant bit first. Return the checksums as an integer array, each
+    of whose most significant of L-1 bits is the first checksum bit, as for checksum_packed.
+    Every row is checksummed at once by looking up the contribution of each of its bytes in a
+    cached table and summing them modulo 2.
+    """
+    if checksum_fill not in (0, 1):
+        raise ValueError("Can't initialise the checksum with {0}s".format(checksum_fill))
+
+    packed = asarray(packed, dtype=uint8)
+    if packed.ndim != 2:
+        raise ValueError("Batched checksum expects a 2-D array, got {0} dimension(s)".format(packed.ndim))
+
+    nbytes = -(-nbits // 8)
+    table = _byte_remainder_table(polynomial, nbits)
+    reg = bitwise_xor.reduce(table[arange(nbytes)[None,:],packed[:,0:nbytes]], axis=1)
+
+    if checksum_fill == 1:
+        reg ^= (1 << (len(_crc_polynomial(polynomial)) - 1)) - 1
+
+    return reg
+
+def check_batch(b, polynomial='CRC24A', checksum_fill=0):
+    """Verify the CRC checksum of every row of a (num_blocks x A+L-1) array of received
+    bitstrings. Return a boolean mask flagging the rows whose checksums are valid.
+    """
+    b = asarray(b)
+    if b.ndim != 2:
+        raise ValueError("Batched check expects a 2-D array, got {0} dimension(s)".format(b.ndim))
+
+    L = len(_crc_polynomial(polynomial))
+    A = b.shape[1] - L + 1
+
+    crc_checksums = checksum_batch(b[:,0:A], polynomial=polynomial, checksum_fill=checksum_fill)
+
+    return (crc_checksums == b[:,A:]).all(axis=1)
+
 if __name__ == "__main__":
 
     test_bitstring = array([0,0,0,0,0,1,0,1,1,0,0,0,0,0,0,0,1,1,1,1,1,1], dtype=int)
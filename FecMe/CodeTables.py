@@ -0,0 +1,158 @@
+### FILE: CodeTables.py
+### AUTHOR: Salvatore Cardamone
+### DESCRIPTION: Precomputed lifted graph tables, serialised to an aligned binary file and memory mapped
+
+import os
+import json
+from hashlib import sha1
+from os.path import abspath, dirname
+from numpy import memmap, ones, argwhere, dtype as numpy_dtype, int16, int32, uint8, uint32
+from scipy.sparse import csr_matrix
+
+from FecMe.BaseGraph import LiftedGraph, lifting_sizes, base_graph, base_graph_shapes
+
+# The file opens with the magic bytes and format version, followed by the length of a JSON
+# index and the index itself. The index records the digest of the base graph file the tables
+# were built from and the offset, dtype and shape of every array. Arrays are laid out on cache
+# line boundaries after the index, so that each can be viewed straight out of the mapping.
+_magic = b'FECMETAB'
+_version = 1
+_alignment = 64
+
+def default_path():
+    """Return the default location of the code tables, alongside the base graph file. This may
+    be overridden with the FECME_CODE_TABLES environment variable.
+    """
+    return os.environ.get('FECME_CODE_TABLES', '{0}/NRLDPC_Tables.bin'.format(abspath(dirname(__file__))))
+
+def _source_digest():
+    """Return the digest of the base graph file, which identifies the tables built from it.
+    """
+    with open('{0}/NRLDPC_Base_Graphs.npz'.format(abspath(dirname(__file__))), 'rb') as source:
+        return sha1(source.read()).hexdigest()
+
+def build(path=None):
+    """Build the lifted graph tables for every lifting size of both base graphs and write them
+    to path: the circulant list of each base graph, and for each lifting size the circulant
+    shifts, the gather indices and the sparse PCM. The file is written alongside and moved
+    into place, so that processes opening it never see it partly written.
+    """
+    path = path or default_path()
+
+    arrays = {}
+    max_nnz = 0
+    for BGN in (1, 2):
+        for LiftingSet, column in argwhere(lifting_sizes > 0):
+            Zc = int(lifting_sizes[LiftingSet,column])
+            graph = LiftedGraph(base_graph(BGN, int(LiftingSet)), Zc)
+            arrays['BG{0}/rows'.format(BGN)] = graph.rows.astype(int16)
+            arrays['BG{0}/cols'.format(BGN)] = graph.cols.astype(int16)
+            arrays['BG{0}/Z{1}/shifts'.format(BGN, Zc)] = graph.shifts.astype(int16)
+            arrays['BG{0}/Z{1}/gather'.format(BGN, Zc)] = graph.gather.astype(int32)
+            arrays['BG{0}/Z{1}/indptr'.format(BGN, Zc)] = graph.H.indptr.astype(int32)
+            arrays['BG{0}/Z{1}/indices'.format(BGN, Zc)] = graph.H.indices.astype(int32)
+            max_nnz = max(max_nnz, graph.H.nnz)
+
+    # Every PCM shares the one array of ones as its data
+    arrays['ones'] = ones((max_nnz,), dtype=uint8)
+
+    def align(offset):
+        return -(-offset // _alignment) * _alignment
+
+    # Offsets are laid out relative to the first array, which follows the index. The index
+    # grows with the offsets it records, so the first array is moved back until it fits.
+    relative = {}
+    offset = 0
+    for name, array in arrays.items():
+        relative[name] = offset
+        offset = align(offset + array.nbytes)
+
+    digest = _source_digest()
+    base = 0
+    while True:
+        index = {name : [base + relative[name], array.dtype.str, list(array.shape)] for name, array in arrays.items()}
+        header = json.dumps({'digest' : digest, 'arrays' : index}).encode()
+        if align(len(_magic) + 8 + len(header)) <= base:
+            break
+        base = align(len(_magic) + 8 + len(header))
+
+    staging = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(staging, 'wb') as tables:
+        tables.write(_magic)
+        tables.write(uint32(_version).tobytes())
+        tables.write(uint32(len(header)).tobytes())
+        tables.write(header)
+        for name, array in arrays.items():
+            tables.write(b'\0' * (index[name][0] - tables.tell()))
+            tables.write(array.tobytes())
+    os.replace(staging, path)
+
+    return path
+
+class CodeTables():
+    """Lifted graph tables memory mapped from a file written by build. The mapping is read-only,
+    so every process which opens the file shares the one copy in the page cache, and lifted
+    graphs are assembled from views into it without any computation.
+    """
+
+    def __init__(self, path=None):
+        """Class constructor. Raise ValueError if the file isn't a set of code tables built from
+        the current base graph file.
+        """
+        self.path = path or default_path()
+        self.map = memmap(self.path, dtype=uint8, mode='r')
+
+        if bytes(self.map[0:len(_magic)]) != _magic:
+            raise ValueError("{0} isn't a code tables file".format(self.path))
+        version, length = self.map[len(_magic):len(_magic)+8].view(uint32)
+        if version != _version:
+            raise ValueError("Code tables file has version {0}, but version {1} is required".format(version, _version))
+
+        header = json.loads(bytes(self.map[len(_magic)+8:len(_magic)+8+length]))
+        if header['digest'] != _source_digest():
+            raise ValueError("Code tables file was built from a different base graph file")
+        self.index = header['arrays']
+
+    def __str__(self):
+        """String representation of CodeTables object.
+        """
+        return "CodeTables: {0} arrays, {1} bytes, mapped from {2}".format(len(self.index), len(self.map), self.path)
+
+    def array(self, name):
+        """Return a read-only view of the named array.
+        """
+        offset, dtype, shape = self.index[name]
+        dtype = numpy_dtype(dtype)
+        count = 1
+        for extent in shape:
+            count *= extent
+
+        return self.map[offset:offset+count*dtype.itemsize].view(dtype).reshape(shape)
+
+    def lifted_graph(self, BGN, Zc):
+        """Return the lifted graph of the given base graph number and lifting size, assembled
+        from views into the tables.
+        """
+        prefix = 'BG{0}/Z{1}/'.format(BGN, Zc)
+        indices = self.array(prefix + 'indices')
+        shape = base_graph_shapes[BGN]
+        H = csr_matrix((self.array('ones')[0:len(indices)], indices, self.array(prefix + 'indptr')),
+                       shape=(shape[0]*Zc, shape[1]*Zc), copy=False)
+        H.has_sorted_indices = True
+
+        return LiftedGraph.from_arrays(shape, Zc, self.array('BG{0}/rows'.format(BGN)), self.array('BG{0}/cols'.format(BGN)),
+                                       self.array(prefix + 'shifts'), gather=self.array(prefix + 'gather'), H=H)
+
+def open_tables(path=None):
+    """Open the code tables, returning None if there's no usable tables file at path.
+    """
+    try:
+        return CodeTables(path)
+    except (OSError, ValueError):
+        return None
+
+
+if __name__ == "__main__":
+
+    print("Wrote code tables to {0}".format(build()))
+    print(CodeTables())
@@ -1,5 +1,7 @@
-from math import sqrt, ceil
-from numpy import zeros, ones
+from math import sqrt
+from numpy import array, asarray, ascontiguousarray, arange, argsort, empty, ones, zeros, zeros_like, take, clip, rint, \
+    floor, minimum, where, inf, complex64, float32, int64, uint8
+from scipy.special import logsumexp
 
 def ConstellationFactory(constellation_type):
     """Constellation factory object creation. Create a constellation object of the
@@ -8,6 +10,12 @@ def ConstellationFactory(constellation_type):
     
     if constellation_type == "QPSK":
         return QPSK(constellation_type)
+    elif constellation_type == "16QAM":
+        return QAM16(constellation_type)
+    elif constellation_type == "64QAM":
+        return QAM64(constellation_type)
+    elif constellation_type == "256QAM":
+        return QAM256(constellation_type)
     else:
         raise ValueError("Unsupported constellation type: {0}".format(constellation_type))
 
@@ -19,44 +27,255 @@ class Constellation(object):
     
     def __init__(self, constellation_type):
         self.name = constellation_type
+        # Lookup tables of map_packed, built on first use
+        self.point_table = None
+        self.byte_table = None
         
     def __str__(self):
         return "Constellation object for {0}".format(self.name)
 
-    def map(self, bitstring):
+    def map(self, bitstring, out=None):
         raise NotImplementedError("Mapping for {0} constellation is unsupported.".format(self.name))
 
-    def demap(self, constellations):
+    def demap(self, constellations, noise_variance=1.0, method='maxlog'):
         raise NotImplementedError("Demapping for {0} constellation is unsupported.".format(self.name))
 
+    def map_packed(self, packed, nbits):
+        """Map the first nbits bits of a bitstring packed into bytes to constellation points,
+        without unpacking it. When Qm divides eight, each byte indexes a 256-entry table of the
+        8/Qm points it carries (four for QPSK); otherwise every three bytes are combined into
+        24 bits and split into the indices of their points in the point table.
+        """
+        Qm = self.Qm
+        if nbits % Qm and Qm != 2:
+            raise ValueError("Number of bits must be a multiple of {0} for {1}".format(Qm, self.name))
+        num_constellations = -(-nbits // Qm)
+        packed = asarray(packed, dtype=uint8)[0:-(-nbits // 8)]
+
+        if 8 % Qm == 0:
+            points = self._byte_table()[packed].ravel()[0:num_constellations]
+        else:
+            groups = zeros((-(-len(packed) // 3)*3,), dtype=int64)
+            groups[0:len(packed)] = packed
+            groups = groups.reshape((-1,3)) @ array([1 << 16, 1 << 8, 1])
+            index = (groups[:,None] >> arange(24 - Qm, -1, -Qm)) & ((1 << Qm) - 1)
+            points = self._point_table()[index.ravel()[0:num_constellations]]
+
+        # As with map, the quadrature part of a point carrying a single trailing bit is zero
+        if nbits % Qm:
+            points[-1] = points[-1].real
+
+        return points
+
+    def _point_table(self):
+        """Return the point carried by each group of Qm bits, indexed by the bits most
+        significant first.
+        """
+        if self.point_table is None:
+            index = arange(1 << self.Qm)
+            self.point_table = self.map(((index[:,None] >> arange(self.Qm-1, -1, -1)) & 1).ravel())
+
+        return self.point_table
+
+    def _byte_table(self):
+        """Return the (256 x 8/Qm) table of the points carried by each value of a byte.
+        """
+        if self.byte_table is None:
+            values = arange(256)
+            shifts = arange(8 - self.Qm, -1, -self.Qm)
+            self.byte_table = self._point_table()[(values[:,None] >> shifts) & ((1 << self.Qm) - 1)]
+
+        return self.byte_table
+
 class QPSK(Constellation):
     """QPSK constellation class.
+    See 38.211 Section 5.1.3
     """
+
+    # Number of bits carried by each point
+    Qm = 2
     
     def __init__(self, constellation_type):
         super(QPSK, self).__init__(constellation_type)
         
-    def map(self, bitstring):
-        """Map a bitstring to a series of points in a QPSK constellation.
+    def map(self, bitstring, out=None):
+        """Map a bitstring to a series of points in a QPSK constellation. Return a complex64
+        array of points, or write them into out if it is given.
+        A complex64 array viewed as float32 interleaves the real and imaginary parts of its
+        points, which is exactly the order of the bits they carry, so the points are formed
+        in a single arithmetic pass over the bitstring.
         """
+        bitstring = asarray(bitstring).ravel()
+        num_constellations = (len(bitstring) + 1) // 2
 
-        num_constellations = int(ceil(len(bitstring) / 2))        
-        constellations = zeros((num_constellations,1), dtype=complex)
-        
-        for i in range(num_constellations):
-            # If we have an odd number of bits to map then we can just handle the index error we
-            # get from accessing past the end of the array by setting the imaginary part of the
-            # constellation to zero
-            try:
-                constellations[i] = ((2*bitstring[2*i] - 1) + 1j*(2*bitstring[2*i+1] - 1)) / sqrt(2)
-            except IndexError:
-                constellations[i] = (2*bitstring[2*i] - 1) / sqrt(2)
-                
-        return constellations
-
-    def demap(self, constellations):
-        """Demap constellation points to LLRs for underlying bits.
+        if out is None:
+            out = empty((num_constellations,), dtype=complex64)
+        elif out.shape != (num_constellations,) or out.dtype != complex64:
+            raise ValueError("Output buffer must be a ({0},) complex64 array".format(num_constellations))
+
+        components = out.view(float32)
+        components[0:len(bitstring)] = bitstring
+        components[0:len(bitstring)] *= -2 / sqrt(2)
+        components[0:len(bitstring)] += 1 / sqrt(2)
+
+        # If we have an odd number of bits to map then the imaginary part of the final
+        # constellation is zero
+        if len(bitstring) % 2:
+            components[-1] = 0
+
+        return out
+
+    def demap(self, constellations, noise_variance=1.0, method='maxlog'):
+        """Demap constellation points to LLRs for underlying bits. Return a float32 array of
+        two LLRs per point, positive for a zero bit.
+        The in-phase and quadrature components each carry one bit with BPSK, so the max-log and
+        exact LLRs coincide: 4.(1/sqrt(2)).y / N0 for a component y and noise variance N0.
         """
+        if method not in ('maxlog', 'exact'):
+            raise ValueError("Unsupported demapping method: {0}".format(method))
+
+        components = ascontiguousarray(asarray(constellations, dtype=complex64).ravel()).view(float32)
+
+        return components * float32(2 * sqrt(2) / noise_variance)
+    
+
+class QAM(Constellation):
+    """Square QAM constellation class, from which the 16QAM, 64QAM and 256QAM constellations
+    are derived. Each point carries Qm bits: the even-numbered bits select the in-phase level
+    and the odd-numbered bits select the quadrature level of a Gray-coded PAM.
+    See 38.211 Sections 5.1.4 to 5.1.6
+    """
+
+    Qm = None
+
+    def __init__(self, constellation_type):
+        super(QAM, self).__init__(constellation_type)
+
+        # Number of bits per axis and the normalisation giving the constellation unit energy
+        m = self.Qm // 2
+        self.norm = sqrt(2 * (4**m - 1) / 3)
+
+        # Bits of each per-axis index, most significant bit first
+        self.axis_bits = (arange(2**m)[:,None] >> arange(m-1, -1, -1)[None,:]) & 1
+
+        # PAM levels indexed by the bits of an axis. For bits t0, t1, ..., the level is
+        # (1-2t0)(2^(m-1) - (1-2t1)(2^(m-2) - ... (1-2t(m-2))(2 - (1-2t(m-1)))))
+        signs = 1 - 2*self.axis_bits
+        levels = signs[:,m-1].astype(float)
+        for k in range(m-2, -1, -1):
+            levels = signs[:,k] * (2**(m-1-k) - levels)
+        self.levels = (levels / self.norm).astype(float32)
+
+        # Bits carried by each level, with the levels in ascending order
+        self.sorted_bits = self.axis_bits[argsort(self.levels)]
+
+        # Point table indexed by the Qm bits of a point, most significant bit first
+        index = arange(2**self.Qm)
+        in_phase = zeros_like(index)
+        quadrature = zeros_like(index)
+        for k in range(m):
+            in_phase |= ((index >> (self.Qm - 1 - 2*k)) & 1) << (m - 1 - k)
+            quadrature |= ((index >> (self.Qm - 2 - 2*k)) & 1) << (m - 1 - k)
+        self.points = (self.levels[in_phase] + 1j*self.levels[quadrature]).astype(complex64)
+
+    def map(self, bitstring, out=None):
+        """Map a bitstring to a series of points in the constellation. Return a complex64 array
+        of points, or write them into out if it is given.
+        Each group of Qm bits is packed into an index into the precomputed point table.
+        """
+        bitstring = asarray(bitstring).ravel()
+        if len(bitstring) % self.Qm:
+            raise ValueError("Number of bits must be a multiple of {0} for {1}".format(self.Qm, self.name))
+        num_constellations = len(bitstring) // self.Qm
+
+        if out is None:
+            out = empty((num_constellations,), dtype=complex64)
+        elif out.shape != (num_constellations,) or out.dtype != complex64:
+            raise ValueError("Output buffer must be a ({0},) complex64 array".format(num_constellations))
+
+        index = bitstring.reshape((num_constellations,self.Qm)) @ (1 << arange(self.Qm-1, -1, -1))
+
+        return take(self.points, index, out=out)
+
+    def demap(self, constellations, noise_variance=1.0, method='maxlog'):
+        """Demap constellation points to LLRs for underlying bits. Return a float32 array of Qm
+        LLRs per point, positive for a zero bit.
+        The in-phase and quadrature components are independent PAMs, so each is demapped
+        separately. The max-log LLR of a bit is the difference between the squared distances
+        to the nearest level carrying a one and the nearest level carrying a zero, over the
+        noise variance. One of those is the nearest level overall. In amplitude order, the
+        levels sharing a value of bit k of an axis form runs of 2w = 2^(Qm/2-k) levels (halved
+        at the ends), so the other is one of the two levels either side of the run holding the
+        nearest level, and each bit costs a fixed number of operations. The exact LLR replaces
+        each minimum with a log-sum-exp over all levels of the axis.
+        """
+        if method not in ('maxlog', 'exact'):
+            raise ValueError("Unsupported demapping method: {0}".format(method))
+
+        constellations = asarray(constellations).ravel()
+        m = self.Qm // 2
+        M = 2**m
+        llr = empty((len(constellations),self.Qm), dtype=float32)
+
+        for axis, component in enumerate((constellations.real, constellations.imag)):
+            component = component.astype(float32)
+
+            if method == 'maxlog':
+
+                # Work in units where the levels are the odd integers -(M-1), ..., M-1, so that
+                # level j in ascending order is 2j - (M-1)
+                u = component * float32(self.norm)
+                scale = float32(1 / (self.norm**2 * noise_variance))
+
+                # Nearest level
+                nearest = clip(rint((u + (M - 1)) / 2), 0, M - 1)
+                nearest_metric = (u - (2*nearest - (M - 1)))**2
+
+                for k in range(m):
+                    # The run of levels sharing bit k with the nearest level is run number r,
+                    # which starts at level lo; the next run starts at level lo + 2w. The nearest
+                    # level with the other value of bit k is whichever of the levels either side
+                    # of the run is closer, if they exist. Runs alternate in the value of bit k.
+                    w = 2**(m-1-k)
+                    r = floor((nearest + w) / (2*w))
+                    lo = r*2*w - w
+                    below = where(lo >= 1, (u - (2*lo - 2 - (M - 1)))**2, inf)
+                    above = where(lo + 2*w <= M - 1, (u - (2*(lo + 2*w) - (M - 1)))**2, inf)
+
+                    one = (r % 2 == 1) ^ (self.sorted_bits[0,k] == 1)
+                    llr[:,2*k+axis] = (minimum(below, above) - nearest_metric) * where(one, -scale, scale)
+
+            else:
+
+                # Scaled squared distance from each received component to every level
+                metric = (component[:,None] - self.levels[None,:])**2 / float32(noise_variance)
+
+                for k in range(m):
+                    ones = self.axis_bits[:,k] == 1
+                    llr[:,2*k+axis] = logsumexp(-metric[:,~ones], axis=1) - logsumexp(-metric[:,ones], axis=1)
+
+        return llr.ravel()
+
+class QAM16(QAM):
+    """16QAM constellation class.
+    See 38.211 Section 5.1.4
+    """
+
+    Qm = 4
+
+class QAM64(QAM):
+    """64QAM constellation class.
+    See 38.211 Section 5.1.5
+    """
+
+    Qm = 6
+
+class QAM256(QAM):
+    """256QAM constellation class.
+    See 38.211 Section 5.1.6
+    """
+
+    Qm = 8
     
 
 if __name__ == "__main__":
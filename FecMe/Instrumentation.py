@@ -0,0 +1,238 @@
+### FILE: Instrumentation.py
+### AUTHOR: Salvatore Cardamone
+### DESCRIPTION: Optional per-stage timing, counters and cache statistics for the NR LDPC chain
+
+from time import perf_counter
+from threading import Lock
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+
+### ====================================================================================
+###                                     Records
+### ====================================================================================
+
+StageStats = namedtuple('StageStats', ['calls', 'seconds', 'nbytes', 'throughput'])
+CacheStats = namedtuple('CacheStats', ['hits', 'misses', 'currsize'])
+
+# An event passed to the export hook: a stage timing (kind 'stage', value in seconds, with the
+# bytes it processed), a counter increment (kind 'counter') or a histogram sample (kind
+# 'histogram')
+Event = namedtuple('Event', ['kind', 'name', 'value', 'nbytes'])
+
+# Functions returning the statistics of each cache in the chain, registered by the module
+# owning the cache; each returns a record with hits, misses and currsize fields
+_caches = {}
+
+def register_cache(name, info):
+    """Register the function returning the hit and miss statistics of a cache, so that they're
+    reported alongside the stage timings.
+    """
+    _caches[name] = info
+
+def _cache_statistics():
+    """Return the current statistics of every registered cache.
+    """
+    statistics = {}
+    for name, info in _caches.items():
+        record = info()
+        statistics[name] = CacheStats(record.hits, record.misses, record.currsize)
+
+    return statistics
+
+### ====================================================================================
+###                                     Collector
+### ====================================================================================
+
+class Collector():
+    """Thread-safe accumulator of the stage timings, counters and histograms recorded while
+    instrumentation is enabled. Cache statistics are reported relative to when the collector
+    was created or last reset, so that they cost nothing on the hot path. If an exporter is
+    given, it's called with an Event for everything recorded.
+    """
+
+    def __init__(self, exporter=None):
+        """Class constructor.
+        """
+        self.exporter = exporter
+        self.lock = Lock()
+        self.reset()
+
+    def __str__(self):
+        """String representation of Collector object.
+        """
+        return "Collector: {0} stages, {1} counters".format(len(self.stages), len(self.counters))
+
+    def reset(self):
+        """Discard everything recorded so far.
+        """
+        with self.lock:
+            self.stages = {}
+            self.counters = Counter()
+            self.histograms = {}
+            self.cache_baseline = _cache_statistics()
+
+    def add_stage(self, name, seconds, nbytes):
+        """Record a call of a stage, taking seconds and processing nbytes bytes.
+        """
+        with self.lock:
+            calls, total_seconds, total_nbytes = self.stages.get(name, (0, 0.0, 0))
+            self.stages[name] = (calls + 1, total_seconds + seconds, total_nbytes + nbytes)
+        if self.exporter is not None:
+            self.exporter(Event('stage', name, seconds, nbytes))
+
+    def add_count(self, name, count):
+        """Add count to a counter.
+        """
+        with self.lock:
+            self.counters[name] += count
+        if self.exporter is not None:
+            self.exporter(Event('counter', name, count, 0))
+
+    def add_samples(self, name, samples):
+        """Add each of a sequence of integer samples to a histogram.
+        """
+        samples = [int(sample) for sample in samples]
+        with self.lock:
+            self.histograms.setdefault(name, Counter()).update(samples)
+        if self.exporter is not None:
+            for sample in samples:
+                self.exporter(Event('histogram', name, sample, 0))
+
+    def snapshot(self):
+        """Return everything recorded so far: the statistics of each stage, the counters, the
+        histograms as dictionaries from value to count, and the hits and misses of each cache
+        since the collector was reset.
+        """
+        current = _cache_statistics()
+        with self.lock:
+            stages = {name : StageStats(calls, seconds, nbytes, nbytes / seconds if seconds > 0 else 0.0)
+                      for name, (calls, seconds, nbytes) in self.stages.items()}
+            counters = dict(self.counters)
+            histograms = {name : dict(sorted(histogram.items())) for name, histogram in self.histograms.items()}
+            baseline = self.cache_baseline
+
+        caches = {}
+        for name, record in current.items():
+            start = baseline.get(name, CacheStats(0, 0, 0))
+            # A cache cleared since the reset has restarted its statistics from zero
+            if record.hits < start.hits or record.misses < start.misses:
+                start = CacheStats(0, 0, 0)
+            caches[name] = CacheStats(record.hits - start.hits, record.misses - start.misses, record.currsize)
+
+        return {'stages' : stages, 'counters' : counters, 'histograms' : histograms, 'caches' : caches}
+
+### ====================================================================================
+###                                     Recording
+### ====================================================================================
+
+# The active collector, or None while instrumentation is disabled. Every recording function
+# checks this first and returns straight away when it's None.
+_collector = None
+
+class _NullStage():
+    """Stage timer handed out while instrumentation is disabled, which does nothing.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+_null_stage = _NullStage()
+
+class _Stage():
+    """Stage timer which records its wall time with the collector on exit.
+    """
+
+    __slots__ = ('collector', 'name', 'nbytes', 'start')
+
+    def __init__(self, collector, name, nbytes):
+        """Class constructor.
+        """
+        self.collector = collector
+        self.name = name
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.collector.add_stage(self.name, perf_counter() - self.start, self.nbytes)
+        return False
+
+def enabled():
+    """Return whether instrumentation is enabled.
+    """
+    return _collector is not None
+
+def stage(name, nbytes=0):
+    """Return a context manager timing a stage which processes nbytes bytes. While
+    instrumentation is disabled this is a shared no-op.
+    """
+    collector = _collector
+    if collector is None:
+        return _null_stage
+
+    return _Stage(collector, name, nbytes)
+
+def count(name, value=1):
+    """Add value to a counter.
+    """
+    collector = _collector
+    if collector is not None:
+        collector.add_count(name, value)
+
+def samples(name, values):
+    """Add each of a sequence of integer values to a histogram.
+    """
+    collector = _collector
+    if collector is not None:
+        collector.add_samples(name, values)
+
+### ====================================================================================
+###                                     Control
+### ====================================================================================
+
+def enable(exporter=None):
+    """Enable instrumentation with a new collector, which is returned. If an exporter is given,
+    it's called with an Event for every stage timing, counter increment and histogram sample.
+    """
+    global _collector
+
+    _collector = Collector(exporter)
+
+    return _collector
+
+def disable():
+    """Disable instrumentation, returning the collector which was active, if any.
+    """
+    global _collector
+
+    collector, _collector = _collector, None
+
+    return collector
+
+def snapshot():
+    """Return everything recorded by the active collector; see Collector.snapshot. Return
+    None if instrumentation is disabled.
+    """
+    collector = _collector
+
+    return None if collector is None else collector.snapshot()
+
+@contextmanager
+def instrumented(exporter=None):
+    """Context manager which enables instrumentation with a new collector for the duration of
+    the block, yielding the collector, and restores the previous state afterwards.
+    """
+    global _collector
+
+    previous = _collector
+    collector = Collector(exporter)
+    _collector = collector
+    try:
+        yield collector
+    finally:
+        _collector = previous
@@ -0,0 +1,192 @@
+### FILE: Kernels.py
+### AUTHOR: Salvatore Cardamone
+### DESCRIPTION: Inner loops of the CRC, encoder and decoder, JIT-compiled with Numba when it's available
+
+import os
+from numpy import asarray, empty, partition, where, maximum, bitwise_xor, float32, int64, uint8, inf
+
+# The backend is chosen once, at import. Numba is used if it can be imported, unless the
+# FECME_KERNELS environment variable is set to 'numpy'.
+try:
+    if os.environ.get('FECME_KERNELS', 'numba') == 'numpy':
+        raise ImportError("NumPy kernels requested")
+    from numba import njit
+    backend = 'numba'
+except ImportError:
+    njit = None
+    backend = 'numpy'
+
+# Check-node update rules, as passed to the compiled layer update
+_algorithms = {'minsum' : 0, 'normalized' : 1, 'offset' : 2}
+
+### ====================================================================================
+###                                     Loops
+### ====================================================================================
+# Each kernel as an explicit loop, which is what Numba compiles. They also run as plain Python,
+# which is how they're checked against the NumPy kernels where Numba isn't installed.
+
+def _crc_register_loop(packed, table, W):
+    """Run the bytes of packed through the table-driven CRC register of width W bits,
+    initialised to zero, and return the register.
+    """
+    shift = W - 8
+    mask = (1 << W) - 1
+
+    reg = 0
+    for byte in packed:
+        reg = ((reg << 8) & mask) ^ table[(reg >> shift) ^ byte]
+
+    return reg
+
+def _gather_xor_loop(x, gather, starts, out):
+    """For every row of x, sum modulo 2 the bits of x gathered by each run of rows of gather,
+    the runs starting at starts, writing the sums into out.
+    """
+    n = x.shape[0]
+    nruns = len(starts)
+    Zc = gather.shape[1]
+
+    for i in range(n):
+        for run in range(nruns):
+            end = starts[run+1] if run + 1 < nruns else gather.shape[0]
+            for z in range(Zc):
+                acc = 0
+                for e in range(starts[run], end):
+                    acc ^= x[i,gather[e,z]]
+                out[i,run,z] = acc
+
+def _layer_update_loop(L, R, gather, start, end, algorithm, scale, offset):
+    """Update the posterior LLRs, L, and check-to-variable messages, R, of every codeword with
+    the checks of the circulants start to end, one check at a time: two passes over the inputs
+    of a check, the first for its two smallest magnitudes and sign and the second to write its
+    messages back.
+    """
+    n = L.shape[0]
+    Zc = gather.shape[1]
+    degree = end - start
+    Q = empty((degree,), dtype=float32)
+    zero = float32(0)
+
+    for i in range(n):
+        for z in range(Zc):
+            min1 = float32(inf)
+            min2 = float32(inf)
+            negative = False
+            for e in range(degree):
+                q = L[i,gather[start+e,z]] - R[i,start+e,z]
+                Q[e] = q
+                magnitude = abs(q)
+                if magnitude < min1:
+                    min2 = min1
+                    min1 = magnitude
+                elif magnitude < min2:
+                    min2 = magnitude
+                if q < zero:
+                    negative = not negative
+
+            for e in range(degree):
+                q = Q[e]
+                magnitude = min2 if abs(q) == min1 else min1
+                if algorithm == 1:
+                    magnitude = magnitude * scale
+                elif algorithm == 2:
+                    magnitude = magnitude - offset
+                    if not magnitude > zero:
+                        magnitude = zero
+                r = -magnitude if (q < zero) != negative else magnitude
+                L[i,gather[start+e,z]] = q + r
+                R[i,start+e,z] = r
+
+### ====================================================================================
+###                                     NumPy Kernels
+### ====================================================================================
+
+def _crc_register_numpy(packed, table, W):
+    """Return the CRC register after the bytes of packed, shifted through a Python loop over
+    the table as a list.
+    """
+    return _crc_register_loop(asarray(packed, dtype=uint8).tobytes(), table, W)
+
+def _gather_xor_numpy(x, gather, starts):
+    """Return the (n x len(starts) x Zc) modulo-2 sums of the bits of x gathered by each run of
+    rows of gather.
+    """
+    return bitwise_xor.reduceat(x[:,gather], starts, axis=1)
+
+def _layer_update_numpy(L, R, gather, start, end, algorithm, scale, offset):
+    """Update L and R for the checks of the circulants start to end as one vectorised update
+    over all Zc checks of all of the circulants and all codewords.
+    """
+    # Variable-to-check messages for every check in the layer
+    idx = gather[start:end]
+    Q = L[:,idx] - R[:,start:end]
+
+    # Each check returns the smallest magnitude among its other inputs, which is the second
+    # smallest magnitude for the input holding the smallest, and the product of their signs
+    magnitude = abs(Q)
+    smallest = partition(magnitude, 1, axis=1)
+    min1 = smallest[:,0:1]
+    min2 = smallest[:,1:2]
+    magnitude = where(magnitude == min1, min2, min1)
+
+    if algorithm == 'normalized':
+        magnitude *= scale
+    elif algorithm == 'offset':
+        magnitude = maximum(magnitude - offset, 0)
+
+    negative = Q < 0
+    negative ^= bitwise_xor.reduce(negative, axis=1)[:,None]
+    R_new = where(negative, -magnitude, magnitude)
+
+    L[:,idx] = Q + R_new
+    R[:,start:end] = R_new
+
+### ====================================================================================
+###                                     Numba Kernels
+### ====================================================================================
+
+if backend == 'numba':
+
+    # Compiled kernels release the GIL, so codewords can be decoded on several threads at once,
+    # and are cached on disk so that only the first process to use them pays to compile them
+    _crc_register_jit = njit(nogil=True, cache=True)(_crc_register_loop)
+    _gather_xor_jit = njit(nogil=True, cache=True)(_gather_xor_loop)
+    _layer_update_jit = njit(nogil=True, cache=True)(_layer_update_loop)
+
+    def crc_table(entries):
+        """Return the entries of a CRC lookup table as the int64 array the compiled register
+        takes.
+        """
+        return asarray(entries, dtype=int64)
+
+    def crc_register(packed, table, W):
+        """Return the CRC register after the bytes of packed, shifted through the table. A table
+        from crc_table is used as it is; any other is converted on every call.
+        """
+        return int(_crc_register_jit(asarray(packed, dtype=uint8), asarray(table, dtype=int64), W))
+
+    def gather_xor(x, gather, starts):
+        """Return the (n x len(starts) x Zc) modulo-2 sums of the bits of x gathered by each run
+        of rows of gather.
+        """
+        out = empty((x.shape[0],len(starts),gather.shape[1]), dtype=uint8)
+        _gather_xor_jit(asarray(x, dtype=uint8), gather, asarray(starts), out)
+
+        return out
+
+    def layer_update(L, R, gather, start, end, algorithm, scale, offset):
+        """Update L and R, in place, for the checks of the circulants start to end.
+        """
+        _layer_update_jit(L, R, gather, start, end, _algorithms[algorithm], float32(scale), float32(offset))
+
+else:
+
+    def crc_table(entries):
+        """Return the entries of a CRC lookup table as the list the Python register loop
+        indexes fastest.
+        """
+        return list(entries)
+
+    crc_register = _crc_register_numpy
+    gather_xor = _gather_xor_numpy
+    layer_update = _layer_update_numpy
@@ -1,32 +1,233 @@
-from numpy import array
-from scipy.linalg import lu
+from hashlib import sha1
+from heapq import heapify, heappush, heappop
+from collections import deque, namedtuple
+from numpy import array, asarray, zeros, full, ones, arange, argsort, repeat, flatnonzero, unique, searchsorted, where, \
+    minimum, maximum, clip, log, tanh, packbits, unpackbits, bitwise_xor, bitwise_or, bitwise_count, add, \
+    uint8, uint64, int32, float32, inf
+from scipy.sparse import csr_matrix, csc_matrix
+
+from FecMe.BaseGraph import LRUCache
+from FecMe.PackedBits import to_words, num_words
+from FecMe.Instrumentation import register_cache
+
+### ====================================================================================
+###                                     Encoder
+### ====================================================================================
+
+# Encoder of a PCM brought into approximate lower triangular form. The bits of a codeword at
+# the information set are the message. The gap columns are solved from them with the reduced
+# gap rows, packed into 64-bit words over the columns outside the triangular part (given in
+# order by outside). The triangular part is then solved a level at a time: each entry of
+# levels is the pivot columns of a level alongside the rows of the PCM holding them, without
+# their pivots, and each level depends only on the bits solved before it.
+Encoder = namedtuple('Encoder', ['information_set', 'outside', 'gap_columns', 'gap_rows', 'levels', 'rank'])
+
+# Encoders of large codes are slow to derive, so they're shared between instances of LDPC
+# with the same PCM
+_encoders = LRUCache(maxsize=16)
+register_cache('encoders', _encoders.info)
+
+# Number of columns transposed at a time when packing the gap system
+_transpose_block = 4096
+
+def _triangulate(H):
+    """Greedily permute the rows and columns of a sparse PCM into approximate lower triangular
+    form. Return the (row, column) pivots of the triangular part in order, such that no row
+    involves the pivot column of a later row.
+    See Richardson and Urbanke, "Efficient Encoding of Low-Density Parity-Check Codes", 2001
+    As in erasure decoding, rows with a single unresolved column are peeled off as pivots. When
+    there are none, the unresolved row with the fewest unresolved columns has all but one of
+    them moved outside the triangular part, which keeps the gap small.
+    """
+    m, n = H.shape
+    Hc = csc_matrix(H)
+    row_ptr, row_cols = H.indptr, H.indices
+    col_ptr, col_rows = Hc.indptr, Hc.indices
+
+    # State of each column: 0 unresolved, 1 pivot, 2 outside the triangular part
+    state = zeros((n,), dtype=uint8)
+    degree = (row_ptr[1:] - row_ptr[:-1]).tolist()
+    done = [False] * m
+    ready = deque(r for r in range(m) if degree[r] == 1)
+    heap = [(degree[r], r) for r in range(m) if degree[r] > 1]
+    heapify(heap)
+
+    def resolve(c):
+        # Every unfinished row holding the column has one fewer unresolved column
+        for r in col_rows[col_ptr[c]:col_ptr[c+1]].tolist():
+            if not done[r]:
+                degree[r] -= 1
+                if degree[r] == 1:
+                    ready.append(r)
+                elif degree[r] > 1:
+                    heappush(heap, (degree[r], r))
+
+    pivots = []
+    while True:
+        if ready:
+            r = ready.popleft()
+            if done[r] or degree[r] != 1:
+                continue
+        else:
+            while heap and (done[heap[0][1]] or degree[heap[0][1]] != heap[0][0]):
+                heappop(heap)
+            if not heap:
+                break
+            _, r = heappop(heap)
+
+            unresolved = [c for c in row_cols[row_ptr[r]:row_ptr[r+1]].tolist() if state[c] == 0]
+            for c in unresolved[1:]:
+                state[c] = 2
+                resolve(c)
+
+        c = next(c for c in row_cols[row_ptr[r]:row_ptr[r+1]].tolist() if state[c] == 0)
+        done[r] = True
+        state[c] = 1
+        pivots.append((r, c))
+        resolve(c)
+
+    return pivots
+
+def _gaussian_elimination(rows):
+    """Bring a GF(2) matrix, packed into 64-bit words along its rows, into reduced row echelon
+    form in place. Return the pivot column of each nonzero row, and those rows.
+    """
+    pivots = []
+    for r in range(rows.shape[0]):
+        # Bring a nonzero row into position r
+        if not rows[r].any():
+            nonzero = flatnonzero(rows[r+1:].any(axis=1))
+            if len(nonzero) == 0:
+                break
+            rows[[r, r + 1 + nonzero[0]]] = rows[[r + 1 + nonzero[0], r]]
+
+        # Its leading bit is the pivot, which is cleared from every other row. The row is zero
+        # ahead of the word holding the pivot, so only the words from there on are touched.
+        word = flatnonzero(rows[r])[0]
+        bit = 64 - int(rows[r,word]).bit_length()
+        holding = flatnonzero(rows[:,word] & (uint64(1) << uint64(63 - bit)))
+        holding = holding[holding != r]
+        rows[holding,word:] ^= rows[r,word:]
+        pivots.append(64*word + bit)
+
+    return array(pivots, dtype=int), rows[0:len(pivots)]
+
+def _derive_encoder(H):
+    """Derive the encoder of a sparse PCM. With the PCM in approximate lower triangular form,
+    the rows outside the triangular part are reduced by the triangular rows so that they only
+    involve the columns outside it. Reducing that small system to row echelon form picks the
+    gap columns, and any rows which are left zero are redundant rows of the PCM.
+    """
+    m, n = H.shape
+    Hc = csc_matrix(H)
+    pivots = _triangulate(H)
+    pivot_rows = array([r for r, _ in pivots], dtype=int)
+    pivot_cols = array([c for _, c in pivots], dtype=int)
+
+    # Position in the triangular part of each row and column, or -1 for those outside it
+    row_index = full((m,), -1)
+    row_index[pivot_rows] = arange(len(pivots))
+    col_index = full((n,), -1)
+    col_index[pivot_cols] = arange(len(pivots))
+    other_rows = flatnonzero(row_index < 0)
+    outside = flatnonzero(col_index < 0)
+
+    # Each column's bits in the other rows, packed into words
+    nw = num_words(len(other_rows)) + 1
+    col_bits = zeros((n,nw), dtype=uint64)
+    coo = H[other_rows].tocoo()
+    bitwise_or.at(col_bits, (coo.col, coo.row >> 6), uint64(1) << (uint64(63) - (coo.row & 63).astype(uint64)))
+
+    # The other rows are reduced by adding triangular rows. Working back from the last, Y[j]
+    # marks the other rows to which triangular row j is added, which are those holding its
+    # pivot column once the later triangular rows have been added
+    Y = zeros((len(pivots),nw), dtype=uint64)
+    for j in range(len(pivots) - 1, -1, -1):
+        c = pivot_cols[j]
+        rows = row_index[Hc.indices[Hc.indptr[c]:Hc.indptr[c+1]]]
+        rows = rows[rows > j]
+        Y[j] = col_bits[c]
+        if len(rows):
+            Y[j] ^= bitwise_xor.reduce(Y[rows], axis=0)
+
+    reduced = col_bits[outside]
+    for i, c in enumerate(outside):
+        rows = row_index[Hc.indices[Hc.indptr[c]:Hc.indptr[c+1]]]
+        rows = rows[rows >= 0]
+        if len(rows):
+            reduced[i] ^= bitwise_xor.reduce(Y[rows], axis=0)
+
+    # Transpose the reduced rows to be packed over the outside columns, a block of columns at a
+    # time so as not to unpack them all at once, and reduce them
+    packed = zeros((len(other_rows),(len(outside) + 7) // 8), dtype=uint8)
+    for start in range(0, len(outside), _transpose_block):
+        bits = unpackbits(reduced[start:start+_transpose_block].astype('>u8').view(uint8), axis=1, count=len(other_rows))
+        packed[:,start//8:(start + bits.shape[0] + 7)//8] = packbits(bits.T, axis=1)
+    gap_pivots, gap_rows = _gaussian_elimination(to_words(packed, num_words(len(outside)) + 1))
+    information = ones((len(outside),), dtype=bool)
+    information[gap_pivots] = False
+
+    # Level of each triangular row, one deeper than the deepest triangular row it depends on
+    level = zeros((len(pivots),), dtype=int)
+    for i, r in enumerate(pivot_rows):
+        depends = col_index[H.indices[H.indptr[r]:H.indptr[r+1]]]
+        depends = depends[(depends >= 0) & (depends != i)]
+        if len(depends):
+            level[i] = level[depends].max() + 1
+
+    # Triangular rows grouped by level, without their pivots
+    order = argsort(level, kind='stable')
+    T = H[pivot_rows[order]].tocoo()
+    keep = T.col != pivot_cols[order][T.row]
+    T = csr_matrix((ones((keep.sum(),), dtype=int32), (T.row[keep], T.col[keep])), shape=(len(pivots),n))
+    bounds = searchsorted(level[order], arange(level.max() + 2 if len(pivots) else 0))
+    levels = [(pivot_cols[order[start:end]], T[start:end]) for start, end in zip(bounds[:-1], bounds[1:])]
+
+    return Encoder(outside[information], outside, outside[gap_pivots], gap_rows, levels, len(pivots) + len(gap_pivots))
+
+### ====================================================================================
+###                                     LDPC
+### ====================================================================================
+
+# Largest magnitude of a check-to-variable message, which bounds the messages of checks with a
+# single variable
+_max_llr = 1e6
 
 class LDPC():
+    """Generic LDPC code defined by an arbitrary binary parity check matrix, held in sparse
+    form throughout so that codes with 10^5 columns or more are practical.
+    """
 
     def __init__(self, pcm):
         self.pcm = pcm
 
     def __str__(self):
-        return "({0} x {1}) PCM Matrix\n{2}".format(self.n - self.k, self.n, self.pcm)
-        
+        return "({0} x {1}) PCM Matrix, {2} nonzero entries".format(self.m, self.n, self.pcm.nnz)
+
     ### ====================================================================================
     ###                                     Parameters
     ### ====================================================================================
 
     @property
     def pcm(self):
-        """Getter for the parity check matrix defining the LDPC code.
+        """Getter for the parity check matrix defining the LDPC code, as a CSR sparse matrix.
         """
         return self.__pcm
 
     @pcm.setter
     def pcm(self, pcm):
-        """Setter for the parity check matrix defining the LDPC code. Also preprocess the
-        PCM to get it into row-reduced form.
+        """Setter for the parity check matrix defining the LDPC code, which may be dense or
+        sparse. Entries are taken modulo 2.
         """
-        pl, u = lu(pcm, permute_l=True)
-        self.__pcm = (u % 2).astype(int)
-    
+        H = csr_matrix(pcm, dtype=int32, copy=True)
+        H.sum_duplicates()
+        H.data %= 2
+        H.eliminate_zeros()
+        H.sort_indices()
+        self.__pcm = H.astype(uint8)
+        self.__encoder = None
+        self.__graph = None
+
     ### ====================================================================================
     ###                                 Dependent Variables
     ### ====================================================================================
@@ -37,22 +238,176 @@ class LDPC():
         """
         return self.pcm.shape[1]
 
+    @property
+    def m(self):
+        """Return the number of parity checks, which may include redundant checks.
+        """
+        return self.pcm.shape[0]
+
     @property
     def k(self):
         """Return the dimension of the LDPC code.
         """
-        return self.n - self.pcm.shape[0]
-    
+        return self.n - self.encoder.rank
+
+    @property
+    def encoder(self):
+        """Return the encoder of the code, derived once per PCM and shared between instances.
+        """
+        if self.__encoder is None:
+            H = self.pcm
+            key = sha1(array(H.shape).tobytes() + H.indptr.astype(int).tobytes() + H.indices.astype(int).tobytes()).hexdigest()
+            self.__encoder = _encoders.get(key, lambda: _derive_encoder(H))
+
+        return self.__encoder
+
+    @property
+    def information_set(self):
+        """Return the positions in a codeword which carry the message bits.
+        """
+        return self.encoder.information_set
+
+    @property
+    def graph(self):
+        """Return the Tanner graph of the code as arrays over its edges, ordered by check: the
+        first edge of each check with at least one edge, the variable and check of each edge,
+        the ordering of the edges by variable, and the first of those of each variable with
+        at least one edge along with the variables themselves.
+        """
+        if self.__graph is None:
+            H = self.pcm
+            degree = H.indptr[1:] - H.indptr[:-1]
+            checks = flatnonzero(degree)
+            variables = H.indices.astype(int)
+            by_variable = argsort(variables, kind='stable')
+            connected = unique(variables)
+            self.__graph = (H.indptr[checks], variables, repeat(arange(len(checks)), degree[checks]), by_variable,
+                            searchsorted(variables[by_variable], connected), connected)
+
+        return self.__graph
+
     ### ====================================================================================
     ###                                     Methods
     ### ====================================================================================
 
-    def encode():
-        pass
-    
+    def encode(self, s):
+        """Encode a message of k bits, or a (num_messages x k) array of them, into codewords of
+        n bits, which carry the message at the information set.
+        The gap bits are solved from the message with the reduced gap rows a machine word at a
+        time, then the triangular part is solved by substitution, with each level of rows
+        that only depend on bits already known solved in one sparse product.
+        """
+        s = asarray(s)
+        single = s.ndim == 1
+        s = s.reshape((-1,self.k)) if single else s
+        if s.shape[1] != self.k:
+            raise ValueError("Encoder expects messages of {0} bits, but {1} have been passed".format(self.k, s.shape[1]))
+
+        encoder = self.encoder
+        x = zeros((self.n,s.shape[0]), dtype=uint8)
+        x[encoder.information_set] = s.T > 0
+
+        if len(encoder.gap_columns):
+            v = to_words(packbits(x[encoder.outside].T, axis=1), encoder.gap_rows.shape[1])
+            for i in range(s.shape[0]):
+                x[encoder.gap_columns,i] = bitwise_count(encoder.gap_rows & v[i]).sum(axis=1) & 1
+
+        for cols, rows in encoder.levels:
+            x[cols] = (rows @ x) & 1
+
+        return x[:,0] if single else x.T
+
+    def syndrome(self, cw):
+        """Return the syndromes of a (num_codewords x n) array of codewords.
+        """
+        return (self.pcm @ asarray(cw, dtype=uint8).T).T & 1
+
+    def decode(self, llr, max_iterations=50, algorithm='normalized', scale=0.75, offset=0.5):
+        """Decode a (num_codewords x n) array of log-likelihood ratios, positive for a zero bit,
+        by flooding belief propagation over the sparse Tanner graph. Return the hard-decision
+        codewords, the number of iterations each took, and whether each converged.
+        Messages are held per edge, so memory scales with the number of nonzero entries of the
+        PCM. The checks use the sum-product rule (algorithm='sumproduct'), or min-sum, scaled
+        (normalized) or reduced by an offset (offset), or neither (minsum). Codewords stop
+        once their syndrome is zero.
+        """
+        if algorithm not in ('sumproduct', 'minsum', 'normalized', 'offset'):
+            raise ValueError("Unsupported belief propagation algorithm: {0}".format(algorithm))
+
+        llr = asarray(llr, dtype=float32)
+        if llr.ndim != 2 or llr.shape[1] != self.n:
+            raise ValueError("Decoder expects (num_codewords x {0}) LLRs, but {1} have been passed".format(self.n, llr.shape))
+
+        check_starts, variables, checks, by_variable, variable_starts, connected = self.graph
+        n = llr.shape[0]
+        hard = zeros((n,self.n), dtype=uint8)
+        iterations = zeros((n,), dtype=int)
+        converged = zeros((n,), dtype=bool)
+        if n == 0:
+            return hard, iterations, converged
+
+        active = arange(n)
+        channel = llr
+        total = llr.copy()
+        R = zeros((n,len(variables)), dtype=float32)
+
+        for iteration in range(1, max_iterations+1):
+
+            # Variable-to-check messages
+            Q = total[:,variables] - R
+            magnitude = abs(Q)
+
+            # Check-to-variable messages
+            if algorithm == 'sumproduct':
+                # Sum of phi(x) = -log(tanh(x/2)) over each check, less that of the edge itself
+                phi = -log(tanh(clip(magnitude, 1e-7, 30) / 2))
+                others = add.reduceat(phi, check_starts, axis=1)[:,checks] - phi
+                magnitude = minimum(-log(tanh(clip(others, 1e-7, 30) / 2)), _max_llr)
+            else:
+                min1 = minimum.reduceat(magnitude, check_starts, axis=1)[:,checks]
+                smallest = magnitude == min1
+                masked = where(smallest, inf, magnitude)
+                min2 = minimum.reduceat(masked, check_starts, axis=1)[:,checks]
+                ties = add.reduceat(smallest, check_starts, axis=1, dtype=int32)[:,checks] > 1
+                min2 = minimum(where(ties, min1, min2), _max_llr)
+                magnitude = where(smallest, min2, min1)
+
+                if algorithm == 'normalized':
+                    magnitude *= scale
+                elif algorithm == 'offset':
+                    magnitude = maximum(magnitude - offset, 0)
+
+            negative = Q < 0
+            negative ^= bitwise_xor.reduceat(negative, check_starts, axis=1)[:,checks]
+            R = where(negative, -magnitude, magnitude).astype(float32)
+
+            # Posterior LLRs
+            total = channel.copy()
+            total[:,connected] += add.reduceat(R[:,by_variable], variable_starts, axis=1)
+
+            # Retire the codewords which have finished decoding
+            cw = (total < 0).astype(uint8)
+            stopped = ~bitwise_xor.reduceat(cw[:,variables], check_starts, axis=1).any(axis=1)
+            done = stopped | (iteration == max_iterations)
+            finished = active[done]
+            hard[finished] = cw[done]
+            iterations[finished] = iteration
+            converged[finished] = stopped[done]
+
+            if done.all():
+                break
+            keep = flatnonzero(~done)
+            active = active[keep]
+            channel = channel[keep]
+            total = total[keep]
+            R = R[keep]
+
+        return hard, iterations, converged
+
 
 if __name__ == "__main__":
 
     pcm = array([[1,1,1,1,0,0],[0,0,1,1,0,1],[1,0,0,1,1,0]], dtype=bool)
     ldpc = LDPC(pcm)
     print(ldpc)
+    print(ldpc.encode([1,0,1]))
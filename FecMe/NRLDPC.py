@@ -1,31 +1,183 @@
-from os.path import abspath, dirname
 from math import inf
-from numpy import array, zeros, ceil, nonzero, min, where, argwhere, concatenate, load, identity, roll
+from functools import lru_cache
+from threading import Lock
+from numpy import array, asarray, zeros, empty, full, arange, where, select, argwhere, searchsorted, unique, concatenate, uint64, float32
 import numpy as np
 
-from FecMe.CRC import polynomials, checksum, check
+from FecMe.CRC import polynomials, checksum, check, checksum_batch, check_batch, checksum_packed, checksum_packed_batch
+from FecMe.BaseGraph import lifting_sizes, base_graph, lifted_graph
+from FecMe.Instrumentation import stage, count, samples, register_cache
+from FecMe.PackedBits import pack, to_words, from_words, extract, deposit, num_words, unpack
+
+### ====================================================================================
+###                                 Code Parameters
+### ====================================================================================
+
+class CodeParameters():
+    """Immutable record of the parameters of an NR LDPC code for a given transport block size,
+    A, and base graph number, BGN.
+    See 38.212 Sections 5.2.2 and 5.3.2
+    """
+
+    __slots__ = ('A', 'BGN', 'Kcb', 'B', 'L', 'C', 'Bprime', 'Kprime', 'Kb', 'Zc', 'LiftingSet', 'K', 'N')
+
+    def __init__(self, *values):
+        """Class constructor. Values are given in the order of the slots.
+        """
+        for name, value in zip(CodeParameters.__slots__, values):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CodeParameters are immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("CodeParameters are immutable")
+
+    def __repr__(self):
+        """String representation of CodeParameters object.
+        """
+        return "CodeParameters({0})".format(", ".join("{0}={1}".format(name, getattr(self, name)) for name in CodeParameters.__slots__))
+
+# Sorted lifting sizes and the lifting set each belongs to, used to select the smallest lifting
+# size satisfying Kb.Zc >= K' by bisection
+_sorted_lifting_sizes = unique(lifting_sizes[lifting_sizes > 0])
+_sorted_lifting_sets = array([argwhere(lifting_sizes == Zc)[0][0] for Zc in _sorted_lifting_sizes], dtype=int)
+
+def _code_parameter_arrays(A, BGN):
+    """Derive the code parameters for an array of transport block sizes and a base graph
+    number. Return a dictionary of parameter arrays, keyed by parameter name.
+    """
+    A = asarray(A, dtype=int)
+    if (A <= 0).any():
+        raise ValueError("Number of bits for coding must be greater than zero.")
+    if BGN != 1 and BGN != 2:
+        raise ValueError("Base graph number {0} is not supported.".format(BGN))
+
+    # Maximum code block size
+    Kcb = 8448 if BGN == 1 else 3840
+    # Transport block plus its CRC
+    B = A + 24
+    # Segmented transport blocks get a CRC per codeblock
+    segmented = B > Kcb
+    L = where(segmented, 24, 0)
+    C = where(segmented, -(-B // (Kcb - 24)), 1)
+    Bprime = B + C * L
+    Kprime = Bprime // C
+
+    if BGN == 1:
+        Kb = full(A.shape, 22)
+    else:
+        Kb = select([B > 640, B > 560, B > 192], [10, 9, 8], default=6)
+
+    # Smallest lifting size for which Kb.Zc >= K'
+    i = searchsorted(_sorted_lifting_sizes, -(-Kprime // Kb))
+    if (i >= len(_sorted_lifting_sizes)).any():
+        raise ValueError("No lifting size is large enough for the codeblocks.")
+    Zc = _sorted_lifting_sizes[i]
+
+    return {'A' : A, 'BGN' : full(A.shape, BGN), 'Kcb' : full(A.shape, Kcb), 'B' : B, 'L' : L, 'C' : C,
+            'Bprime' : Bprime, 'Kprime' : Kprime, 'Kb' : Kb, 'Zc' : Zc, 'LiftingSet' : _sorted_lifting_sets[i],
+            'K' : (22 if BGN == 1 else 10) * Zc, 'N' : (66 if BGN == 1 else 50) * Zc}
+
+# Code parameter records are shared by every NRLDPC instance
+_code_parameters = {}
+_code_parameters_lock = Lock()
+
+def precompute_code_parameters(A, BGN=1):
+    """Derive and cache the code parameters for every transport block size in A in one
+    vectorised pass, building a lookup table over the range of sizes in use.
+    """
+    arrays = _code_parameter_arrays(A, BGN)
+    columns = [arrays[name].ravel().tolist() for name in CodeParameters.__slots__]
+    records = {}
+    for values in zip(*columns):
+        record = CodeParameters(*values)
+        records[(record.A, BGN)] = record
+
+    with _code_parameters_lock:
+        _code_parameters.update(records)
+
+def code_parameters(A, BGN=1):
+    """Return the code parameters record for the transport block size and base graph number,
+    deriving it on first request.
+    """
+    record = _code_parameters.get((A, BGN))
+    if record is None:
+        precompute_code_parameters([A], BGN)
+        record = _code_parameters[(A, BGN)]
+
+    return record
+
+### ====================================================================================
+###                                 Rate Matching
+### ====================================================================================
+
+# Numerators of the starting position of each redundancy version in the circular buffer, with
+# the denominator 66 for base graph 1 and 50 for base graph 2.
+# See 38.212 Table 5.4.2.1-2
+_redundancy_versions = {1 : (0, 17, 33, 56), 2 : (0, 13, 25, 43)}
+
+def _starting_position(BGN, Zc, Ncb, rv):
+    """Return the starting position, k0, of redundancy version rv in the circular buffer.
+    See 38.212 Table 5.4.2.1-2
+    """
+    N = (66 if BGN == 1 else 50) * Zc
+
+    return (_redundancy_versions[BGN][rv] * Ncb // N) * Zc
+
+def _rate_matching_lengths(C, G, Qm, NL):
+    """Return the rate-matched output length, E, of each of C codeblocks sharing G bits.
+    See 38.212 Section 5.4.2.1
+    """
+    if G % (NL*Qm):
+        raise ValueError("Number of rate-matched bits {0} must be a multiple of {1}".format(G, NL*Qm))
+
+    symbols = G // (NL*Qm)
+    E = full((C,), NL*Qm*(symbols // C), dtype=int)
+    E[C - symbols % C:] += NL*Qm
+
+    return E
+
+@lru_cache(maxsize=256)
+def _rate_matching_index(BGN, Zc, Kprime, Ncb, E, rv, Qm):
+    """Return the index of the bit of an encoded codeblock, d, which lands at each of the E
+    positions of its rate-matched output, f. Bit selection reads the first Ncb bits of d as a
+    circular buffer from position k0, skipping filler bits, and the bit interleaver then
+    writes the E selected bits row-wise into Qm rows and reads them out column-wise. Both are
+    permutations of positions in d, so they compose into a single gather index.
+    See 38.212 Sections 5.4.2.1 and 5.4.2.2
+    """
+    K = (22 if BGN == 1 else 10) * Zc
+    k0 = _starting_position(BGN, Zc, Ncb, rv)
+
+    # Positions of the circular buffer in reading order, less the filler bits
+    order = (k0 + arange(Ncb)) % Ncb
+    order = order[(order < Kprime - 2*Zc) | (order >= K - 2*Zc)]
+
+    # Bit selection wraps around the circular buffer as many times as E requires
+    index = order[arange(E) % len(order)]
+    # Bit interleaving
+    index = index.reshape((Qm,E//Qm)).T.ravel()
+    index.flags.writeable = False
+
+    return index
+
+register_cache('rate_matching_index', _rate_matching_index.cache_info)
 
 class NRLDPC():
     """New Radio LDPC Encode/Decode.
     """
 
-    lifting_sizes = array(
-        [[2,4,8,16,32,64,128,256],
-         [3,6,12,24,48,96,192,384],
-         [5,10,20,40,80,160,320,0],
-         [7,14,28,56,112,224,0,0],
-         [9,18,36,72,144,288,0,0],
-         [11,22,44,88,176,352,0,0],
-         [13,26,52,104,208,0,0,0],
-         [15,30,60,120,240,0,0,0]], dtype=int)
+    lifting_sizes = lifting_sizes
+
+    # LLR given to filler bits, which are known to be zero, when decoding
+    filler_llr = 1e6
 
     def __init__(self, A, BGN=1):
         """Class constructor.
         """
         self.A = A
         self.BGN = BGN
-        self.BG_cache = None
-        self.PCM_cache = None
         
     def __str__(self):
         """String representation of NRLDPC object.
@@ -48,6 +200,7 @@ class NRLDPC():
         """
         if A > 0:
             self.__A = A
+            self.__params = None
         else:
             raise ValueError("Number of bits for coding must be greater than zero.")
         
@@ -63,6 +216,7 @@ class NRLDPC():
         """
         if BGN == 1 or BGN == 2:
             self.__BGN = BGN
+            self.__params = None
         else:
             raise ValueError("Base graph number {0} is not supported.".format(BGN))
 
@@ -70,178 +224,155 @@ class NRLDPC():
     ###                                 Dependent Variables
     ### ====================================================================================
         
+    @property
+    def params(self):
+        """Return the code parameters record for the transport block size and base graph.
+        Records are shared between instances, so this is a cache lookup at most.
+        """
+        if self.__params is None:
+            self.__params = code_parameters(self.A, self.BGN)
+
+        return self.__params
+
     @property
     def Kcb(self):
         """Return the maximum code block size.
         See 38.212 Section 5.2.2
         """
-        if self.BGN == 1:
-            return 8448
-        else:
-            return 3840
+        return self.params.Kcb
 
     @property
     def B(self):
         """Return the number of bits in the transport block plus the appended CRC.
         """
-        return self.A + 24
+        return self.params.B
 
     @property
     def L(self):
         """Return the number of bits that get appended to each segmented codeblock.
         """
-        if self.B <= self.Kcb:
-            return 0
-        else:
-            return 24
+        return self.params.L
         
     @property
     def C(self):
         """Return the number of codeblocks the transport block is to be segmented into.
         """
-        if self.B <= self.Kcb:
-            return 1
-        else:
-            return int(ceil(self.B / (self.Kcb - self.L)))
+        return self.params.C
 
     @property
     def Bprime(self):
         """Return the total number of bits of all codeblocks combined.
         """
-        return self.B + self.C * self.L
+        return self.params.Bprime
 
     @property
     def Kprime(self):
         """Return the number of bits in each codeblock.
         """
-        return self.Bprime // self.C
+        return self.params.Kprime
 
     @property
     def Kb(self):
         """Return Kb, a parameter which helps us select the lifting size.
         """
-        if self.BGN == 1:
-            return 22
-        elif self.BGN == 2:
-            if self.B > 640:
-                return 10
-            elif self.B > 560:
-                return 9
-            elif self.B > 192:
-                return 8
-            else:
-                return 6
+        return self.params.Kb
 
     @property
     def Zc(self):
         """Return the lifting size for the base graph.
         """
-        local_lifting_sizes = NRLDPC.lifting_sizes
-        # Pull out the indices whose entries don't satisfy the inequality Kb.Zc >= K'
-        sub_threshold_indices = local_lifting_sizes < self.Kprime / self.Kb
-        # Set subthreshold elements to zero
-        local_lifting_sizes[sub_threshold_indices] = 0
-        # Now pull out the smallest non-zero element from the lifting sizes and that's our
-        # desired lifting size
-        lifting_set, z = where(local_lifting_sizes == min(local_lifting_sizes[nonzero(local_lifting_sizes)]))
-
-        return int(local_lifting_sizes[lifting_set,z])
+        return self.params.Zc
         
     @property
     def LiftingSet(self):
         """Return the lifting set for the base graph.
         """
-        local_lifting_sizes = NRLDPC.lifting_sizes
-        lifting_set = argwhere(local_lifting_sizes == self.Zc)[0][0]
-
-        return int(lifting_set)
+        return self.params.LiftingSet
     
     @property
     def K(self):
         """Return the number of bits the encoded codeblock will comprise.
         """
-        if self.BGN == 1:
-            return 22 * self.Zc
-        else:
-            return 10 * self.Zc
+        return self.params.K
+
+    @property
+    def N(self):
+        """Return the number of bits in each encoded codeblock once the leading 2Zc systematic
+        bits have been punctured.
+        """
+        return self.params.N
 
     @property
     def BG(self):
-        """Return the base graph from which the LDPC PCM will be constructed. If the base graph
-        hasn't yet been formed, then explicitly do so, otherwise return the cached base graph.
+        """Return the base graph from which the LDPC PCM will be constructed. Base graphs are
+        loaded once per process and shared between instances.
+        Unpopulated entries of the base graph are marked with -1.
         """
-        if self.BG_cache is None:
-            # Get the path to FecMe/FecMe so we can find the npz file
-            path = abspath(dirname(__file__))
-            # Select the appropriate base graph
-            BGs = load('{0}/NRLDPC_Base_Graphs.npz'.format(path))
-            self.BG_cache = BGs['BaseGraph{0}_LiftingSet{1}'.format(self.BGN, self.LiftingSet)]
+        return base_graph(self.BGN, self.LiftingSet)
+
+    @property
+    def graph(self):
+        """Return the lifted base graph, which holds the PCM in compact form as a list of
+        circulants. Lifted graphs are cached per process and shared between instances.
+        """
+        return lifted_graph(self.BGN, self.LiftingSet, self.Zc)
+
+    @property
+    def PCM_index(self):
+        """Return the parity check matrix in index form, as arrays of the base graph row, base
+        graph column and shift of each of its circulants.
+        """
+        return self.graph.rows, self.graph.cols, self.graph.shifts
+
+    @property
+    def PCM_sparse(self):
+        """Return the parity check matrix (PCM) for the LDPC code as a CSR sparse matrix.
+        """
+        return self.graph.H
 
-        return self.BG_cache
-        
     @property
     def PCM(self):
-        """Return the parity check matrix (PCM) for the LDPC code. If it hasn't yet been created,
-        explicitly make it, otherwise return the cached PCM.
+        """Return the parity check matrix (PCM) for the LDPC code as a dense matrix. This is
+        only practical for small lifting sizes; prefer PCM_sparse or PCM_index otherwise.
         See 38.212 Section 5.3.2, Item (3) for details about construction
         """
-        # If we don't have a PCM in cache, then explicitly construct it
-        if self.PCM_cache is None:
-            
-            bg_nrows = self.BG.shape[0]
-            bg_ncols = self.BG.shape[1]
-
-            # Now our PCM cache contains something, so we won't enter this branch again
-            self.PCM_cache = zeros((bg_nrows*self.Zc,bg_ncols*self.Zc), dtype=int)
-
-            # Loop over each entry in base graph and 
-            for irow in range(bg_nrows):
-                for icol in range(bg_ncols):
-
-                    # If the base graph entry is zero, the PCM receives a null matrix
-                    if self.BG[irow,icol] == 0:
-                        self.PCM_cache[irow*self.Zc:(irow+1)*self.Zc,icol*self.Zc:(icol+1)*self.Zc] = zeros((self.Zc,self.Zc), dtype=int)
-                    # If the base graph entry is nonzero, the PCM receives a cyclically shifted
-                    # identity matrix
-                    else:
-                        shift = self.BG[irow,icol] % self.Zc
-                        self.PCM_cache[irow*self.Zc:(irow+1)*self.Zc,icol*self.Zc:(icol+1)*self.Zc] = roll(identity(self.Zc, dtype=int), shift, axis=1)
-
-        return self.PCM_cache
+        return self.graph.H.toarray().astype(int)
             
         
     ### ====================================================================================
     ###                                     Methods
     ### ====================================================================================
 
-    def segmentation(self, b):
+    def segmentation(self, b, out=None):
         """Segment the transport block (with attached CRC bits) into codeblocks which
         are to be encoded separately.
         See 38.212 Section 5.2.2. for details.
+        The codeblocks are formed as a (C x K) matrix by reshaping the transport block, with the
+        CRC24B checksums of all codeblocks computed in a single batched call. If out is given,
+        the codeblocks are written into it rather than into a newly allocated matrix.
         """
-        # Initialise our segmented codeblocks with zeros
-        c = zeros((self.C,self.K), dtype=int)
-
-        # Counter we manually increment when filling message bits
-        s = 0
-        # Loop over codeblocks we're segmenting the transport block into
-        for r in range(self.C):
-                
-            # Fill the message bits in the codeblock
-            for k in range(self.Kprime - self.L):
-                c[r,k] = b[s]
-                s += 1
-
-            # If we're segmenting the transport block, each codeblock gets its own CRC checksum 
-            if self.C > 1:
-                p = checksum(c[r,0:(self.Kprime - self.L)], polynomial='CRC24B', checksum_fill=0)
-                # Append the checksum bits to the message bits in the codeblock
-                for k in range((self.Kprime-self.L), self.Kprime):
-                    c[r,k] = p[k + self.L - self.Kprime]
-
-            # Pad the remaining bits in the codeblock with filler bits
-            for k in range(self.Kprime, self.K):
-                c[r,k] = -1
+        p = self.params
+        Kmsg = p.Kprime - p.L
+
+        if len(b) != p.C * Kmsg:
+            raise ValueError("Segmentation expects {0} bits, but {1} have been passed".format(p.C * Kmsg, len(b)))
+
+        if out is None:
+            c = empty((p.C,p.K), dtype=int)
+        elif out.shape != (p.C,p.K):
+            raise ValueError("Output buffer has shape {0}, but segmentation requires {1}".format(out.shape, (p.C,p.K)))
+        else:
+            c = out
+
+        # Fill the message bits in all codeblocks at once
+        c[:,0:Kmsg] = b.reshape((p.C,Kmsg))
+
+        # If we're segmenting the transport block, each codeblock gets its own CRC checksum
+        if p.C > 1:
+            c[:,Kmsg:p.Kprime] = checksum_batch(c[:,0:Kmsg], polynomial='CRC24B', checksum_fill=0)
+
+        # Pad the remaining bits in the codeblocks with filler bits
+        c[:,p.Kprime:] = -1
 
         return c
     
@@ -250,69 +381,447 @@ class NRLDPC():
         codewords.
         See 38.212 Section 5.3.2. for details, although the means by which the parity bits are
         derived is not discussed.
+        All codeblocks are encoded at once by the quasi-cyclic encoder of the lifted graph. The
+        first 2Zc systematic bits are punctured from the returned codewords, and filler bits
+        are carried through as -1. If verify is set, the full codewords are checked against
+        the sparse PCM.
         """
-        for r in range(self.C):
-
-            # Extract the codeblock and reshape to a matrix where all rows are lifted segments
-            segs = c[r,:].reshape((-1,self.Zc))
-            # Turn all filler bits to zeros so we don't mess up the encoding
-            segs[segs < 0] = 0
-
-            # Explicitly zero our core parity sections
-            temp_parity = np.zeros((4,self.Zc), dtype=int)
-            core_parity = np.zeros((4,self.Zc), dtype=int)
-
-            # Loop over the "information section" of the base graph, i.e. the first Kb columns
-            for j in range(self.Kb):
-                # Loop over the core parity sections and construct from the information columns
-                for i_core in range(4):
-                    bg_value = self.BG(i_core,j)
-                    if bg_value >= 0:
-                        temp_parity[i_core,:] += np.roll(segs.reshape((1,self.Zc)), -(bg_value % self.Zc))
-
-            if self.BGN == 1:
-                core_parity[0,:] = np.sum(temp_parity, axis=0)
-                
-            else:
-            
+        p = self.params
+        graph = self.graph
+
+        # Filler bits are encoded as zeros
+        cw = graph.encode(c > 0)
+
         # Verify that the produced codeword spans the nullspace of the PCM if we're explicitly
         # verifying the encoding
-        if verify == True:
-            pass
-        
-        pass
+        if verify:
+            if (graph.H @ cw.T % 2).any():
+                raise RuntimeError("Encoded codewords don't satisfy the parity checks")
 
+        d = cw[:,2*p.Zc:].astype(int)
+        d[:,max(p.Kprime-2*p.Zc, 0):p.K-2*p.Zc] = -1
 
-    def encode(self, a):
-        """Take a bitstring and encode it. We return the fully rate-matched output, g, where
-        all segmented code blocks are concatenated.
-        See 38.212 Section 5.5 for the end point of this function.
+        return d
+
+    def filler_mask(self, punctured=False):
+        """Return a boolean mask of the filler bit positions in a codeblock, or in an encoded
+        codeblock once its leading 2Zc bits have been punctured. Packed bitstrings carry their
+        filler bits as zeros alongside this mask.
         """
+        p = self.params
+        offset = 2*p.Zc if punctured else 0
 
+        mask = zeros((p.N if punctured else p.K,), dtype=bool)
+        mask[max(p.Kprime-offset, 0):p.K-offset] = True
 
-        def rate(self, d):
-            def select(self):
-                pass
-            def interleave(self):
-                pass
-            pass
+        return mask
 
-        def concatenation(self, f):
-            pass
-        
+    def segmentation_packed(self, b, out=None):
+        """Packed counterpart of segmentation. Take the transport block (with attached CRC
+        bits) packed into bytes, and return the codeblocks as a (C x ceil(K/8)) array of packed
+        bytes with their filler bits zeroed, along with the filler mask of a codeblock.
+        """
+        p = self.params
+        Kmsg = p.Kprime - p.L
+
+        if p.B != p.C * Kmsg:
+            raise ValueError("Transport block of {0} bits can't be segmented into {1} codeblocks".format(p.B, p.C))
+        if len(b) != (p.B + 7) // 8:
+            raise ValueError("Segmentation expects {0} packed bits, but {1} bytes have been passed".format(p.B, len(b)))
+
+        # Lift the message bits of every codeblock out of the transport block a word at a time
+        b_words = to_words(b, num_words(p.B) + 1)
+        c_words = zeros((p.C,num_words(p.K)+1), dtype=uint64)
+        c_words[:,0:num_words(Kmsg)] = extract(b_words, arange(p.C)*Kmsg, Kmsg)
+
+        # If we're segmenting the transport block, each codeblock gets its own CRC checksum
+        if p.C > 1:
+            packed = from_words(c_words, Kmsg)
+            crc_checksums = checksum_packed_batch(packed, Kmsg, polynomial='CRC24B', checksum_fill=0).astype(uint64)
+            deposit(c_words, (crc_checksums << uint64(40)).reshape((p.C,1,1)), [Kmsg])
+
+        c = from_words(c_words, p.K)
+        if out is not None:
+            out[...] = c
+            c = out
+
+        return c, self.filler_mask()
+
+    def parity_packed(self, c, verify=False):
+        """Packed counterpart of parity. Take the codeblocks as packed bytes, with filler bits
+        zeroed, and return the encoded codeblocks (with their leading 2Zc bits punctured) as a
+        (C x ceil(N/8)) array of packed bytes along with their filler mask. The encoder rotates
+        and sums whole 64-bit words of each lifted segment.
+        """
+        p = self.params
+        graph = self.graph
+        Zc = p.Zc
+
+        # Split the codeblocks into their lifted systematic segments and encode them
+        s = extract(to_words(c, num_words(p.K) + 1), arange(graph.kb)*Zc, Zc)
+        segments = graph.encode_packed(s)
+
+        if verify:
+            cw_words = zeros((p.C,num_words(graph.ncols*Zc)+1), dtype=uint64)
+            deposit(cw_words, segments, arange(graph.ncols)*Zc)
+            cw = unpack(from_words(cw_words, graph.ncols*Zc), graph.ncols*Zc)
+            if (graph.H @ cw.T % 2).any():
+                raise RuntimeError("Encoded codewords don't satisfy the parity checks")
+
+        # Reassemble the codewords from all but the two punctured segments
+        d_words = zeros((p.C,num_words(p.N)+1), dtype=uint64)
+        deposit(d_words, segments[:,2:], arange(graph.ncols-2)*Zc)
+
+        return from_words(d_words, p.N), self.filler_mask(punctured=True)
+
+    def encode_packed(self, a):
+        """Packed counterpart of the encoder. Take the transport block packed into bytes and
+        return the encoded codeblocks as packed bytes, along with their filler mask.
+        """
+        p = self.params
+
+        if len(a) != (self.A + 7) // 8:
+            raise ValueError("Encoder has been parameterised for {0} packed bits, but {1} bytes have been passed".format(self.A, len(a)))
+
+        # Append the transport block CRC
+        b_words = to_words(a, num_words(p.B) + 1)
+        crc_checksum = uint64(checksum_packed(a, self.A, polynomial='CRC24A', checksum_fill=0))
+        deposit(b_words, (crc_checksum << uint64(40)).reshape((1,1)), [self.A])
+
+        c, _ = self.segmentation_packed(from_words(b_words, p.B))
+
+        return self.parity_packed(c)
+
+    def decode(self, llr, max_iterations=25, algorithm='normalized', scale=0.75, offset=0.5, early_stop='syndrome'):
+        """Decode the encoded codeblocks of a transport block from a (C x N) array of LLRs, one
+        per bit of d (positive for a zero bit), and return the (C x K) hard-decision codeblocks
+        with filler bits as -1, the number of iterations spent on each codeblock and whether
+        each codeblock decoded successfully.
+        All codeblocks are decoded as a batch by layered min-sum over the lifted graph; see
+        LiftedGraph.decode for the algorithms. The punctured bits are decoded from zero LLRs
+        and the filler bits are pinned to zero. A codeblock stops early once its syndrome is
+        zero (early_stop='syndrome') or once its CRC passes (early_stop='crc'), which is the
+        CRC24B of the codeblock, or the CRC24A of the transport block if it isn't segmented.
+        Otherwise (early_stop=None) every codeblock runs for max_iterations.
+        Any number of codeblocks of the code may be passed as rows of llr, so that a subset of
+        the codeblocks of a transport block, or those of several, can be decoded together.
+        """
+        p = self.params
+        graph = self.graph
+
+        if llr.ndim != 2 or llr.shape[1] != p.N:
+            raise ValueError("Decoder expects ({0} x {1}) LLRs, but {2} have been passed".format(p.C, p.N, llr.shape))
+
+        full_llr = zeros((llr.shape[0],graph.ncols*p.Zc), dtype=float32)
+        full_llr[:,2*p.Zc:] = llr
+        full_llr[:,p.Kprime:p.K] = NRLDPC.filler_llr
+
+        if early_stop == 'syndrome':
+            stop = None
+        elif early_stop == 'crc':
+            polynomial = 'CRC24B' if p.C > 1 else 'CRC24A'
+            stop = lambda cw: check_batch(cw[:,0:p.Kprime], polynomial=polynomial)
+        elif early_stop is None:
+            stop = lambda cw: zeros((cw.shape[0],), dtype=bool)
+        else:
+            raise ValueError("Unsupported early stopping criterion: {0}".format(early_stop))
+
+        with stage('decode', llr.shape[0] * p.Kprime // 8):
+            hard, iterations, converged = graph.decode(full_llr, max_iterations=max_iterations, algorithm=algorithm,
+                                                       scale=scale, offset=offset, stop=stop)
+        samples('decode_iterations', iterations)
+        if early_stop is None:
+            converged = ~graph.syndrome(hard).any(axis=1)
+
+        c = hard[:,0:p.K].astype(int)
+        c[:,p.Kprime:] = -1
+
+        return c, iterations, converged
+
+    def decode_packed(self, llr, **kwargs):
+        """Packed counterpart of decode. Return the hard-decision codeblocks as a (C x ceil(K/8))
+        array of packed bytes, with filler bits zeroed, alongside the number of iterations
+        spent on each codeblock and whether each decoded successfully.
+        """
+        c, iterations, converged = self.decode(llr, **kwargs)
+
+        return pack(c), iterations, converged
+
+    def desegmentation(self, c):
+        """Reassemble the transport block, with its attached CRC bits, from the (C x K)
+        codeblocks. This is the inverse of segmentation.
+        See 38.212 Section 5.2.2. for details.
+        """
+        p = self.params
+
+        return c[:,0:p.Kprime-p.L].ravel()
+
+    def circular_buffer_size(self, Nref=None):
+        """Return the length, Ncb, of the circular buffer used for rate matching. With limited
+        buffer rate matching the buffer is capped at Nref = floor(TBS_LBRM / (C.R_LBRM)), where
+        R_LBRM = 2/3; otherwise (Nref=None) it spans the whole encoded codeblock.
+        See 38.212 Section 5.4.2.1
+        """
+        return self.N if Nref is None else min(self.N, Nref)
+
+    def rate_matching_lengths(self, G, Qm=2, NL=1):
+        """Return the rate-matched output length, E, of each codeblock when the transport block
+        is carried in G bits by NL layers with Qm bits per modulation symbol. The lengths are
+        multiples of NL.Qm and differ by NL.Qm at most.
+        See 38.212 Section 5.4.2.1
+        """
+        return _rate_matching_lengths(self.C, G, Qm, NL)
+
+    def rate_matching(self, d, G, Qm=2, rv=0, NL=1, Nref=None):
+        """Rate match the (C x N) encoded codeblocks into G bits, returning the concatenated
+        output, g, of bit selection and bit interleaving of each codeblock.
+        See 38.212 Sections 5.4.2 and 5.5
+        Each codeblock is rate matched with one gather through a precomputed index, which is
+        cached per code, output length, redundancy version and modulation order.
+        """
+        p = self.params
+
+        if d.shape != (p.C,p.N):
+            raise ValueError("Rate matching expects ({0} x {1}) encoded bits, but {2} have been passed".format(p.C, p.N, d.shape))
+        if rv not in (0, 1, 2, 3):
+            raise ValueError("Redundancy version {0} is not supported".format(rv))
+
+        Ncb = self.circular_buffer_size(Nref)
+        E = self.rate_matching_lengths(G, Qm, NL)
+
+        g = empty((G,), dtype=d.dtype)
+        start = 0
+        for r in range(p.C):
+            index = _rate_matching_index(p.BGN, p.Zc, p.Kprime, Ncb, int(E[r]), rv, Qm)
+            g[start:start+E[r]] = d[r,index]
+            start += E[r]
+
+        return g
+
+    def rate_dematching(self, llr, Qm=2, rv=0, NL=1, Nref=None, out=None):
+        """Invert rate matching on the G LLRs of a transport block, returning the (C x N) LLRs
+        of the encoded codeblocks. LLRs of bits selected more than once are summed, and bits
+        which weren't transmitted, along with the filler bits, are left at zero. If out is
+        given, the LLRs are soft-combined into it, so that it can serve as the HARQ buffer
+        across redundancy versions and retransmissions.
+        See 38.212 Section 5.4.2 for the rate matching this inverts.
+        """
+        p = self.params
+        llr = asarray(llr, dtype=float32)
+
+        if rv not in (0, 1, 2, 3):
+            raise ValueError("Redundancy version {0} is not supported".format(rv))
+
+        if out is None:
+            out = zeros((p.C,p.N), dtype=float32)
+        elif out.shape != (p.C,p.N):
+            raise ValueError("HARQ buffer has shape {0}, but rate dematching requires {1}".format(out.shape, (p.C,p.N)))
+
+        Ncb = self.circular_buffer_size(Nref)
+        E = self.rate_matching_lengths(len(llr), Qm, NL)
+
+        with stage('rate_dematching', len(llr) // 8):
+            start = 0
+            for r in range(p.C):
+                index = _rate_matching_index(p.BGN, p.Zc, p.Kprime, Ncb, int(E[r]), rv, Qm)
+                np.add.at(out[r], index, llr[start:start+E[r]])
+                start += E[r]
+
+        return out
+
+    def encode(self, a, G, Qm=2, rv=0, NL=1, Nref=None):
+        """Take a bitstring and encode it. We return the fully rate-matched output, g, of G bits,
+        where all segmented code blocks are concatenated.
+        See 38.212 Section 5.5 for the end point of this function.
+        """
         # Make sure we're not trying to encode something that doesn't belong
         if len(a) != self.A:
             raise ValueError("Encoder has been parameterised for {0} bits, but {1} have been passed".format(self.A, len(a)))
 
         # QQ: Not sure if this is the right polynomial. Can't find it in the spec...
-        b = concatenate((a, checksum(a, polynomial='CRC24A', checksum_fill=0)))
+        with stage('crc', len(a) // 8):
+            b = concatenate((a, checksum(a, polynomial='CRC24A', checksum_fill=0)))
         # Transport block segmentation
-        c = self.segmentation(b)
+        with stage('segmentation', len(b) // 8):
+            c = self.segmentation(b)
         # Generate parity bits for each codeblock
-        d = parity(self, c)
-        # Rate matching
-        f = rate(self, d)
-        # Codeblock concatenation
-        g = concatenation(self, f)
+        with stage('parity', c.size // 8):
+            d = self.parity(c)
+        # Rate matching and codeblock concatenation
+        with stage('rate_matching', d.size // 8):
+            g = self.rate_matching(d, G, Qm=Qm, rv=rv, NL=NL, Nref=Nref)
 
         return g
+
+
+### ====================================================================================
+###                               Batched Transport Blocks
+### ====================================================================================
+
+def _per_transport_block(value, n, name):
+    """Broadcast a parameter given once for a slot, or once per transport block, to a list
+    with an entry for each of the n transport blocks.
+    """
+    if isinstance(value, (list, tuple)) or hasattr(value, 'shape'):
+        if len(value) != n:
+            raise ValueError("{0} has {1} entries, but {2} transport blocks have been passed".format(name, len(value), n))
+        return [v.item() if hasattr(v, 'item') else v for v in value]
+
+    return [value] * n
+
+def _padded_checksums(bitstrings, polynomial):
+    """Compute the checksums of bitstrings of varying length in one batched call. A checksum
+    without a fill is unchanged by leading zeros, so the bitstrings are stacked right-aligned
+    behind zeros to the length of the longest.
+    """
+    width = max(len(bits) for bits in bitstrings)
+    padded = zeros((len(bitstrings),width), dtype=int)
+    for i, bits in enumerate(bitstrings):
+        padded[i,width-len(bits):] = bits
+
+    return checksum_batch(padded, polynomial=polynomial, checksum_fill=0)
+
+def _group_transport_blocks(A, G, BGN, Qm, rv, NL, Nref):
+    """Resolve the code parameters of every transport block in a slot and group the
+    transport blocks by lifted graph, which is the (BGN, Zc) of their codes. Return the
+    per-transport-block parameter records and, for each group, the indices of its transport
+    blocks, the first row of each of their codeblocks in the stacked codeblocks of the group,
+    and the gather index which rate matches the stacked codewords of the group into the
+    concatenated outputs of its transport blocks.
+    """
+    n = len(A)
+    G, BGN, Qm, rv, NL, Nref = (_per_transport_block(value, n, name) for value, name in
+                                ((G, 'G'), (BGN, 'BGN'), (Qm, 'Qm'), (rv, 'rv'), (NL, 'NL'), (Nref, 'Nref')))
+    if any(r not in (0, 1, 2, 3) for r in rv):
+        raise ValueError("Redundancy versions must be one of 0, 1, 2 or 3")
+
+    params = [code_parameters(A[i], BGN[i]) for i in range(n)]
+
+    groups = {}
+    for i, p in enumerate(params):
+        groups.setdefault((p.BGN, p.Zc), []).append(i)
+
+    batches = []
+    for (bgn, Zc), members in groups.items():
+        p0 = params[members[0]]
+        width = (68 if bgn == 1 else 52) * Zc
+
+        rows = []
+        index = []
+        row = 0
+        for i in members:
+            p = params[i]
+            Ncb = p.N if Nref[i] is None else min(p.N, Nref[i])
+            for r, E in enumerate(_rate_matching_lengths(p.C, G[i], Qm[i], NL[i])):
+                # Rate matching indexes d, which starts 2Zc bits into the full codeword
+                index.append(_rate_matching_index(bgn, Zc, p.Kprime, Ncb, int(E), rv[i], Qm[i]) + (row + r)*width + 2*Zc)
+            rows.append(row)
+            row += p.C
+
+        batches.append((lifted_graph(bgn, p0.LiftingSet, Zc), members, rows, row, concatenate(index)))
+
+    return params, G, batches
+
+def encode_batch(transport_blocks, G, BGN=1, Qm=2, rv=0, NL=1, Nref=None):
+    """Encode the transport blocks of a slot, which may be of different sizes, in one call.
+    Return a list holding the rate-matched output, g, of each transport block as uint8 bits;
+    these hold the same bits as NRLDPC.encode, which returns them as ints. An empty slot
+    gives an empty list.
+    G, BGN, Qm, rv, NL and Nref may each be given once for the whole slot or as a sequence
+    with an entry per transport block; see NRLDPC.encode for their meanings.
+    Transport blocks sharing a lifted graph are encoded together: the CRCs of all their
+    codeblocks are computed in batched calls, their codeblocks are stacked and encoded in a
+    single call, and they are rate matched and concatenated by a single gather, so that the
+    Python overhead is paid per lifted graph rather than per transport block.
+    """
+    transport_blocks = [asarray(a) for a in transport_blocks]
+    if not transport_blocks:
+        return []
+    params, G, batches = _group_transport_blocks([len(a) for a in transport_blocks], G, BGN, Qm, rv, NL, Nref)
+
+    # Transport block CRCs for the whole slot
+    with stage('crc', sum(len(a) for a in transport_blocks) // 8):
+        b = [concatenate((a, crc_checksum)) for a, crc_checksum in zip(transport_blocks, _padded_checksums(transport_blocks, 'CRC24A'))]
+
+    g = [None] * len(transport_blocks)
+    for graph, members, rows, num_rows, index in batches:
+        K = graph.kb * graph.Zc
+        c = zeros((num_rows,K), dtype=bool)
+
+        # Segmentation, with the codeblock CRCs of every segmented transport block in one call
+        with stage('segmentation', sum(len(b[i]) for i in members) // 8):
+            segmented = []
+            for i, row in zip(members, rows):
+                p = params[i]
+                Kmsg = p.Kprime - p.L
+                if p.B != p.C * Kmsg:
+                    raise ValueError("Transport block of {0} bits can't be segmented into {1} codeblocks".format(p.B, p.C))
+                c[row:row+p.C,0:Kmsg] = b[i].reshape((p.C,Kmsg))
+                if p.C > 1:
+                    segmented.extend((row + r, Kmsg, p.Kprime) for r in range(p.C))
+
+            if segmented:
+                crc_checksums = _padded_checksums([c[row,0:Kmsg] for row, Kmsg, _ in segmented], 'CRC24B')
+                for (row, Kmsg, Kprime), crc_checksum in zip(segmented, crc_checksums):
+                    c[row,Kmsg:Kprime] = crc_checksum
+
+        # Encode every codeblock of the group, then rate match and concatenate them all at once
+        with stage('parity', c.size // 8):
+            d = graph.encode(c)
+        with stage('rate_matching', d.size // 8):
+            f = d.ravel()[index]
+
+        start = 0
+        for i in members:
+            g[i] = f[start:start+G[i]]
+            start += G[i]
+
+    return g
+
+def decode_batch(llrs, A, BGN=1, Qm=2, rv=0, NL=1, Nref=None, max_iterations=25, algorithm='normalized', scale=0.75, offset=0.5):
+    """Decode the transport blocks of a slot from the LLRs of their rate-matched outputs, one
+    array of G LLRs (positive for a zero bit) per transport block of A bits, in one call.
+    Return a list of the decoded transport blocks, whether each passed its CRC, and the most
+    iterations spent on any codeblock of each transport block.
+    Parameters may be given once for the whole slot or per transport block, as for
+    encode_batch. Transport blocks sharing a lifted graph are rate dematched by a single
+    scatter and their codeblocks decoded as one batch, each stopping on a zero syndrome.
+    An empty slot gives empty results.
+    """
+    llrs = [asarray(llr, dtype=float32) for llr in llrs]
+    if not llrs:
+        return [], zeros((0,), dtype=bool), zeros((0,), dtype=int)
+    A = _per_transport_block(A, len(llrs), 'A')
+    params, G, batches = _group_transport_blocks(A, [len(llr) for llr in llrs], BGN, Qm, rv, NL, Nref)
+
+    a = [None] * len(llrs)
+    iterations = zeros((len(llrs),), dtype=int)
+    for graph, members, rows, num_rows, index in batches:
+        Zc = graph.Zc
+        K = graph.kb * Zc
+
+        # Rate dematching with soft combining of repeated bits, leaving the punctured bits at zero
+        with stage('rate_dematching', len(index) // 8):
+            full_llr = zeros((num_rows,graph.ncols*Zc), dtype=float32)
+            np.add.at(full_llr.ravel(), index, concatenate([llrs[i] for i in members]))
+            for i, row in zip(members, rows):
+                full_llr[row:row+params[i].C,params[i].Kprime:K] = NRLDPC.filler_llr
+
+        with stage('decode', sum(params[i].C * params[i].Kprime for i in members) // 8):
+            hard, cb_iterations, _ = graph.decode(full_llr, max_iterations=max_iterations, algorithm=algorithm,
+                                                  scale=scale, offset=offset)
+        samples('decode_iterations', cb_iterations)
+
+        # Desegmentation
+        for i, row in zip(members, rows):
+            p = params[i]
+            a[i] = hard[row:row+p.C,0:p.Kprime-p.L].ravel()
+            iterations[i] = cb_iterations[row:row+p.C].max()
+
+    # Transport block CRCs for the whole slot
+    with stage('crc', sum(A) // 8):
+        crc_checksums = _padded_checksums([b[0:n] for b, n in zip(a, A)], 'CRC24A')
+        passed = array([(b[n:] == crc_checksum).all() for b, n, crc_checksum in zip(a, A, crc_checksums)], dtype=bool)
+    count('crc_failures', int((~passed).sum()))
+
+    return [b[0:n] for b, n in zip(a, A)], passed, iterations
@@ -0,0 +1,107 @@
+### FILE: PackedBits.py
+### AUTHOR: Salvatore Cardamone
+### DESCRIPTION: Bitstrings packed most-significant-bit first into bytes and 64-bit words
+
+from numpy import asarray, ascontiguousarray, packbits, unpackbits, zeros, arange, bitwise_or, uint8, uint64
+
+# All ones in a 64-bit word, used to build masks for the trailing bits of a bitstring
+_ones = uint64(0xFFFFFFFFFFFFFFFF)
+
+def pack(bits):
+    """Pack an array of bits along its last axis into bytes, most significant bit first. Any
+    nonpositive entry, such as a -1 filler bit, is packed as a zero.
+    """
+    return packbits(asarray(bits) > 0, axis=-1)
+
+def unpack(packed, nbits):
+    """Unpack the first nbits bits along the last axis of an array of packed bytes.
+    """
+    return unpackbits(asarray(packed, dtype=uint8), axis=-1, count=nbits).astype(int)
+
+def num_words(nbits):
+    """Return the number of 64-bit words needed to hold nbits bits.
+    """
+    return (nbits + 63) // 64
+
+def to_words(packed, nwords=None):
+    """Convert an array of packed bytes into native 64-bit words along its last axis. Bits keep
+    their order, so the first bit of the bitstring is the most significant bit of the first
+    word. By default the words are followed by a zero guard word, which lets windows be
+    extracted right up to the end of the bitstring.
+    """
+    packed = asarray(packed, dtype=uint8)
+    nbytes = packed.shape[-1]
+    if nwords is None:
+        nwords = (nbytes + 7) // 8 + 1
+
+    buf = zeros(packed.shape[:-1] + (8*nwords,), dtype=uint8)
+    buf[...,0:nbytes] = packed
+
+    return buf.view('>u8').astype(uint64)
+
+def from_words(words, nbits):
+    """Convert an array of 64-bit words back into the packed bytes holding its first nbits bits.
+    """
+    return ascontiguousarray(words.astype('>u8')).view(uint8)[...,0:(nbits + 7) // 8]
+
+def tail_mask(nbits):
+    """Return the mask which keeps the bits of the final word of an nbits-bit bitstring.
+    """
+    tail = nbits % 64
+
+    return _ones if tail == 0 else _ones << uint64(64 - tail)
+
+def extract(words, offsets, nbits):
+    """Extract an nbits-bit window starting at each of the given bit offsets from a bitstream of
+    64-bit words, which must carry a guard word beyond its final window. Windows are returned
+    as (..., len(offsets), num_words(nbits)) words, left-aligned with their trailing bits zeroed.
+    """
+    offsets = asarray(offsets)
+    nw = num_words(nbits)
+
+    q = (offsets >> 6)[:,None] + arange(nw)[None,:]
+    r = (offsets & 63).astype(uint64)[:,None]
+
+    # Splice each word of the window from the tail of one stream word and the head of the next.
+    # The right shift is split in two so that an aligned window doesn't shift by a full word.
+    windows = (words[...,q] << r) | ((words[...,q+1] >> (uint64(63) - r)) >> uint64(1))
+    windows[...,-1] &= tail_mask(nbits)
+
+    return windows
+
+def deposit(words, windows, offsets):
+    """Write left-aligned windows, with their trailing bits zeroed, into a zeroed bitstream of
+    64-bit words at the given bit offsets. The bitstream must carry a guard word beyond its
+    final window. This is the inverse of extract for non-overlapping windows.
+    """
+    offsets = asarray(offsets)
+    nw = windows.shape[-1]
+
+    q = (offsets >> 6)[:,None] + arange(nw)[None,:]
+    r = (offsets & 63).astype(uint64)[:,None]
+
+    lead = tuple(arange(n).reshape((-1,) + (1,)*(windows.ndim - 1 - i)) for i, n in enumerate(windows.shape[:-2]))
+    bitwise_or.at(words, lead + (q,), windows >> r)
+    bitwise_or.at(words, lead + (q+1,), (windows << (uint64(63) - r)) << uint64(1))
+
+    return words
+
+def rotate(segments, shifts, nbits):
+    """Cyclically rotate each nbits-bit segment of a (num_bitstrings x num_segments x words)
+    array towards its most significant end by the corresponding entry of shifts, so that bit k
+    of a rotated segment is bit (k + shift) mod nbits of the original.
+    """
+    n, m, nw = segments.shape
+    shifts = asarray(shifts)
+
+    # Lay each segment out behind a zeroed lead-in of the same size, so that a window starting
+    # shift bits into the segment and a window ending shift bits into it give the two halves of
+    # the rotation. The lead-in of the next segment, or a zeroed tail after the last segment,
+    # supplies the zeros shifted in behind the first half.
+    stride = 2*nw
+    buf = zeros((n, m*stride + nw + 1), dtype=uint64)
+    buf[:,0:m*stride].reshape((n, m, stride))[:,:,nw:] = segments
+
+    base = 64 * (arange(m) * stride + nw)
+
+    return extract(buf, base + shifts, nbits) | extract(buf, base + shifts - nbits, nbits)
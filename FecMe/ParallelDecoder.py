@@ -0,0 +1,230 @@
+### FILE: ParallelDecoder.py
+### AUTHOR: Salvatore Cardamone
+### DESCRIPTION: Decode NR LDPC codeblocks across a pool of worker processes
+
+import os
+from time import perf_counter
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from multiprocessing.shared_memory import SharedMemory
+from numpy import ndarray, asarray, zeros, linspace, concatenate, int8, int32, float32
+
+from FecMe.BaseGraph import warm_up
+from FecMe.NRLDPC import NRLDPC
+
+### ====================================================================================
+###                                 Shared Buffers
+### ====================================================================================
+
+# Arrays are laid out in shared memory on cache line boundaries
+_alignment = 64
+
+def _layout(n, N, K):
+    """Return the (offset, shape, dtype) of the LLR input and the hard-decision, iteration
+    and convergence outputs of n codeblocks, laid out back to back in one shared buffer,
+    along with the total size of the buffer in bytes.
+    """
+    arrays = (((n,N), float32), ((n,K), int8), ((n,), int32), ((n,), bool))
+
+    layout = []
+    offset = 0
+    for shape, dtype in arrays:
+        layout.append((offset, shape, dtype))
+        nbytes = int(zeros((), dtype=dtype).itemsize) * int(asarray(shape).prod())
+        offset += -(-nbytes // _alignment) * _alignment
+
+    return layout, max(offset, 1)
+
+def _views(buf, layout):
+    """Return the arrays of a layout as views into a shared buffer.
+    """
+    return [ndarray(shape, dtype=dtype, buffer=buf, offset=offset) for offset, shape, dtype in layout]
+
+### ====================================================================================
+###                                     Workers
+### ====================================================================================
+
+WorkerStats = namedtuple('WorkerStats', ['pid', 'calls', 'codeblocks', 'seconds', 'throughput'])
+
+# State of a worker process: the shared buffer it's attached to and its running totals
+_worker = {'buffer' : None, 'calls' : 0, 'codeblocks' : 0, 'seconds' : 0.0}
+
+def _initialise_worker(BGNs):
+    """Initialise a worker process, building the lifted graphs of the given base graphs up
+    front so that no decode pays for them.
+    """
+    warm_up(BGNs)
+
+def _attach(name):
+    """Return the shared buffer of the given name, reusing the attachment from the previous
+    call when the decoder hasn't had to grow its buffer since.
+    """
+    buffer = _worker['buffer']
+    if buffer is None or buffer.name != name:
+        if buffer is not None:
+            buffer.close()
+        buffer = SharedMemory(name=name)
+        _worker['buffer'] = buffer
+
+    return buffer
+
+def _decode_chunk(name, n, A, BGN, start, stop, kwargs):
+    """Decode rows start to stop of the LLRs in the named shared buffer, which holds n
+    codeblocks of the code for transport block size A and base graph BGN, writing the
+    results into the same buffer. Return the statistics of this worker.
+    """
+    t0 = perf_counter()
+
+    ldpc = NRLDPC(A, BGN)
+    llr, c, iterations, converged = _views(_attach(name).buf, _layout(n, ldpc.N, ldpc.K)[0])
+    c[start:stop], iterations[start:stop], converged[start:stop] = ldpc.decode(llr[start:stop], **kwargs)
+
+    _worker['calls'] += 1
+    _worker['codeblocks'] += stop - start
+    _worker['seconds'] += perf_counter() - t0
+
+    return os.getpid(), _worker['calls'], _worker['codeblocks'], _worker['seconds']
+
+### ====================================================================================
+###                                     Decoder
+### ====================================================================================
+
+class ParallelDecoder():
+    """Decode NR LDPC codeblocks across a pool of persistent worker processes, which sidesteps
+    the GIL held by the Python and much of the NumPy work of the decoder. Workers build the
+    lifted graphs when they start, and the LLRs and decoded bits pass through a shared memory
+    buffer rather than being pickled; only the code parameters and row ranges are sent.
+    The buffer is kept between calls and grown when a larger batch arrives.
+    """
+
+    def __init__(self, workers=None, BGNs=(1,2), chunks_per_worker=1):
+        """Class constructor. By default there's one worker per core.
+        """
+        self.workers = workers or os.cpu_count()
+        self.chunks_per_worker = chunks_per_worker
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_initialise_worker, initargs=(BGNs,))
+        self.buffer = None
+        self.stats_by_pid = {}
+
+    def __str__(self):
+        """String representation of ParallelDecoder object.
+        """
+        return "ParallelDecoder: {0} workers".format(self.workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def shutdown(self):
+        """Stop the worker processes and release the shared buffer.
+        """
+        self.executor.shutdown()
+        if self.buffer is not None:
+            self.buffer.close()
+            self.buffer.unlink()
+            self.buffer = None
+
+    def _reserve(self, nbytes):
+        """Return a shared buffer of at least nbytes bytes, replacing the current one if it's
+        too small.
+        """
+        if self.buffer is None or self.buffer.size < nbytes:
+            if self.buffer is not None:
+                self.buffer.close()
+                self.buffer.unlink()
+            self.buffer = SharedMemory(create=True, size=nbytes)
+
+        return self.buffer
+
+    def decode(self, ldpc, llr, **kwargs):
+        """Decode the codeblocks of an NRLDPC code from an (n x N) array of LLRs, splitting the
+        rows between the workers. Return the hard-decision codeblocks, the iterations spent on
+        each and whether each converged, as NRLDPC.decode does; keyword arguments are passed
+        through to it.
+        """
+        n = llr.shape[0]
+        if llr.ndim != 2 or llr.shape[1] != ldpc.N:
+            raise ValueError("Decoder expects (n x {0}) LLRs, but {1} have been passed".format(ldpc.N, llr.shape))
+
+        layout, nbytes = _layout(n, ldpc.N, ldpc.K)
+        buffer = self._reserve(nbytes)
+        shared_llr, c, iterations, converged = _views(buffer.buf, layout)
+        shared_llr[...] = llr
+
+        # Contiguous, evenly sized chunks of rows
+        bounds = linspace(0, n, min(n, self.workers * self.chunks_per_worker) + 1).astype(int)
+        futures = [self.executor.submit(_decode_chunk, buffer.name, n, ldpc.A, ldpc.BGN, int(start), int(stop), kwargs)
+                   for start, stop in zip(bounds[:-1], bounds[1:])]
+        wait(futures)
+
+        for future in futures:
+            pid, calls, codeblocks, seconds = future.result()
+            previous = self.stats_by_pid.get(pid)
+            if previous is None or previous[0] < calls:
+                self.stats_by_pid[pid] = (calls, codeblocks, seconds)
+
+        result = (c.astype(int), iterations.astype(int), converged.copy())
+        del shared_llr, c, iterations, converged
+
+        return result
+
+    def stats(self):
+        """Return the statistics of each worker which has decoded codeblocks: the number of
+        calls it has served, the codeblocks it has decoded, the seconds it has spent decoding
+        and its throughput in codeblocks per second.
+        """
+        return [WorkerStats(pid, calls, codeblocks, seconds, codeblocks / seconds if seconds > 0 else 0.0)
+                for pid, (calls, codeblocks, seconds) in sorted(self.stats_by_pid.items())]
+
+### ====================================================================================
+###                                 Threaded Decoder
+### ====================================================================================
+
+class ThreadedDecoder():
+    """Decode NR LDPC codeblocks across a pool of threads in this process. The layer updates
+    hold the GIL with the NumPy kernels for much of their time, but release it throughout with
+    the compiled kernels (see FecMe.Kernels), so that the threads scale across cores without
+    the shared memory or worker start-up of ParallelDecoder.
+    """
+
+    def __init__(self, workers=None):
+        """Class constructor. By default there's one thread per core.
+        """
+        self.workers = workers or os.cpu_count()
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+
+    def __str__(self):
+        """String representation of ThreadedDecoder object.
+        """
+        return "ThreadedDecoder: {0} threads".format(self.workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def shutdown(self):
+        """Stop the threads.
+        """
+        self.executor.shutdown()
+
+    def decode(self, ldpc, llr, **kwargs):
+        """Decode the codeblocks of an NRLDPC code from an (n x N) array of LLRs, splitting the
+        rows between the threads. Return the hard-decision codeblocks, the iterations spent on
+        each and whether each converged, as NRLDPC.decode does; keyword arguments are passed
+        through to it.
+        """
+        n = llr.shape[0]
+        if llr.ndim != 2 or llr.shape[1] != ldpc.N:
+            raise ValueError("Decoder expects (n x {0}) LLRs, but {1} have been passed".format(ldpc.N, llr.shape))
+        if n == 0:
+            return ldpc.decode(llr, **kwargs)
+
+        bounds = linspace(0, n, min(n, self.workers) + 1).astype(int)
+        futures = [self.executor.submit(ldpc.decode, llr[start:stop], **kwargs) for start, stop in zip(bounds[:-1], bounds[1:])]
+        results = [future.result() for future in futures]
+
+        return tuple(concatenate(arrays) for arrays in zip(*results))
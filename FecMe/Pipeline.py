@@ -0,0 +1,280 @@
+### FILE: Pipeline.py
+### AUTHOR: Salvatore Cardamone
+### DESCRIPTION: Streaming NR LDPC transmit and receive chains built from generator stages
+
+from numbers import Number
+from collections import deque
+from itertools import repeat, islice
+from threading import Thread, Event
+from queue import Queue, Full, Empty
+from numpy import asarray, empty, complex64, float32
+
+from FecMe.NRLDPC import encode_batch, decode_batch
+from FecMe.Constellation import ConstellationFactory
+
+### ====================================================================================
+###                                     Plumbing
+### ====================================================================================
+
+class RingPool():
+    """Fixed ring of preallocated buffers, handed out in turn. A buffer is reused once all the
+    others have been handed out after it, so a consumer holding fewer than count buffers at a
+    time never sees one overwritten.
+    """
+
+    def __init__(self, count, shape, dtype):
+        """Class constructor.
+        """
+        if count < 1:
+            raise ValueError("A ring pool needs at least one buffer")
+        self.buffers = [empty(shape, dtype=dtype) for _ in range(count)]
+        self.position = 0
+
+    def __len__(self):
+        return len(self.buffers)
+
+    def next(self):
+        """Return the next buffer in the ring.
+        """
+        buffer = self.buffers[self.position]
+        self.position = (self.position + 1) % len(self.buffers)
+
+        return buffer
+
+def _per_item(value):
+    """Return an iterator over a per-item parameter, which may be a single value for every
+    item or an iterable with one value per item.
+    """
+    if isinstance(value, Number) or value is None:
+        return repeat(value)
+
+    return iter(value)
+
+def batches(iterable, size):
+    """Group the items of an iterable into lists of up to size items.
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def rechunk(arrays, size, dtype):
+    """Concatenate a stream of 1-D arrays and split it into chunks of size elements, the last
+    of which may be shorter. Chunks are staged in a single buffer, so each is only valid until
+    the next is requested.
+    """
+    buffer = empty((size,), dtype=dtype)
+    filled = 0
+    for array in arrays:
+        array = asarray(array)
+        start = 0
+        while start < len(array):
+            n = min(size - filled, len(array) - start)
+            buffer[filled:filled+n] = array[start:start+n]
+            filled += n
+            start += n
+            if filled == size:
+                yield buffer
+                filled = 0
+
+    if filled:
+        yield buffer[0:filled]
+
+def reframe(chunks, sizes, dtype):
+    """Split a stream of 1-D chunks into consecutive arrays of the given sizes. This is the
+    inverse of rechunk, and each array is newly allocated.
+    """
+    sizes = iter(sizes)
+    chunks = iter(chunks)
+    chunk = empty((0,), dtype=dtype)
+    for size in sizes:
+        frame = empty((size,), dtype=dtype)
+        filled = 0
+        while filled < size:
+            if len(chunk) == 0:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    if filled:
+                        raise ValueError("Stream ended part of the way through a frame of {0}".format(size))
+                    return
+            n = min(size - filled, len(chunk))
+            frame[filled:filled+n] = chunk[0:n]
+            chunk = chunk[n:]
+            filled += n
+        yield frame
+
+_end_of_stream = object()
+
+# Seconds a blocked producer waits before checking whether the consumer has gone away
+_put_timeout = 0.05
+
+def prefetch(iterable, depth):
+    """Run an iterable in a background thread, which stays at most depth items ahead of the
+    consumer. The bounded queue between them applies backpressure to the producer, and any
+    exception it raises is re-raised in the consumer. If the consumer stops early, by closing
+    the generator or abandoning it, the producer is told to stop, the iterable is closed and
+    the thread is joined before the generator finishes.
+    """
+    queue = Queue(maxsize=depth)
+    stopping = Event()
+
+    def put(item):
+        while not stopping.is_set():
+            try:
+                queue.put(item, timeout=_put_timeout)
+                return True
+            except Full:
+                pass
+        return False
+
+    def produce():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if not put(item):
+                    return
+            put(_end_of_stream)
+        except BaseException as error:
+            put(error)
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+
+    producer = Thread(target=produce, daemon=True)
+    producer.start()
+
+    try:
+        while True:
+            item = queue.get()
+            if item is _end_of_stream:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stopping.set()
+        # Free the producer if it's blocked on a full queue
+        while True:
+            try:
+                queue.get_nowait()
+            except Empty:
+                break
+        producer.join()
+
+### ====================================================================================
+###                                     Stages
+### ====================================================================================
+
+def encode_stage(transport_blocks, G, batch_size=8, BGN=1, Qm=2, rv=0, NL=1, Nref=None):
+    """Encode a stream of transport blocks, yielding the rate-matched output of each in turn.
+    G may be a single value or an iterable with a value per transport block. Transport blocks
+    are taken batch_size at a time and encoded together; see encode_batch.
+    """
+    for batch in batches(zip(transport_blocks, _per_item(G)), batch_size):
+        yield from encode_batch([a for a, _ in batch], [g for _, g in batch], BGN=BGN, Qm=Qm, rv=rv, NL=NL, Nref=Nref)
+
+def modulation_stage(bitstreams, constellation, chunk_size, pool_size=4):
+    """Map a stream of bitstrings onto a continuous stream of constellation points, yielding
+    chunks of chunk_size points, the last of which may be shorter. Chunks are written into a
+    ring pool of pool_size buffers, so each stays valid until pool_size - 1 more have been
+    yielded.
+    """
+    pool = RingPool(pool_size, (chunk_size,), complex64)
+    for bits in rechunk(bitstreams, chunk_size * constellation.Qm, int):
+        out = pool.next()[0:-(-len(bits) // constellation.Qm)]
+        yield constellation.map(bits, out=out)
+
+def demodulation_stage(chunks, constellation, noise_variance=1.0, method='maxlog'):
+    """Demap a stream of chunks of constellation points, yielding the LLRs of each chunk.
+    """
+    for chunk in chunks:
+        yield constellation.demap(chunk, noise_variance=noise_variance, method=method)
+
+def decode_stage(llrs, A, G, batch_size=8, BGN=1, Qm=2, rv=0, NL=1, Nref=None, **kwargs):
+    """Decode a continuous stream of LLR chunks, yielding the decoded transport block, whether
+    it passed its CRC and the most iterations spent on any of its codeblocks, for each
+    transport block in turn. A and G may be single values or iterables with a value per
+    transport block. Transport blocks are taken batch_size at a time and decoded together;
+    see decode_batch, to which keyword arguments are passed.
+    """
+    # Transport block sizes of the frames read so far but not yet decoded
+    pending = deque()
+
+    def frame_sizes():
+        for a, g in zip(_per_item(A), _per_item(G)):
+            pending.append(a)
+            yield g
+
+    for batch in batches(reframe(llrs, frame_sizes(), float32), batch_size):
+        transport_sizes = [pending.popleft() for _ in batch]
+        a_hat, passed, iterations = decode_batch(batch, transport_sizes, BGN=BGN, Qm=Qm, rv=rv, NL=NL, Nref=Nref, **kwargs)
+        yield from zip(a_hat, passed, iterations)
+
+### ====================================================================================
+###                                     Pipeline
+### ====================================================================================
+
+class Pipeline():
+    """Streaming NR LDPC transmit and receive chains. The transmit chain runs CRC attachment,
+    segmentation, parity and rate matching over batches of transport blocks, then modulation
+    over fixed-size chunks of points; the receive chain mirrors it. Every stage is a generator
+    pulling from the one before, so however long the stream, only a batch of transport blocks
+    and a ring of chunk buffers are held at once. With a nonzero prefetch depth, the output of
+    each chain is produced in a background thread which runs at most that many chunks or
+    transport blocks ahead of the consumer.
+    The coding chain itself is batched rather than streamed: CRC attachment through rate
+    matching (and rate dematching through the CRC check) run as one call of encode_batch
+    (decode_batch) per batch, and only their output is chunked. Peak memory is therefore
+    bounded by batch_size times the largest transport block and its codeblocks, rather than
+    by the chunk size.
+    """
+
+    def __init__(self, constellation_type="QPSK", BGN=1, rv=0, NL=1, Nref=None, chunk_size=4096, batch_size=8,
+                 pool_size=4, prefetch_depth=0):
+        """Class constructor.
+        """
+        # The consumer holds one chunk and the queue up to prefetch_depth, while the producer
+        # fills another
+        if pool_size < prefetch_depth + 2:
+            raise ValueError("A prefetch depth of {0} needs a pool of at least {1} buffers".format(prefetch_depth, prefetch_depth + 2))
+
+        self.constellation = ConstellationFactory(constellation_type)
+        self.BGN = BGN
+        self.rv = rv
+        self.NL = NL
+        self.Nref = Nref
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.pool_size = pool_size
+        self.prefetch_depth = prefetch_depth
+
+    def __str__(self):
+        """String representation of Pipeline object.
+        """
+        return "Pipeline: {0}, Base-Graph Number {1}, {2} point chunks".format(self.constellation.name, self.BGN, self.chunk_size)
+
+    def _prefetched(self, stream):
+        return prefetch(stream, self.prefetch_depth) if self.prefetch_depth else stream
+
+    def transmit(self, transport_blocks, G):
+        """Encode and modulate a stream of transport blocks, yielding chunks of constellation
+        points. G may be a single value or an iterable with a value per transport block.
+        """
+        g = encode_stage(transport_blocks, G, batch_size=self.batch_size, BGN=self.BGN, Qm=self.constellation.Qm,
+                         rv=self.rv, NL=self.NL, Nref=self.Nref)
+
+        return self._prefetched(modulation_stage(g, self.constellation, self.chunk_size, pool_size=self.pool_size))
+
+    def receive(self, chunks, A, G, noise_variance=1.0, method='maxlog', **kwargs):
+        """Demodulate and decode a stream of chunks of constellation points, yielding the
+        decoded transport block, whether it passed its CRC and its iteration count for each
+        transport block in turn. A and G may be single values or iterables with a value per
+        transport block, and keyword arguments are passed to the decoder.
+        """
+        llrs = demodulation_stage(chunks, self.constellation, noise_variance=noise_variance, method=method)
+
+        return self._prefetched(decode_stage(llrs, A, G, batch_size=self.batch_size, BGN=self.BGN, Qm=self.constellation.Qm,
+                                             rv=self.rv, NL=self.NL, Nref=self.Nref, **kwargs))
@@ -0,0 +1,239 @@
+### FILE: Simulation.py
+### AUTHOR: Salvatore Cardamone
+### DESCRIPTION: Link-level Monte-Carlo simulation of the block error rate of the NR LDPC chain over AWGN
+
+import os
+import json
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from numpy import concatenate, cumsum, split, float32
+from numpy.random import default_rng, SeedSequence
+
+from FecMe.NRLDPC import encode_batch, decode_batch
+from FecMe.Constellation import ConstellationFactory
+
+### ====================================================================================
+###                                     Points
+### ====================================================================================
+
+# A point of the sweep: transport block size, base graph, modulation, Eb/N0 in dB and the
+# number of rate-matched bits, G, per transport block
+Point = namedtuple('Point', ['A', 'BGN', 'modulation', 'ebn0_db', 'G'])
+
+# Counts accumulated at a point: the transport blocks simulated, those decoded in error, the
+# information bits decoded in error and the number of batches run, along with whether the
+# point has finished
+Tally = namedtuple('Tally', ['blocks', 'block_errors', 'bit_errors', 'batches', 'done'])
+
+PointResult = namedtuple('PointResult', ['point', 'blocks', 'block_errors', 'bit_errors', 'bler', 'ber', 'throughput'])
+
+def rate_matched_length(A, Qm, rate):
+    """Return the number of rate-matched bits, G, which carries a transport block of A bits with
+    Qm bits per symbol at the nearest code rate to rate that fills whole symbols. The code rate
+    is A/G, counting only the bits of the transport block as in the MCS tables, so that the
+    CRC bits of the transport block and its codeblocks are overhead at every size.
+    """
+    return Qm * max(1, round(A / rate / Qm))
+
+def noise_variance(point, Qm):
+    """Return the noise variance, N0, of the AWGN channel at a point, for constellations of
+    unit average energy. Each symbol carries Qm.A/G information bits, which is Qm times the
+    code rate of rate_matched_length, so Es/N0 is Eb/N0 scaled by that.
+    """
+    esn0 = 10**(point.ebn0_db / 10) * Qm * point.A / point.G
+
+    return 1 / esn0
+
+### ====================================================================================
+###                                     Batches
+### ====================================================================================
+
+def _batch_seed(seed, index, batch):
+    """Return the seed of a batch of a point. Every batch has its own stream, derived from the
+    seed of the simulation and the indices of the point and the batch, so that results don't
+    depend on how points are spread over workers or where a run was resumed.
+    """
+    return SeedSequence(seed, spawn_key=(index, batch))
+
+def simulate_batch(point, batch_size, rng, **kwargs):
+    """Simulate a batch of transport blocks at a point: draw random transport blocks, encode and
+    map them, pass the symbols through AWGN, then demap and decode them. Every transport
+    block of the batch goes through each stage in one vectorised call. Return the number of
+    transport blocks decoded in error and the number of information bits in error. Keyword
+    arguments are passed to the decoder.
+    """
+    constellation = ConstellationFactory(point.modulation)
+    Qm = constellation.Qm
+    N0 = noise_variance(point, Qm)
+
+    a = rng.integers(0, 2, (batch_size,point.A), dtype='u1')
+    g = concatenate(encode_batch(list(a), point.G, BGN=point.BGN, Qm=Qm))
+    symbols = constellation.map(g)
+    noise = rng.standard_normal((2,len(symbols)), dtype=float32) * float32((N0 / 2)**0.5)
+    symbols.real += noise[0]
+    symbols.imag += noise[1]
+
+    llr = constellation.demap(symbols, noise_variance=N0)
+    llrs = split(llr.ravel(), cumsum([point.G] * (batch_size - 1)))
+    a_hat, _, _ = decode_batch(llrs, point.A, BGN=point.BGN, Qm=Qm, **kwargs)
+
+    errors = (a != a_hat).sum(axis=1)
+
+    return int((errors > 0).sum()), int(errors.sum())
+
+def simulate_point(point, index, seed, tally, num_batches, batch_size, target_errors, max_blocks, decode_kwargs):
+    """Continue the simulation of a point from its tally for up to num_batches batches, or until
+    it reaches target_errors block errors or max_blocks transport blocks. Return the updated
+    tally.
+    """
+    blocks, block_errors, bit_errors, batches, _ = tally
+
+    for _ in range(num_batches):
+        if block_errors >= target_errors or blocks >= max_blocks:
+            break
+        rng = default_rng(_batch_seed(seed, index, batches))
+        n = min(batch_size, max_blocks - blocks)
+        errors = simulate_batch(point, n, rng, **decode_kwargs)
+        blocks += n
+        block_errors += errors[0]
+        bit_errors += errors[1]
+        batches += 1
+
+    done = block_errors >= target_errors or blocks >= max_blocks
+
+    return Tally(blocks, block_errors, bit_errors, batches, done)
+
+### ====================================================================================
+###                                     Simulation
+### ====================================================================================
+
+class Simulation():
+    """Monte-Carlo simulation of the block error rate of the NR LDPC chain over AWGN, swept
+    over Eb/N0, transport block sizes and modulations at a fixed code rate, A/G. Each point runs
+    batches of transport blocks until it has seen target_errors block errors or simulated
+    max_blocks transport blocks. Points are spread over a pool of worker processes, a slice of
+    batches at a time, and every batch draws from its own seeded stream, so results are
+    reproducible whatever the number of workers. If a checkpoint file is given, the tallies
+    are saved to it after every slice, and a later run with the same sweep resumes from them.
+    """
+
+    def __init__(self, ebn0_db, sizes, modulations=("QPSK",), rate=0.5, BGN=1, target_errors=100, max_blocks=10**5,
+                 batch_size=32, batches_per_slice=8, workers=None, seed=0, checkpoint=None, **decode_kwargs):
+        """Class constructor. By default there's one worker per core; with workers=0 every
+        point is simulated in this process. Keyword arguments are passed to the decoder.
+        """
+        self.points = []
+        for modulation in modulations:
+            Qm = ConstellationFactory(modulation).Qm
+            for A in sizes:
+                G = rate_matched_length(A, Qm, rate)
+                self.points.extend(Point(A, BGN, modulation, float(ebn0), G) for ebn0 in ebn0_db)
+
+        self.target_errors = target_errors
+        self.max_blocks = max_blocks
+        self.batch_size = batch_size
+        self.batches_per_slice = batches_per_slice
+        self.workers = os.cpu_count() if workers is None else workers
+        self.seed = seed
+        self.checkpoint = checkpoint
+        self.decode_kwargs = decode_kwargs
+        self.tallies = [Tally(0, 0, 0, 0, False) for _ in self.points]
+
+    def __str__(self):
+        """String representation of Simulation object.
+        """
+        return "Simulation: {0} points, {1} target block errors".format(len(self.points), self.target_errors)
+
+    def _configuration(self):
+        """Return the settings which determine the results, which a checkpoint must match to
+        be resumed from.
+        """
+        return {'points' : [list(point) for point in self.points], 'target_errors' : self.target_errors,
+                'max_blocks' : self.max_blocks, 'batch_size' : self.batch_size, 'seed' : self.seed,
+                'decode_kwargs' : self.decode_kwargs}
+
+    def load_checkpoint(self):
+        """Resume from the checkpoint file, if there is one. Raise ValueError if it was written
+        by a simulation with different settings.
+        """
+        if self.checkpoint is None or not os.path.exists(self.checkpoint):
+            return
+
+        with open(self.checkpoint) as checkpoint:
+            state = json.load(checkpoint)
+        if state['configuration'] != json.loads(json.dumps(self._configuration())):
+            raise ValueError("Checkpoint {0} was written by a simulation with different settings".format(self.checkpoint))
+        self.tallies = [Tally(*tally) for tally in state['tallies']]
+
+    def save_checkpoint(self):
+        """Save the tallies to the checkpoint file, writing alongside and moving it into place so
+        that an interrupted save never leaves it partly written.
+        """
+        if self.checkpoint is None:
+            return
+
+        staging = '{0}.tmp'.format(self.checkpoint)
+        with open(staging, 'w') as checkpoint:
+            json.dump({'configuration' : self._configuration(), 'tallies' : [list(tally) for tally in self.tallies]}, checkpoint)
+        os.replace(staging, self.checkpoint)
+
+    def _arguments(self, index):
+        """Return the arguments of simulate_point for the next slice of a point.
+        """
+        return (self.points[index], index, self.seed, self.tallies[index], self.batches_per_slice, self.batch_size,
+                self.target_errors, self.max_blocks, self.decode_kwargs)
+
+    def run(self, progress=None):
+        """Simulate every point which hasn't finished, returning the results of all of them. If
+        progress is given, it's called with the index and tally of a point after every slice.
+        """
+        self.load_checkpoint()
+        pending = [index for index, tally in enumerate(self.tallies) if not tally.done]
+
+        def update(index, tally):
+            self.tallies[index] = tally
+            self.save_checkpoint()
+            if progress is not None:
+                progress(index, tally)
+
+        if self.workers == 0:
+            for index in pending:
+                while not self.tallies[index].done:
+                    update(index, simulate_point(*self._arguments(index)))
+            return self.results()
+
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(simulate_point, *self._arguments(index)) : index for index in pending}
+            while futures:
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    index = futures.pop(future)
+                    update(index, future.result())
+                    if not self.tallies[index].done:
+                        futures[executor.submit(simulate_point, *self._arguments(index))] = index
+
+        return self.results()
+
+    def results(self):
+        """Return the block and bit error rates of every point, along with its throughput in
+        information bits delivered per symbol.
+        """
+        results = []
+        for point, tally in zip(self.points, self.tallies):
+            Qm = ConstellationFactory(point.modulation).Qm
+            bler = tally.block_errors / tally.blocks if tally.blocks else float('nan')
+            ber = tally.bit_errors / (tally.blocks * point.A) if tally.blocks else float('nan')
+            throughput = (1 - bler) * Qm * point.A / point.G
+            results.append(PointResult(point, tally.blocks, tally.block_errors, tally.bit_errors, bler, ber, throughput))
+
+        return results
+
+
+if __name__ == "__main__":
+
+    simulation = Simulation([0.0, 0.5, 1.0, 1.5, 2.0], [3000], modulations=("QPSK", "16QAM"), target_errors=50, max_blocks=2000)
+    print(simulation)
+    for result in simulation.run():
+        point = result.point
+        print("{0:>6} A={1:<6} Eb/N0={2:5.2f} dB: BLER {3:.3e}, BER {4:.3e}, {5:.3f} bits/symbol over {6} blocks".format(
+            point.modulation, point.A, point.ebn0_db, result.bler, result.ber, result.throughput, result.blocks))
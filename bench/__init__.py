@@ -0,0 +1,3 @@
+### FILE: __init__.py
+### AUTHOR: Salvatore Cardamone
+### DESCRIPTION: Benchmarks of the NR LDPC chain, each run from the root of the repository as python -m bench.<module>
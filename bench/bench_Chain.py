@@ -0,0 +1,202 @@
+### FILE: bench_Chain.py
+### AUTHOR: Salvatore Cardamone
+### DESCRIPTION: Latency, throughput and peak memory of every stage of the NR LDPC chain; run from the root of the repository as python -m bench.bench_Chain
+
+import sys
+import json
+import platform
+import argparse
+import tracemalloc
+from time import perf_counter, strftime
+from numpy import array, concatenate, percentile, __version__ as numpy_version
+from numpy.random import default_rng
+
+from FecMe.CRC import checksum
+from FecMe.BaseGraph import LiftedGraph, base_graph, lifting_sizes, warm_up
+from FecMe.NRLDPC import NRLDPC
+from FecMe.Constellation import ConstellationFactory
+
+### ====================================================================================
+###                                     Measurement
+### ====================================================================================
+
+def measure(function, repeats):
+    """Return the wall time, in seconds, of each of repeated calls to function, after a first
+    call which isn't timed so that caches and allocations are warm.
+    """
+    function()
+    times = []
+    for _ in range(repeats):
+        start = perf_counter()
+        function()
+        times.append(perf_counter() - start)
+
+    return array(times)
+
+def peak_memory(function):
+    """Return the peak memory, in bytes, allocated by a call to function over and above what
+    was already allocated. Measured separately from the timings, since tracing slows every
+    allocation.
+    """
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        function()
+        return tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+
+def record(stage, function, bits, repeats, **parameters):
+    """Benchmark one stage, returning its parameters along with its latency percentiles in
+    microseconds, its throughput in Mbit/s of the bits it processes at the median latency, and
+    its peak memory.
+    """
+    times = measure(function, repeats) * 1e6
+    p50, p90, p99 = percentile(times, (50, 90, 99))
+
+    result = {'stage' : stage}
+    result.update(parameters)
+    result.update({'bits' : int(bits), 'repeats' : repeats,
+                   'latency_us' : {'min' : float(times.min()), 'p50' : float(p50), 'p90' : float(p90), 'p99' : float(p99)},
+                   'mbps' : float(bits / p50) if p50 > 0 else 0.0,
+                   'peak_bytes' : int(peak_memory(function))})
+
+    return result
+
+### ====================================================================================
+###                                     Stages
+### ====================================================================================
+
+def lifting_benchmarks(repeats, BGNs=(1,2)):
+    """Benchmark lifting of the PCM of the largest lifting size in every lifting set of each of
+    the given base graphs, bypassing the lifted graph cache. Throughput is of the nonzero PCM
+    entries.
+    """
+    results = []
+    for BGN in BGNs:
+        for LiftingSet in range(lifting_sizes.shape[0]):
+            Zc = int(lifting_sizes[LiftingSet].max())
+            BG = base_graph(BGN, LiftingSet)
+
+            def lift():
+                graph = LiftedGraph(BG, Zc)
+                return graph.gather, graph.H
+
+            nnz = LiftedGraph(BG, Zc).H.nnz
+            results.append(record('lifting', lift, nnz, repeats, BGN=BGN, LiftingSet=LiftingSet, Zc=Zc))
+
+    return results
+
+def chain_benchmarks(A, BGN, repeats, rng, rate=0.5, noise_variance=0.5):
+    """Benchmark each stage of the chain for a transport block of A bits, rate matched onto
+    QPSK at roughly the given code rate, and decoded from LLRs received over AWGN.
+    """
+    ldpc = NRLDPC(A, BGN=BGN)
+    qpsk = ConstellationFactory("QPSK")
+    p = ldpc.params
+    G = 2 * int(round((A + ldpc.L) / rate / 2))
+
+    a = rng.integers(0, 2, A)
+    b = concatenate((a, checksum(a, polynomial='CRC24A')))
+    c = ldpc.segmentation(b)
+    d = ldpc.parity(c)
+    g = ldpc.rate_matching(d, G, Qm=2)
+    symbols = qpsk.map(g)
+    received = symbols + rng.normal(0, (noise_variance/2)**0.5, len(symbols)) + 1j*rng.normal(0, (noise_variance/2)**0.5, len(symbols))
+    llr = ldpc.rate_dematching(qpsk.demap(received, noise_variance=noise_variance), Qm=2)
+
+    parameters = {'BGN' : BGN, 'A' : A, 'LiftingSet' : int(p.LiftingSet), 'Zc' : int(p.Zc), 'C' : int(p.C)}
+    stages = (('crc', lambda: checksum(a, polynomial='CRC24A'), A),
+              ('segmentation', lambda: ldpc.segmentation(b), len(b)),
+              ('encoding', lambda: ldpc.parity(c), c.size),
+              ('rate_matching', lambda: ldpc.rate_matching(d, G, Qm=2), G),
+              ('qpsk_map', lambda: qpsk.map(g), G),
+              ('qpsk_demap', lambda: qpsk.demap(received, noise_variance=noise_variance), G),
+              ('rate_dematching', lambda: ldpc.rate_dematching(qpsk.demap(received, noise_variance=noise_variance), Qm=2), G),
+              ('decoding', lambda: ldpc.decode(llr), A))
+
+    return [record(stage, function, bits, repeats, **parameters) for stage, function, bits in stages]
+
+def run(sizes, BGNs, repeats, seed=0):
+    """Run every benchmark, returning the results along with a description of the machine.
+    """
+    rng = default_rng(seed)
+    warm_up(BGNs)
+
+    results = lifting_benchmarks(repeats, BGNs)
+    for BGN in BGNs:
+        for A in sizes:
+            results.extend(chain_benchmarks(A, BGN, repeats, rng))
+
+    machine = {'python' : platform.python_version(), 'numpy' : numpy_version, 'machine' : platform.machine(),
+               'processor' : platform.processor(), 'timestamp' : strftime('%Y-%m-%dT%H:%M:%S')}
+
+    return {'machine' : machine, 'results' : results}
+
+### ====================================================================================
+###                                     Baselines
+### ====================================================================================
+
+def _key(result):
+    """Return the key identifying a benchmark across runs.
+    """
+    return tuple((name, result.get(name)) for name in ('stage', 'BGN', 'A', 'LiftingSet', 'Zc'))
+
+def compare(results, baseline, tolerance=0.1):
+    """Compare the median latency of each benchmark against the baseline, returning a
+    (result, baseline median, ratio) tuple for each benchmark found in both and the list of
+    those which slowed down by more than the tolerance.
+    """
+    reference = {_key(result) : result['latency_us']['p50'] for result in baseline['results']}
+
+    comparisons = []
+    for result in results['results']:
+        median = reference.get(_key(result))
+        if median:
+            comparisons.append((result, median, result['latency_us']['p50'] / median))
+
+    regressions = [comparison for comparison in comparisons if comparison[2] > 1 + tolerance]
+
+    return comparisons, regressions
+
+def _label(result):
+    """Return a short description of the parameters of a benchmark.
+    """
+    if result['stage'] == 'lifting':
+        return "BG{0} Zc={1}".format(result['BGN'], result['Zc'])
+    return "BG{0} A={1}".format(result['BGN'], result['A'])
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark every stage of the NR LDPC chain")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, 3000, 12000, 24000],
+                        help="transport block sizes, each of which must segment evenly under both base graphs")
+    parser.add_argument('--bgn', type=int, nargs='+', default=[1, 2], choices=[1, 2], help="base graphs")
+    parser.add_argument('--repeats', type=int, default=20, help="timed calls of each stage")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="compare against the results in this JSON file")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="median slowdown counted as a regression")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.bgn, args.repeats)
+
+    print("{0:>16} {1:>16} {2:>10} {3:>10} {4:>10} {5:>10} {6:>10}".format(
+        "stage", "parameters", "p50 us", "p90 us", "p99 us", "Mbit/s", "peak KiB"))
+    for result in results['results']:
+        latency = result['latency_us']
+        print("{0:>16} {1:>16} {2:10.1f} {3:10.1f} {4:10.1f} {5:10.2f} {6:10.1f}".format(
+            result['stage'], _label(result), latency['p50'], latency['p90'], latency['p99'], result['mbps'], result['peak_bytes'] / 1024))
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            comparisons, regressions = compare(results, json.load(baseline), args.tolerance)
+        print("\n{0} of {1} benchmarks compared against {2}".format(len(comparisons), len(results['results']), args.baseline))
+        for result, median, ratio in regressions:
+            print("REGRESSION {0:>16} {1:>16}: p50 {2:.1f} us against {3:.1f} us ({4:.2f}x)".format(
+                result['stage'], _label(result), result['latency_us']['p50'], median, ratio))
+        sys.exit(1 if regressions else 0)
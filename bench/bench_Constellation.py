@@ -0,0 +1,38 @@
+### FILE: bench_Constellation.py
+### AUTHOR: Salvatore Cardamone
+### DESCRIPTION: Throughput of constellation mapping and demapping; run from the root of the repository as python -m bench.bench_Constellation
+
+from time import perf_counter
+from numpy import empty, complex64
+from numpy.random import default_rng
+
+from FecMe.Constellation import ConstellationFactory
+
+def throughput(function, repeats=5):
+    """Return the best wall time, in seconds, of repeated calls to function.
+    """
+    best = float('inf')
+    for _ in range(repeats):
+        start = perf_counter()
+        function()
+        best = min(best, perf_counter() - start)
+
+    return best
+
+if __name__ == "__main__":
+
+    num_symbols = 10**6
+    rng = default_rng(0)
+
+    for constellation_type in ("QPSK", "16QAM", "64QAM", "256QAM"):
+
+        constellation = ConstellationFactory(constellation_type)
+        bitstring = rng.integers(0, 2, constellation.Qm*num_symbols)
+        out = empty((num_symbols,), dtype=complex64)
+        symbols = constellation.map(bitstring)
+
+        map_time = throughput(lambda: constellation.map(bitstring, out=out))
+        demap_time = throughput(lambda: constellation.demap(symbols, noise_variance=0.5))
+
+        print("{0:>6} map:   {1:8.2f} Msymbols/s".format(constellation_type, num_symbols / map_time / 1e6))
+        print("{0:>6} demap: {1:8.2f} Msymbols/s".format(constellation_type, num_symbols / demap_time / 1e6))
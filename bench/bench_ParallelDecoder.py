@@ -0,0 +1,48 @@
+### FILE: bench_ParallelDecoder.py
+### AUTHOR: Salvatore Cardamone
+### DESCRIPTION: Scaling of NR LDPC decoding throughput with the number of worker processes; run from the root of the repository as python -m bench.bench_ParallelDecoder
+
+import os
+from time import perf_counter
+from numpy import concatenate
+from numpy.random import default_rng
+
+from FecMe.CRC import checksum
+from FecMe.NRLDPC import NRLDPC
+from FecMe.ParallelDecoder import ParallelDecoder
+
+def throughput(function, repeats=5):
+    """Return the best wall time, in seconds, of repeated calls to function.
+    """
+    best = float('inf')
+    for _ in range(repeats):
+        start = perf_counter()
+        function()
+        best = min(best, perf_counter() - start)
+
+    return best
+
+if __name__ == "__main__":
+
+    rng = default_rng(0)
+    ldpc = NRLDPC(10000)
+    a = rng.integers(0, 2, ldpc.A)
+    d = ldpc.parity(ldpc.segmentation(concatenate((a, checksum(a, polynomial='CRC24A')))))
+    d = concatenate([d] * 32)
+
+    # BPSK over AWGN at an SNR of 1dB
+    noise_variance = 10**(-0.1)
+    llr = 2*((1 - 2*(d > 0)) + rng.normal(0, noise_variance**0.5, d.shape)) / noise_variance
+
+    serial = throughput(lambda: ldpc.decode(llr), repeats=3)
+    print("   in-process: {0:8.1f} codeblocks/s".format(d.shape[0] / serial))
+
+    workers = 1
+    while workers <= os.cpu_count():
+        with ParallelDecoder(workers=workers, BGNs=(1,)) as decoder:
+            decoder.decode(ldpc, llr)
+            elapsed = throughput(lambda: decoder.decode(ldpc, llr), repeats=3)
+            print("{0:3d} workers:   {1:8.1f} codeblocks/s ({2:.2f}x)".format(workers, d.shape[0] / elapsed, serial / elapsed))
+            for worker in decoder.stats():
+                print("    pid {0}: {1} codeblocks, {2:8.1f} codeblocks/s".format(worker.pid, worker.codeblocks, worker.throughput))
+        workers *= 2
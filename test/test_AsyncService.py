@@ -0,0 +1,89 @@
+### FILE: test_AsyncService.py
+### AUTHOR: Salvatore Cardamone
+### DESCRIPTION: Verify that the asyncio service batches requests and resolves each correctly
+
+import unittest
+import asyncio
+from numpy.random import default_rng
+
+from FecMe.NRLDPC import NRLDPC
+from FecMe.AsyncService import FECService
+
+class TestAsyncService(unittest.TestCase):
+    """asyncio service Unit testing.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Class constructor.
+        """
+        super(TestAsyncService, self).__init__(*args, **kwargs)
+        self.rng = default_rng(2024)
+
+    def test_1(self):
+        """Test that concurrent requests are micro-batched, that each resolves to the result of
+        encoding or decoding its own transport block, and that a bad request only fails itself.
+        """
+        A = [int(n) for n in self.rng.integers(100, 2000, 20)]
+        transport_blocks = [self.rng.integers(0, 2, n) for n in A]
+
+        async def run():
+            async with FECService(max_batch=8, flush_deadline=0.01) as service:
+                g = await asyncio.gather(*(service.encode(a, 4000) for a in transport_blocks))
+                decoded = await asyncio.gather(*(service.decode(4.0*(1 - 2*gi.astype(int)), n) for gi, n in zip(g, A)))
+                outcomes = await asyncio.gather(service.encode(transport_blocks[0], 4000), service.encode(transport_blocks[1], 4001),
+                                                return_exceptions=True)
+                # A lone request is flushed by the deadline
+                lone = await service.encode(transport_blocks[2], 4000, rv=2)
+                return g, decoded, outcomes, lone, service.stats()
+
+        g, decoded, outcomes, lone, stats = asyncio.run(run())
+
+        for n, a, gi, (a_hat, passed, _) in zip(A, transport_blocks, g, decoded):
+            self.assertEqual(gi.tolist(), NRLDPC(n).encode(a, 4000).tolist())
+            self.assertTrue(passed)
+            self.assertEqual(a_hat.tolist(), a.tolist())
+
+        self.assertEqual(outcomes[0].tolist(), g[0].tolist())
+        self.assertIsInstance(outcomes[1], ValueError)
+        self.assertEqual(lone.tolist(), NRLDPC(A[2]).encode(transport_blocks[2], 4000, rv=2).tolist())
+
+        self.assertEqual(stats['encode']['batch_sizes'], {8 : 2, 4 : 1, 2 : 1, 1 : 1})
+        self.assertEqual(sum(stats['decode']['batch_sizes'].values()), 3)
+        self.assertEqual(sum(stats['encode']['queue_depths'].values()), 23)
+
+    def test_2(self):
+        """Test that stopping a service which was never started, or stopping one twice, does
+        nothing, and that a stopped service refuses requests.
+        """
+        async def run():
+            service = FECService()
+            await service.stop()
+            async with service:
+                pass
+            await service.stop()
+            with self.assertRaises(RuntimeError):
+                await service.encode(self.rng.integers(0, 2, 100), 400)
+            return service
+
+        service = asyncio.run(run())
+        self.assertIsNone(service.executor)
+
+    def test_3(self):
+        """Test that a request made while the service is stopping is refused rather than left
+        waiting behind the stop, and that requests queued before it are still served.
+        """
+        a = self.rng.integers(0, 2, 100)
+
+        async def run():
+            service = FECService(flush_deadline=0.01)
+            await service.start()
+            queued = asyncio.create_task(service.encode(a, 400))
+            await asyncio.sleep(0)
+            stopping = asyncio.create_task(service.stop())
+            await asyncio.sleep(0)
+            with self.assertRaises(RuntimeError):
+                await asyncio.wait_for(service.encode(a, 400), 3)
+            await stopping
+            return await queued
+
+        self.assertEqual(asyncio.run(run()).tolist(), NRLDPC(100).encode(a, 400).tolist())
@@ -0,0 +1,95 @@
+### FILE: test_CRC.py
+### AUTHOR: Salvatore Cardamone
+### DESCRIPTION: Verify our CRC implementation against golden data and bit-serial division
+
+import unittest
+from numpy import load, array, concatenate, zeros, ones, packbits
+from numpy.random import default_rng
+
+from FecMe.CRC import polynomials, checksum, check, checksum_batch, check_batch, checksum_packed, checksum_packed_batch
+
+def long_division(a, polynomial, checksum_fill=0):
+    """Reference bit-serial polynomial long division over GF(2).
+    """
+    g = polynomials[polynomial]
+    L = len(g)
+    work = concatenate((a, (ones if checksum_fill else zeros)((L-1,), dtype=int)))
+    for i in range(len(a)):
+        if work[i]:
+            work[i:i+L] ^= g
+
+    return work[len(a):]
+
+class TestCRC(unittest.TestCase):
+    """CRC Unit testing.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Class constructor. Load all the test vectors once.
+        """
+        super(TestCRC, self).__init__(*args, **kwargs)
+        self.test_vectors = load('test/test_NRLDPC.npz')
+        self.rng = default_rng(2024)
+
+    def test_1(self):
+        """Test the table-driven checksum against golden data.
+        """
+        golden_crc_out = self.test_vectors['crc_out'][-24:]
+        crc_out = checksum(self.test_vectors['data_in'], polynomial='CRC24A', checksum_fill=0)
+        self.assertEqual(crc_out.tolist(), golden_crc_out.tolist())
+
+    def test_2(self):
+        """Test the table-driven checksum against long division for all polynomials, both
+        checksum fills and lengths which aren't a whole number of bytes.
+        """
+        for polynomial in polynomials:
+            for checksum_fill in (0, 1):
+                for A in (0, 1, 7, 13, 64, 101):
+                    a = self.rng.integers(0, 2, A)
+                    self.assertEqual(checksum(a, polynomial=polynomial, checksum_fill=checksum_fill).tolist(),
+                                     long_division(a, polynomial, checksum_fill).tolist())
+
+    def test_3(self):
+        """Test that check accepts a valid checksum and rejects a corrupted bitstring.
+        """
+        for polynomial in polynomials:
+            a = self.rng.integers(0, 2, 50)
+            b = concatenate((a, checksum(a, polynomial=polynomial)))
+            self.assertTrue(check(b, polynomial=polynomial))
+            b[7] ^= 1
+            self.assertFalse(check(b, polynomial=polynomial))
+
+    def test_4(self):
+        """Test that unknown polynomials are rejected.
+        """
+        with self.assertRaises(ValueError):
+            checksum(array([1,0,1]), polynomial='CRC99')
+
+    def test_5(self):
+        """Test the batched checksum and check against the single-bitstring versions.
+        """
+        for polynomial in polynomials:
+            for checksum_fill in (0, 1):
+                a = self.rng.integers(0, 2, (6, 77))
+                crc_out = checksum_batch(a, polynomial=polynomial, checksum_fill=checksum_fill)
+                self.assertEqual(crc_out.tolist(),
+                                 [checksum(row, polynomial=polynomial, checksum_fill=checksum_fill).tolist() for row in a])
+
+                b = concatenate((a, crc_out), axis=1)
+                b[[1,4],[3,80]] ^= 1
+                self.assertEqual(check_batch(b, polynomial=polynomial, checksum_fill=checksum_fill).tolist(),
+                                 [True, False, True, True, False, True])
+
+    def test_6(self):
+        """Test the batched packed checksum against the packed checksum of each row, ignoring
+        the bits which pad out the final byte.
+        """
+        for polynomial in polynomials:
+            for nbits in (5, 8, 77, 8424):
+                for checksum_fill in (0, 1):
+                    packed = packbits(self.rng.integers(0, 2, (4, nbits)), axis=1)
+                    golden = [checksum_packed(row, nbits, polynomial=polynomial, checksum_fill=checksum_fill) for row in packed]
+                    if nbits % 8:
+                        packed[:,-1] |= (1 << (-nbits % 8)) - 1
+                    self.assertEqual(checksum_packed_batch(packed, nbits, polynomial=polynomial, checksum_fill=checksum_fill).tolist(), golden)
+
@@ -0,0 +1,60 @@
+### FILE: test_CodeTables.py
+### AUTHOR: Salvatore Cardamone
+### DESCRIPTION: Verify that lifted graphs mapped from the code tables match those computed afresh
+
+import unittest
+from tempfile import TemporaryDirectory
+from numpy import concatenate
+from numpy.random import default_rng
+
+from FecMe.CRC import checksum
+from FecMe.BaseGraph import LiftedGraph, base_graph, code_tables, use_code_tables
+from FecMe.CodeTables import CodeTables, build, open_tables
+from FecMe.NRLDPC import NRLDPC
+
+class TestCodeTables(unittest.TestCase):
+    """Code tables Unit testing.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Class constructor.
+        """
+        super(TestCodeTables, self).__init__(*args, **kwargs)
+        self.rng = default_rng(2025)
+
+    def test_1(self):
+        """Test that lifted graphs assembled from a tables file match those computed from the
+        base graphs, that the chain encodes and decodes from them, and that a corrupt file
+        isn't used.
+        """
+        with TemporaryDirectory() as directory:
+            path = build('{0}/tables.bin'.format(directory))
+            tables = CodeTables(path)
+
+            for BGN, LiftingSet, Zc in ((1, 0, 2), (1, 1, 384), (2, 7, 120), (2, 5, 352)):
+                golden = LiftedGraph(base_graph(BGN, LiftingSet), Zc)
+                mapped = tables.lifted_graph(BGN, Zc)
+                self.assertFalse(mapped.gather.flags.writeable)
+                self.assertEqual(mapped.shifts.tolist(), golden.shifts.tolist())
+                self.assertEqual(mapped.gather.tolist(), golden.gather.tolist())
+                self.assertEqual((mapped.H != golden.H).nnz, 0)
+
+            try:
+                use_code_tables(path)
+                self.assertEqual(code_tables().path, path)
+
+                A, G = 8000, 20000
+                ldpc = NRLDPC(A, BGN=1)
+                a = self.rng.integers(0, 2, A)
+                d = ldpc.parity(ldpc.segmentation(concatenate((a, checksum(a, polynomial='CRC24A')))))
+                _, _, converged = ldpc.decode(8.0*(1 - 2.0*d))
+                self.assertTrue(converged.all())
+                self.assertEqual(ldpc.encode(a, G).tolist(), NRLDPC(A, BGN=1).encode(a, G).tolist())
+            finally:
+                use_code_tables(None)
+
+            with open(path, 'r+b') as corrupt:
+                corrupt.write(b'X')
+            self.assertIsNone(open_tables(path))
+            self.assertIsNone(open_tables('{0}/missing.bin'.format(directory)))
+            del tables
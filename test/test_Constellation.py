@@ -0,0 +1,111 @@
+### FILE: test_Constellation.py
+### AUTHOR: Salvatore Cardamone
+### DESCRIPTION: Verify our constellation mapping and demapping
+
+import unittest
+from math import sqrt
+from numpy import array, arange, empty, packbits, complex64, float32, allclose
+from scipy.special import logsumexp
+from numpy.random import default_rng
+
+from FecMe.Constellation import ConstellationFactory
+
+class TestConstellation(unittest.TestCase):
+    """Constellation Unit testing.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Class constructor.
+        """
+        super(TestConstellation, self).__init__(*args, **kwargs)
+        self.rng = default_rng(2024)
+
+    def test_1(self):
+        """Test QPSK mapping against 38.211 Section 5.1.3, including an odd number of bits.
+        """
+        qpsk = ConstellationFactory("QPSK")
+        bitstring = array([0,0,0,1,1,0,1,1,1])
+        golden = array([1+1j, 1-1j, -1+1j, -1-1j, -1]) / sqrt(2)
+
+        constellations = qpsk.map(bitstring)
+        self.assertEqual(constellations.dtype, complex64)
+        self.assertTrue(allclose(constellations, golden))
+
+        out = empty((5,), dtype=complex64)
+        self.assertIs(qpsk.map(bitstring, out=out), out)
+        self.assertTrue(allclose(out, golden))
+
+    def test_2(self):
+        """Test QPSK demapping against the BPSK LLR of each component.
+        """
+        qpsk = ConstellationFactory("QPSK")
+        bitstring = self.rng.integers(0, 2, 1000)
+        constellations = qpsk.map(bitstring)
+        noisy = constellations + 0.3*(self.rng.normal(size=500) + 1j*self.rng.normal(size=500))
+
+        for method in ('maxlog', 'exact'):
+            llr = qpsk.demap(noisy, noise_variance=0.18, method=method)
+            self.assertEqual(llr.dtype, float32)
+            golden = 4 / sqrt(2) * array([noisy.real, noisy.imag]).T.ravel() / 0.18
+            self.assertTrue(allclose(llr, golden, rtol=1e-5))
+
+        self.assertEqual((qpsk.demap(constellations) < 0).astype(int).tolist(), bitstring.tolist())
+
+    def test_3(self):
+        """Test 16QAM, 64QAM and 256QAM mapping against the formulae of 38.211 Sections 5.1.4
+        to 5.1.6.
+        """
+        def golden(bits, Qm):
+            s = 1 - 2*bits
+            in_phase, quadrature = s[0::2][::-1], s[1::2][::-1]
+            I, Q = in_phase[0], quadrature[0]
+            for k in range(1, Qm//2):
+                I, Q = in_phase[k] * (2**k - I), quadrature[k] * (2**k - Q)
+            return (I + 1j*Q) / sqrt(2 * (2**Qm - 1) / 3)
+
+        for constellation_type in ("16QAM", "64QAM", "256QAM"):
+            qam = ConstellationFactory(constellation_type)
+            bitstring = self.rng.integers(0, 2, 100*qam.Qm)
+            constellations = qam.map(bitstring)
+            self.assertTrue(allclose(constellations, [golden(bits, qam.Qm) for bits in bitstring.reshape((-1,qam.Qm))], atol=1e-6))
+            self.assertAlmostEqual(float((abs(qam.points)**2).mean()), 1.0, places=5)
+
+    def test_4(self):
+        """Test separable per-axis demapping against demapping by distance to every point.
+        """
+        for constellation_type in ("16QAM", "64QAM", "256QAM"):
+            qam = ConstellationFactory(constellation_type)
+            bitstring = self.rng.integers(0, 2, 200*qam.Qm)
+            constellations = qam.map(bitstring)
+            noisy = constellations + 0.05*(self.rng.normal(size=200) + 1j*self.rng.normal(size=200))
+
+            point_bits = (arange(2**qam.Qm)[:,None] >> arange(qam.Qm-1, -1, -1)[None,:]) & 1
+            metric = abs(noisy[:,None] - qam.points[None,:])**2 / 0.005
+            for method in ('maxlog', 'exact'):
+                llr = qam.demap(noisy, noise_variance=0.005, method=method).reshape((-1,qam.Qm))
+                for k in range(qam.Qm):
+                    ones = point_bits[:,k] == 1
+                    if method == 'maxlog':
+                        golden = metric[:,ones].min(axis=1) - metric[:,~ones].min(axis=1)
+                    else:
+                        golden = logsumexp(-metric[:,~ones], axis=1) - logsumexp(-metric[:,ones], axis=1)
+                    self.assertTrue(allclose(llr[:,k], golden, rtol=1e-3, atol=1e-2))
+
+            self.assertEqual((qam.demap(constellations) < 0).astype(int).tolist(), bitstring.tolist())
+
+    def test_5(self):
+        """Test that mapping a packed bitstring matches mapping it unpacked for every
+        constellation, whatever the bits padding out its final byte.
+        """
+        for constellation_type in ("QPSK", "16QAM", "64QAM", "256QAM"):
+            constellation = ConstellationFactory(constellation_type)
+            lengths = [constellation.Qm * n for n in (1, 4, 7, 301)] + ([1, 13] if constellation_type == "QPSK" else [])
+            for nbits in lengths:
+                bitstring = self.rng.integers(0, 2, nbits)
+                packed = packbits(bitstring)
+                packed[-1] |= (1 << (-nbits % 8)) - 1
+                self.assertEqual(constellation.map_packed(packed, nbits).tolist(), constellation.map(bitstring).tolist())
+
+        with self.assertRaises(ValueError):
+            ConstellationFactory("64QAM").map_packed(packbits([1,0,1,1]), 4)
+
@@ -0,0 +1,65 @@
+### FILE: test_Instrumentation.py
+### AUTHOR: Salvatore Cardamone
+### DESCRIPTION: Verify the stage timings, counters and cache statistics recorded by the chain
+
+import unittest
+from numpy.random import default_rng
+
+from FecMe import Instrumentation
+from FecMe.Instrumentation import instrumented, stage
+from FecMe.NRLDPC import NRLDPC, encode_batch, decode_batch
+
+class TestInstrumentation(unittest.TestCase):
+    """Instrumentation Unit testing.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Class constructor.
+        """
+        super(TestInstrumentation, self).__init__(*args, **kwargs)
+        self.rng = default_rng(2026)
+
+    def test_1(self):
+        """Test that the encode and decode chains record every stage, the decoder iterations and
+        the cache statistics while instrumented, that every record reaches the exporter, and
+        that nothing is recorded otherwise.
+        """
+        A, G = 3000, 6400
+        ldpc = NRLDPC(A)
+        a = self.rng.integers(0, 2, A)
+
+        events = []
+        with instrumented(exporter=events.append) as collector:
+            g = ldpc.encode(a, G)
+            llr = ldpc.rate_dematching(8.0*(1 - 2.0*g))
+            _, iterations, _ = ldpc.decode(llr)
+
+            transport_blocks = [self.rng.integers(0, 2, A) for _ in range(3)]
+            g_batch = encode_batch(transport_blocks, G)
+            _, passed, _ = decode_batch([8.0*(1 - 2.0*g) for g in g_batch], A)
+            self.assertTrue(passed.all())
+
+            self.assertTrue(Instrumentation.enabled())
+            report = Instrumentation.snapshot()
+
+        self.assertFalse(Instrumentation.enabled())
+        self.assertIsNone(Instrumentation.snapshot())
+
+        stages = report['stages']
+        for name, calls in (('crc', 3), ('segmentation', 2), ('parity', 2), ('rate_matching', 2), ('rate_dematching', 2), ('decode', 2)):
+            self.assertEqual(stages[name].calls, calls)
+            self.assertGreater(stages[name].seconds, 0.0)
+        self.assertEqual(stages['crc'].nbytes, 4 * A // 8 + 3 * A // 8)
+
+        self.assertEqual(sum(report['histograms']['decode_iterations'].values()), 4 * ldpc.C)
+        self.assertEqual(report['counters'], {'crc_failures' : 0})
+        self.assertGreater(report['caches']['lifted_graphs'].hits, 0)
+        self.assertIn('rate_matching_index', report['caches'])
+
+        self.assertEqual(sum(1 for event in events if event.kind == 'stage'), sum(record.calls for record in stages.values()))
+        self.assertEqual(sum(1 for event in events if event.kind == 'histogram'), 4 * ldpc.C)
+
+        # Nothing is recorded once disabled, and the collector is left as it was
+        ldpc.encode(a, G)
+        self.assertIs(stage('crc'), stage('parity'))
+        self.assertEqual(collector.snapshot()['stages']['crc'].calls, 3)
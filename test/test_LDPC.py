@@ -0,0 +1,106 @@
+### FILE: test_LDPC.py
+### AUTHOR: Salvatore Cardamone
+### DESCRIPTION: Verify the generic sparse LDPC encoder and belief propagation decoder
+
+import unittest
+from numpy import array, arange, ones, repeat, concatenate
+from numpy.random import default_rng
+from scipy.sparse import csr_matrix
+
+from FecMe.LDPC import LDPC
+
+def gf2_rank(M):
+    """Reference rank of a dense binary matrix by Gaussian elimination over GF(2).
+    """
+    M = M.copy() % 2
+    rank = 0
+    for c in range(M.shape[1]):
+        rows = [r for r in range(rank, M.shape[0]) if M[r,c]]
+        if not rows:
+            continue
+        M[[rank, rows[0]]] = M[[rows[0], rank]]
+        for r in range(M.shape[0]):
+            if r != rank and M[r,c]:
+                M[r] ^= M[rank]
+        rank += 1
+
+    return rank
+
+class TestLDPC(unittest.TestCase):
+    """Generic LDPC Unit testing.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Class constructor.
+        """
+        super(TestLDPC, self).__init__(*args, **kwargs)
+        self.rng = default_rng(2024)
+
+    def regular(self, n, dv=3, dc=6):
+        """Return a random (dv, dc)-regular PCM of length n.
+        """
+        m = n * dv // dc
+        sockets = self.rng.permutation(repeat(arange(n), dv))
+        return csr_matrix((ones((n*dv,), dtype=int), (repeat(arange(m), dc), sockets)), shape=(m, n))
+
+    def test_1(self):
+        """Test that the dimension and codewords are right for small random PCMs, including ones
+        with redundant and empty rows, and that the message lands on the information set.
+        """
+        for _ in range(100):
+            m, n = self.rng.integers(1, 12), self.rng.integers(2, 20)
+            pcm = (self.rng.random((m, n)) < 0.3).astype(int)
+            ldpc = LDPC(pcm)
+            self.assertEqual(ldpc.k, n - gf2_rank(pcm))
+
+            s = self.rng.integers(0, 2, (5, ldpc.k))
+            cw = ldpc.encode(s)
+            self.assertFalse(ldpc.syndrome(cw).any())
+            self.assertEqual(cw[:,ldpc.information_set].tolist(), s.tolist())
+
+        ldpc = LDPC(array([[1,1,1,1,0,0],[0,0,1,1,0,1],[1,0,0,1,1,0]]))
+        self.assertEqual(ldpc.encode([1,0,1]).shape, (6,))
+        with self.assertRaises(ValueError):
+            ldpc.encode([1,0])
+
+    def test_2(self):
+        """Test that every belief propagation algorithm recovers noisy codewords of a random
+        regular code, and reports those it fails to decode.
+        """
+        ldpc = LDPC(self.regular(2000))
+        cw = ldpc.encode(self.rng.integers(0, 2, (4, ldpc.k)))
+        self.assertFalse(ldpc.syndrome(cw).any())
+
+        # BPSK over AWGN
+        noise_variance = 0.36
+        llr = 2*((1 - 2.0*cw) + self.rng.normal(0, noise_variance**0.5, cw.shape)) / noise_variance
+        for algorithm in ('sumproduct', 'minsum', 'normalized', 'offset'):
+            hard, iterations, converged = ldpc.decode(llr, algorithm=algorithm)
+            self.assertEqual(hard.tolist(), cw.tolist())
+            self.assertTrue(converged.all())
+            self.assertTrue((iterations < 50).all())
+
+        _, iterations, converged = ldpc.decode(self.rng.normal(0, 1, cw.shape), max_iterations=5)
+        self.assertFalse(converged.any())
+        self.assertTrue((iterations == 5).all())
+
+    def test_3(self):
+        """Test an accumulator-based code of 10^5 columns, in the style of WiFi and DVB, whose
+        PCM has a dual-diagonal parity part.
+        """
+        k = m = 50000
+        cols = repeat(arange(k), 3)
+        rows = self.rng.integers(0, m, 3*k)
+        diagonal = concatenate((arange(m), arange(1, m)))
+        pcm = csr_matrix((ones((3*k + 2*m - 1,), dtype=int),
+                          (concatenate((rows, diagonal)), concatenate((cols, k + arange(m), k + arange(m - 1))))), shape=(m, k + m))
+
+        ldpc = LDPC(pcm)
+        self.assertEqual(ldpc.k, k)
+        self.assertIs(LDPC(pcm).encoder, ldpc.encoder)
+
+        cw = ldpc.encode(self.rng.integers(0, 2, (2, k)))
+        self.assertFalse(ldpc.syndrome(cw).any())
+        hard, _, converged = ldpc.decode(8*(1 - 2.0*cw))
+        self.assertTrue(converged.all())
+        self.assertEqual(hard.tolist(), cw.tolist())
@@ -3,10 +3,13 @@
 ### DESCRIPTION: Verify our NR LDPC implementation against golden data
 
 import unittest
-from numpy import load, array
+from numpy import load, array, empty, zeros, roll, identity, concatenate
+from numpy.random import default_rng
 
-from FecMe.CRC import checksum
-from FecMe.NRLDPC import NRLDPC
+from FecMe.CRC import checksum, check
+from FecMe.NRLDPC import NRLDPC, code_parameters, precompute_code_parameters, encode_batch, decode_batch
+from FecMe.PackedBits import pack, unpack
+from FecMe.BaseGraph import lifting_sizes, lifted_graph, cache_info, cache_clear, warm_up
 
 class TestNRLDPC(unittest.TestCase):
     """NR LDPC Unit testing.
@@ -17,6 +20,7 @@ class TestNRLDPC(unittest.TestCase):
         """
         super(TestNRLDPC, self).__init__(*args, **kwargs)
         self.test_vectors = load('test/test_NRLDPC.npz')
+        self.rng = default_rng(2024)
     
     def test_1(self):
         """Test the transport block CRC against golden data.
@@ -38,11 +42,205 @@ class TestNRLDPC(unittest.TestCase):
         test_var = self.assertEqual(seg_out.tolist(), golden_seg_out.tolist())
         
     def test_3(self):
-        """Test the NR LDPC codeword creation against golden data.
+        """Test that the NR LDPC codewords satisfy the parity checks and carry the systematic
+        and filler bits through, for both base graphs and every lifting set.
         """
-        pass
+        golden_seg_out = array([self.test_vectors['seg_out'][::2], self.test_vectors['seg_out'][1::2]])
+        ldpc = NRLDPC(len(self.test_vectors['data_in']))
+        d = ldpc.parity(golden_seg_out, verify=True)
+        self.assertEqual(d.shape, (2, 66*ldpc.Zc))
+        self.assertEqual(d[:,0:ldpc.K-2*ldpc.Zc].tolist(), golden_seg_out[:,2*ldpc.Zc:].tolist())
+
+        for BGN in (1, 2):
+            for LiftingSet, Zc in enumerate(lifting_sizes[:,1]):
+                graph = lifted_graph(BGN, LiftingSet, int(Zc))
+                cw = graph.encode(self.rng.integers(0, 2, (4, graph.kb*Zc)))
+                self.assertFalse(graph.syndrome(cw).any())
 
     def test_4(self):
-        """Test the full NR LDPC encode chain against golden data.
+        """Test rate matching against bit-serial bit selection and interleaving, and that rate
+        dematching inverts it with soft combining.
+        """
+        def rate_matching(d, E, k0, Ncb, Qm):
+            e = []
+            j = 0
+            while len(e) < E:
+                if d[(k0 + j) % Ncb] != -1:
+                    e.append(d[(k0 + j) % Ncb])
+                j += 1
+            return [e[i*E//Qm + j] for j in range(E//Qm) for i in range(Qm)]
+
+        for BGN, A in ((1, len(self.test_vectors['data_in'])), (2, 300)):
+            ldpc = NRLDPC(A, BGN)
+            a = self.rng.integers(0, 2, A)
+            d = ldpc.parity(ldpc.segmentation(concatenate((a, checksum(a, polynomial='CRC24A')))))
+            for G, Qm, rv, NL, Nref in ((9000, 2, 0, 1, None), (30000, 4, 1, 2, None), (3000, 6, 2, 1, 20000), (24000, 8, 3, 1, 8000)):
+                # Make the codeblocks' rate-matched lengths uneven
+                G = G // (NL*Qm*ldpc.C) * NL*Qm*ldpc.C + NL*Qm
+                E = ldpc.rate_matching_lengths(G, Qm, NL)
+                self.assertEqual(E.sum(), G)
+                Ncb = ldpc.circular_buffer_size(Nref)
+                k0 = ([0, 17, 33, 56] if BGN == 1 else [0, 13, 25, 43])[rv] * Ncb // ldpc.N * ldpc.Zc
+
+                g = ldpc.rate_matching(d, G, Qm=Qm, rv=rv, NL=NL, Nref=Nref)
+                golden = sum((rate_matching(d[r], E[r], k0, Ncb, Qm) for r in range(ldpc.C)), [])
+                self.assertEqual(g.tolist(), golden)
+
+                # Each transmitted bit accumulates one unit of LLR per selection
+                llr = ldpc.rate_dematching(1 - 2*g, Qm=Qm, rv=rv, NL=NL, Nref=Nref)
+                harq = ldpc.rate_dematching(1 - 2*g, Qm=Qm, rv=rv, NL=NL, Nref=Nref, out=llr.copy())
+                self.assertTrue(((llr > 0) == (d == 0))[llr != 0].all())
+                self.assertEqual(abs(llr).sum(), G)
+                self.assertTrue((harq == 2*llr).all())
+                self.assertFalse(llr[d == -1].any())
+
+        with self.assertRaises(ValueError):
+            ldpc.rate_matching_lengths(1001, 2)
+
+        with self.assertRaises(ValueError):
+            ldpc.encode(self.rng.integers(0, 2, ldpc.A), 1000, rv=4)
+
+    def test_5(self):
+        """Test that segmentation into a preallocated buffer matches the golden data and
+        reuses the buffer.
+        """
+        A = len(self.test_vectors['data_in'])
+        ldpc = NRLDPC(A)
+
+        golden_seg_out = array([self.test_vectors['seg_out'][::2], self.test_vectors['seg_out'][1::2]])
+        out = empty(golden_seg_out.shape, dtype=int)
+        seg_out = ldpc.segmentation(self.test_vectors['crc_out'], out=out)
+        self.assertIs(seg_out, out)
+        self.assertEqual(seg_out.tolist(), golden_seg_out.tolist())
+
+        with self.assertRaises(ValueError):
+            ldpc.segmentation(self.test_vectors['crc_out'][:-1])
+
+    def test_6(self):
+        """Test the sparse and index forms of the PCM against a PCM built circulant by
+        circulant, and the syndrome computed from the index form.
+        """
+        for BGN, num_circulants in ((1, 316), (2, 197)):
+            ldpc = NRLDPC(100, BGN=BGN)
+            Zc = ldpc.Zc
+            rows, cols, shifts = ldpc.PCM_index
+            self.assertEqual(len(shifts), num_circulants)
+
+            golden_pcm = zeros(ldpc.PCM_sparse.shape, dtype=int)
+            for irow, icol, shift in zip(rows, cols, shifts):
+                golden_pcm[irow*Zc:(irow+1)*Zc,icol*Zc:(icol+1)*Zc] = roll(identity(Zc, dtype=int), shift, axis=1)
+            self.assertEqual(ldpc.PCM.tolist(), golden_pcm.tolist())
+
+            cw = self.rng.integers(0, 2, (3, golden_pcm.shape[1]))
+            self.assertEqual(ldpc.graph.syndrome(cw).tolist(), ((cw @ golden_pcm.T) % 2).tolist())
+
+    def test_7(self):
+        """Test that lifted graphs are shared between instances through the process-wide cache,
+        and that warming up the cache builds all 51 lifting sizes of both base graphs.
         """
-        pass
+        cache_clear()
+        first = NRLDPC(1000).graph
+        second = NRLDPC(1000).graph
+        self.assertIs(first, second)
+        self.assertEqual(cache_info().misses, 1)
+        self.assertEqual(cache_info().hits, 1)
+
+        warm_up()
+        self.assertEqual(cache_info().currsize, 102)
+
+    def test_8(self):
+        """Test that code parameters don't depend on the order in which instances are created,
+        and that the shared parameter records can't be modified.
+        """
+        self.assertEqual((NRLDPC(10000).Zc, NRLDPC(100).Zc, NRLDPC(10000).Zc), (240, 6, 240))
+        self.assertEqual((NRLDPC(100, BGN=2).Zc, NRLDPC(100, BGN=2).K), (22, 220))
+
+        precompute_code_parameters(range(1, 2000), BGN=2)
+        params = code_parameters(1500, BGN=2)
+        self.assertIs(NRLDPC(1500, BGN=2).params, params)
+        with self.assertRaises(AttributeError):
+            params.Zc = 2
+
+    def test_9(self):
+        """Test that the packed encoding path produces the packed form of the unpacked path.
+        """
+        for BGN, A in ((1, 10000), (1, 500), (2, 3000), (2, 200)):
+            ldpc = NRLDPC(A, BGN=BGN)
+            a = self.rng.integers(0, 2, A)
+            b = concatenate((a, checksum(a, polynomial='CRC24A')))
+            c = ldpc.segmentation(b)
+            d = ldpc.parity(c)
+
+            c_packed, c_filler = ldpc.segmentation_packed(pack(b))
+            self.assertEqual(c_packed.tolist(), pack(c).tolist())
+            self.assertEqual(c_filler.tolist(), (c[0] < 0).tolist())
+
+            d_packed, d_filler = ldpc.encode_packed(pack(a))
+            self.assertEqual(d_packed.tolist(), pack(d).tolist())
+            self.assertEqual(d_filler.tolist(), (d[0] < 0).tolist())
+            self.assertEqual(unpack(d_packed, ldpc.N)[:,~d_filler].tolist(), d[:,~d_filler].tolist())
+
+    def test_10(self):
+        """Test that the layered min-sum decoder recovers noisy codeblocks of both base graphs,
+        stopping early on both syndrome and CRC, and reports blocks it fails to decode.
+        """
+        for BGN, A in ((1, 10000), (2, 1000)):
+            ldpc = NRLDPC(A, BGN=BGN)
+            a = self.rng.integers(0, 2, A)
+            c = ldpc.segmentation(concatenate((a, checksum(a, polynomial='CRC24A'))))
+            d = ldpc.parity(c)
+
+            # BPSK over AWGN at an SNR of 1dB
+            noise_variance = 10**(-0.1)
+            y = (1 - 2*(d > 0)) + self.rng.normal(0, noise_variance**0.5, d.shape)
+            llr = 2*y/noise_variance
+
+            for algorithm in ('normalized', 'offset'):
+                for early_stop in ('syndrome', 'crc'):
+                    c_hat, iterations, converged = ldpc.decode(llr, algorithm=algorithm, early_stop=early_stop)
+                    self.assertEqual(c_hat.tolist(), c.tolist())
+                    self.assertTrue(converged.all())
+                    self.assertTrue((iterations < 25).all())
+                    self.assertTrue(check(ldpc.desegmentation(c_hat), polynomial='CRC24A'))
+
+            c_packed, _, _ = ldpc.decode_packed(llr)
+            self.assertEqual(c_packed.tolist(), pack(c).tolist())
+
+            # Pure noise can't be decoded
+            _, iterations, converged = ldpc.decode(self.rng.normal(0, 1, d.shape), max_iterations=5)
+            self.assertFalse(converged.any())
+            self.assertTrue((iterations == 5).all())
+
+    def test_11(self):
+        """Test that batched encoding of a slot of transport blocks of different sizes, base
+        graphs and rate matching parameters matches encoding them one at a time, and that
+        batched decoding recovers them.
+        """
+        A = [100, 300, 10000, 500, 100, 19968]
+        BGN = [2, 2, 1, 1, 2, 1]
+        G = [1200, 2000, 24000, 3000, 1000, 40000]
+        Qm = [2, 4, 2, 6, 2, 8]
+        rv = [0, 1, 2, 3, 0, 0]
+        Nref = [None, None, None, 2000, None, None]
+        transport_blocks = [self.rng.integers(0, 2, n) for n in A]
+
+        g = encode_batch(transport_blocks, G, BGN=BGN, Qm=Qm, rv=rv, Nref=Nref)
+        for i, a in enumerate(transport_blocks):
+            golden = NRLDPC(A[i], BGN[i]).encode(a, G[i], Qm=Qm[i], rv=rv[i], Nref=Nref[i])
+            self.assertEqual(g[i].tolist(), golden.tolist())
+
+        llrs = [4.0*(1 - 2*gi.astype(int)) for gi in g]
+        llrs[1] = self.rng.normal(0, 1, G[1])
+        a_hat, passed, iterations = decode_batch(llrs, A, BGN=BGN, Qm=Qm, rv=rv, Nref=Nref, max_iterations=5)
+        self.assertEqual(passed.tolist(), [True, False, True, True, True, True])
+        self.assertEqual(iterations[1], 5)
+        for i in (0, 2, 3, 4, 5):
+            self.assertEqual(a_hat[i].tolist(), transport_blocks[i].tolist())
+
+        with self.assertRaises(ValueError):
+            encode_batch(transport_blocks, G[0:2])
+
+        # An empty slot
+        self.assertEqual(encode_batch([], 1000), [])
+        a_hat, passed, iterations = decode_batch([], 100)
+        self.assertEqual((a_hat, passed.tolist(), iterations.tolist()), ([], [], []))
@@ -0,0 +1,65 @@
+### FILE: test_ParallelDecoder.py
+### AUTHOR: Salvatore Cardamone
+### DESCRIPTION: Verify that decoding across worker processes matches decoding in-process
+
+import unittest
+from numpy import concatenate
+from numpy.random import default_rng
+
+from FecMe.CRC import checksum
+from FecMe.NRLDPC import NRLDPC
+from FecMe.ParallelDecoder import ParallelDecoder, ThreadedDecoder
+
+class TestParallelDecoder(unittest.TestCase):
+    """Parallel decoder Unit testing.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Class constructor.
+        """
+        super(TestParallelDecoder, self).__init__(*args, **kwargs)
+        self.rng = default_rng(2024)
+
+    def test_1(self):
+        """Test that the parallel decoder matches the in-process decoder across batches of
+        different sizes and codes, and accounts for every codeblock in its worker statistics.
+        """
+        with ParallelDecoder(workers=2, BGNs=(1,2)) as decoder:
+            total = 0
+            for BGN, A, copies in ((1, 10000, 3), (2, 1000, 1), (1, 10000, 1)):
+                ldpc = NRLDPC(A, BGN=BGN)
+                a = self.rng.integers(0, 2, A)
+                d = ldpc.parity(ldpc.segmentation(concatenate((a, checksum(a, polynomial='CRC24A')))))
+                d = concatenate([d] * copies)
+
+                noise_variance = 10**(-0.1)
+                llr = 2*((1 - 2*(d > 0)) + self.rng.normal(0, noise_variance**0.5, d.shape)) / noise_variance
+
+                for golden, result in zip(ldpc.decode(llr), decoder.decode(ldpc, llr)):
+                    self.assertEqual(result.tolist(), golden.tolist())
+                total += d.shape[0]
+
+            stats = decoder.stats()
+            self.assertEqual(sum(worker.codeblocks for worker in stats), total)
+            self.assertTrue(all(worker.throughput > 0 for worker in stats))
+
+            with self.assertRaises(ValueError):
+                decoder.decode(ldpc, llr[:,1:])
+
+    def test_2(self):
+        """Test that the threaded decoder matches the in-process decoder, however many threads
+        the codeblocks are split between.
+        """
+        ldpc = NRLDPC(10000, BGN=1)
+        a = self.rng.integers(0, 2, ldpc.A)
+        d = ldpc.parity(ldpc.segmentation(concatenate((a, checksum(a, polynomial='CRC24A')))))
+        d = concatenate([d] * 3)
+
+        noise_variance = 10**(-0.1)
+        llr = 2*((1 - 2*(d > 0)) + self.rng.normal(0, noise_variance**0.5, d.shape)) / noise_variance
+        golden = ldpc.decode(llr, algorithm='offset')
+
+        for workers in (1, 4, 16):
+            with ThreadedDecoder(workers=workers) as decoder:
+                for expected, result in zip(golden, decoder.decode(ldpc, llr, algorithm='offset')):
+                    self.assertEqual(result.tolist(), expected.tolist())
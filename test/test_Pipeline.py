@@ -0,0 +1,94 @@
+### FILE: test_Pipeline.py
+### AUTHOR: Salvatore Cardamone
+### DESCRIPTION: Verify the streaming transmit and receive chains against the batch API
+
+import unittest
+import threading
+from itertools import count, islice
+from numpy import concatenate
+from numpy.random import default_rng
+
+from FecMe.NRLDPC import NRLDPC
+from FecMe.Constellation import ConstellationFactory
+from FecMe.Pipeline import Pipeline, RingPool, rechunk, reframe, prefetch
+
+class TestPipeline(unittest.TestCase):
+    """Pipeline Unit testing.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Class constructor.
+        """
+        super(TestPipeline, self).__init__(*args, **kwargs)
+        self.rng = default_rng(2024)
+
+    def test_1(self):
+        """Test that rechunking and reframing a stream of arrays are inverses, and that a ring
+        pool hands out its buffers in turn.
+        """
+        arrays = [self.rng.integers(0, 100, n) for n in (5, 0, 17, 3, 40)]
+        chunks = [chunk.copy() for chunk in rechunk(arrays, 8, int)]
+        self.assertEqual([len(chunk) for chunk in chunks], [8]*8 + [1])
+        frames = list(reframe(chunks, [len(array) for array in arrays], int))
+        self.assertEqual([frame.tolist() for frame in frames], [array.tolist() for array in arrays])
+
+        with self.assertRaises(ValueError):
+            list(reframe(chunks, [70], int))
+
+        pool = RingPool(3, (4,), int)
+        buffers = [pool.next() for _ in range(4)]
+        self.assertIs(buffers[0], buffers[3])
+        self.assertIsNot(buffers[0], buffers[1])
+
+    def test_2(self):
+        """Test that the streaming chains match encoding and mapping each transport block in
+        turn, and recover the transport blocks, with and without prefetching.
+        """
+        for constellation_type, prefetch_depth in (("QPSK", 0), ("16QAM", 2)):
+            Qm = ConstellationFactory(constellation_type).Qm
+            A = [int(n) for n in self.rng.integers(100, 3000, 12)]
+            G = [int(g) // Qm * Qm for g in self.rng.integers(3000, 6000, 12)]
+            transport_blocks = [self.rng.integers(0, 2, n) for n in A]
+
+            pipeline = Pipeline(constellation_type, chunk_size=1000, batch_size=5, pool_size=4, prefetch_depth=prefetch_depth)
+            chunks = [chunk.copy() for chunk in pipeline.transmit(iter(transport_blocks), iter(G))]
+            self.assertTrue(all(len(chunk) == 1000 for chunk in chunks[:-1]))
+
+            golden = pipeline.constellation.map(concatenate([NRLDPC(a_len).encode(a, g, Qm=Qm) for a_len, a, g in zip(A, transport_blocks, G)]))
+            self.assertEqual(concatenate(chunks).tolist(), golden.tolist())
+
+            received = list(pipeline.receive(iter(chunks), iter(A), iter(G), noise_variance=0.1))
+            self.assertEqual(len(received), len(transport_blocks))
+            for (a_hat, passed, _), a in zip(received, transport_blocks):
+                self.assertTrue(passed)
+                self.assertEqual(a_hat.tolist(), a.tolist())
+
+    def test_3(self):
+        """Test that an unbounded stream is processed lazily.
+        """
+        pipeline = Pipeline("QPSK", chunk_size=500)
+        transport_blocks = (self.rng.integers(0, 2, 200) for _ in count())
+        chunks = list(islice(pipeline.transmit(transport_blocks, 1000), 10))
+        self.assertEqual(len(chunks), 10)
+
+        with self.assertRaises(ValueError):
+            Pipeline("QPSK", pool_size=2, prefetch_depth=1)
+
+    def test_4(self):
+        """Test that a prefetched stream which is closed part of the way through stops its
+        producer thread, whether it's a bare stream or the transmit chain of a pipeline.
+        """
+        threads = threading.active_count()
+
+        for _ in range(5):
+            stream = prefetch(count(), 2)
+            self.assertEqual(list(islice(stream, 3)), [0, 1, 2])
+            stream.close()
+        self.assertEqual(threading.active_count(), threads)
+
+        pipeline = Pipeline("QPSK", chunk_size=500, batch_size=2, pool_size=4, prefetch_depth=2)
+        transport_blocks = (self.rng.integers(0, 2, 1000) for _ in count())
+        chunks = pipeline.transmit(transport_blocks, 2000)
+        self.assertEqual(len(list(islice(chunks, 3))), 3)
+        chunks.close()
+        self.assertEqual(threading.active_count(), threads)
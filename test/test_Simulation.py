@@ -0,0 +1,59 @@
+### FILE: test_Simulation.py
+### AUTHOR: Salvatore Cardamone
+### DESCRIPTION: Verify that BLER simulations are reproducible across workers and checkpoints
+
+import unittest
+from tempfile import TemporaryDirectory
+
+from FecMe.Simulation import Simulation, rate_matched_length
+
+class TestSimulation(unittest.TestCase):
+    """Simulation Unit testing.
+    """
+
+    def simulation(self, **kwargs):
+        """Return a small simulation, which stops most points on their error target and the
+        rest on their block limit.
+        """
+        return Simulation([0.0, 1.0, 2.5], [500], modulations=("QPSK", "16QAM"), target_errors=10, max_blocks=96,
+                          batch_size=16, batches_per_slice=2, **kwargs)
+
+    def test_1(self):
+        """Test that a simulation gives the same tallies in-process, across worker processes and
+        when interrupted and resumed from a checkpoint, that its error rates fall with Eb/N0,
+        and that a checkpoint from a different sweep is refused.
+        """
+        # The code rate is A/G whether or not the transport block is segmented
+        for A in (500, 3000, 24000, 60000):
+            self.assertAlmostEqual(A / rate_matched_length(A, 2, 0.5), 0.5, places=2)
+
+        serial = self.simulation(workers=0)
+        results = serial.run()
+        self.assertTrue(all(tally.done for tally in serial.tallies))
+
+        qpsk = [result for result in results if result.point.modulation == "QPSK"]
+        self.assertEqual(qpsk[0].bler, 1.0)
+        self.assertLess(qpsk[2].bler, qpsk[0].bler)
+        self.assertLess(qpsk[2].ber, qpsk[1].ber)
+        self.assertEqual(qpsk[0].throughput, 0.0)
+
+        self.assertEqual(self.simulation(workers=2).run(), results)
+
+        with TemporaryDirectory() as directory:
+            path = '{0}/checkpoint.json'.format(directory)
+
+            def interrupt(index, tally):
+                if index == 2:
+                    raise KeyboardInterrupt
+
+            with self.assertRaises(KeyboardInterrupt):
+                self.simulation(workers=0, checkpoint=path).run(progress=interrupt)
+
+            resumed = self.simulation(workers=0, checkpoint=path)
+            resumed.load_checkpoint()
+            self.assertTrue(resumed.tallies[0].done)
+            self.assertFalse(resumed.tallies[2].done)
+            self.assertEqual(resumed.run(), results)
+
+            with self.assertRaises(ValueError):
+                Simulation([0.0], [500], workers=0, checkpoint=path).run()